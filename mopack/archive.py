@@ -1,11 +1,75 @@
+import shutil
 import tarfile
+import tempfile
 import zipfile
 
-__all__ = ['Archive', 'open']
+__all__ = ['Archive', 'open', 'sniff']
+
+_magic = [
+    (b'PK\x03\x04', 'zip'),
+    (b'PK\x05\x06', 'zip'),  # Empty zip file
+    (b'\x1f\x8b', 'gz'),
+    (b'BZh', 'bz2'),
+    (b'\xfd7zXZ\x00', 'xz'),
+]
+_magic_length = max(len(i) for i, _ in _magic)
+
+
+def sniff(head):
+    for magic, fmt in _magic:
+        if head.startswith(magic):
+            return fmt
+    return 'tar'
+
+
+def _parents(name):
+    bits = name.rstrip('/').split('/')[:-1]
+    return ['/'.join(bits[:i + 1]) + '/' for i in range(len(bits))]
+
+
+def _seekable(file):
+    return getattr(file, 'seekable', lambda: False)()
+
+
+class _PrefixedReader:
+    # A reader that returns some already-read bytes before continuing with the
+    # rest of a (non-seekable) file.
+
+    def __init__(self, prefix, file):
+        self._prefix = prefix
+        self._file = file
+
+    def read(self, size=-1):
+        if not self._prefix:
+            return self._file.read(size)
+
+        if size is None or size < 0:
+            data, self._prefix = self._prefix + self._file.read(), b''
+        else:
+            data, self._prefix = self._prefix[:size], self._prefix[size:]
+        return data
+
+
+def _peek(file, size):
+    if _seekable(file):
+        pos = file.tell()
+        head = file.read(size)
+        file.seek(pos)
+        return head, file
+    elif hasattr(file, 'peek'):
+        return file.peek(size)[:size], file
+
+    head = file.read(size)
+    return head, _PrefixedReader(head, file)
 
 
 class Archive:
     def __init__(self, file, mode='r:*'):
+        self._spill = None
+        if '|' in mode:
+            self._open_stream(file, *mode.split('|', 1))
+            return
+
         split_mode = mode.split(':', 1)
         if len(split_mode) == 2:
             mode, fmt = split_mode
@@ -26,12 +90,38 @@ class Archive:
         else:
             self._archive = tarfile.open(mode=full_mode, fileobj=file)
 
+    def _open_stream(self, file, mode, fmt):
+        # Open an archive for a single, sequential pass. Tarballs are read
+        # directly from `file` without ever seeking, so they can be extracted
+        # while they're still downloading. Zip files store their index at the
+        # end, so if `file` isn't seekable, we spill it to a temporary file
+        # first (rather than buffering it in memory).
+        if fmt in ('', '*'):
+            head, file = _peek(file, _magic_length)
+            fmt = sniff(head)
+
+        if fmt == 'zip':
+            if not _seekable(file):
+                self._spill = tempfile.TemporaryFile()
+                shutil.copyfileobj(file, self._spill)
+                self._spill.seek(0)
+                file = self._spill
+            self._archive = zipfile.ZipFile(file, mode)
+        else:
+            if fmt == 'tar':
+                fmt = ''
+            self._archive = tarfile.open(mode=mode + '|' + fmt, fileobj=file)
+
     def __enter__(self):
         self._archive.__enter__()
         return self
 
     def __exit__(self, type, value, traceback):
-        self._archive.__exit__(type, value, traceback)
+        try:
+            self._archive.__exit__(type, value, traceback)
+        finally:
+            if self._spill:
+                self._spill.close()
 
     def getnames(self):
         def fixdir(info):
@@ -54,6 +144,57 @@ class Archive:
             members = [i.rstrip('/') for i in members]
         return self._archive.extractall(path, members)
 
+    def extractmatching(self, path='.', match=None):
+        # Extract all the members whose names satisfy `match` (or every member
+        # if `match` is None), along with their parent directories, in a
+        # single pass. Return the names of *all* the members in the archive.
+        # Unlike `getnames()` followed by `extract()`, this works with
+        # archives opened as a stream.
+        if isinstance(self._archive, tarfile.TarFile):
+            names = []
+            # Directories we've seen but haven't extracted yet, in case they
+            # turn out to be the parent of a matching member, and parents of
+            # matching members that we haven't seen yet.
+            pending_dirs = {}
+            wanted_dirs = set()
+
+            def members():
+                for info in self._archive:
+                    name = info.name + '/' if info.isdir() else info.name
+                    names.append(name)
+                    if match is None:
+                        yield info
+                    elif name in wanted_dirs or match(name):
+                        for i in _parents(name):
+                            if i in pending_dirs:
+                                # Directories don't have any data, so we can
+                                # extract them after the fact, even from a
+                                # stream.
+                                yield pending_dirs.pop(i)
+                            else:
+                                wanted_dirs.add(i)
+                        yield info
+                    elif info.isdir():
+                        pending_dirs[name] = info
+
+            # Let `extractall` do the extraction, since it takes care of
+            # setting directory attributes once their contents are extracted.
+            self._archive.extractall(path, members())
+        else:
+            names = self._archive.namelist()
+            members = None
+            if match is not None:
+                all_names = set(names)
+                members = []
+                for i in names:
+                    if match(i):
+                        members.extend(j for j in _parents(i)
+                                       if j in all_names)
+                        members.append(i)
+                members = list(dict.fromkeys(members))
+            self._archive.extractall(path, members)
+        return names
+
 
 def open(*args, **kwargs):
     return Archive(*args, **kwargs)
@@ -1,15 +1,16 @@
 import os
 import shutil
-from pkg_resources import load_entry_point
+from contextlib import contextmanager
 
 from ..base_options import BaseOptions, OptionsHolder
 from ..freezedried import FreezeDried
+from ..plugins import load_plugin
 from ..types import FieldValueError, wrap_field_error
 
 
 def _get_builder_type(type, field='type'):
     try:
-        return load_entry_point('mopack', 'mopack.builders', type)
+        return load_plugin('mopack.builders', type)
     except ImportError:
         raise FieldValueError('unknown builder {!r}'.format(type), field)
 
@@ -33,9 +34,40 @@ class Builder(OptionsHolder):
                                                 self.name))
         return {'builddir': builddir}
 
+    def artifact_dirs(self):
+        # The path bases of the directories holding this builder's outputs;
+        # these are what get saved to and restored from the artifact cache.
+        return ('builddir',)
+
     def filter_usage(self, usage):
         return usage
 
+    def _build_env(self, metadata):
+        # If we're sharing a job budget with other builds, point the build
+        # tools to our jobserver.
+        env = self._common_options.env
+        if metadata.jobserver:
+            return metadata.jobserver.environ(env)
+        return env
+
+    @contextmanager
+    def _ninja_jobs(self, metadata):
+        # Ninja can't use our jobserver, so when sharing a job budget, take
+        # the free job slots for it (along with the one this build already
+        # holds) and yield the arguments to limit it to that many jobs.
+        if not metadata.jobserver:
+            yield []
+            return
+        with metadata.jobserver.extra_slots() as extra:
+            yield ['-j', str(extra + 1)]
+
+    def _build_kwargs(self, metadata):
+        # Extra arguments for running build commands; when sharing a job
+        # budget, the build tools need to inherit the jobserver's pipe.
+        if metadata.jobserver:
+            return {'pass_fds': metadata.jobserver.pass_fds}
+        return {}
+
     def clean(self, metadata, pkg):
         path_values = pkg.path_values(metadata, builder=self)
         shutil.rmtree(path_values['builddir'], ignore_errors=True)
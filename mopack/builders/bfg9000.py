@@ -5,7 +5,6 @@ from .. import types
 from ..environment import get_cmd
 from ..freezedried import FreezeDried
 from ..log import LogFile
-from ..path import pushd
 from ..shell import ShellArguments
 
 _known_install_types = ('prefix', 'exec-prefix', 'bindir', 'libdir',
@@ -65,20 +64,21 @@ class Bfg9000Builder(Builder):
     def build(self, metadata, pkg):
         path_values = pkg.path_values(metadata, builder=self)
 
-        env = self._common_options.env
+        env = self._build_env(metadata)
+        kwargs = self._build_kwargs(metadata)
         bfg9000 = get_cmd(env, 'BFG9000', 'bfg9000')
         ninja = get_cmd(env, 'NINJA', 'ninja')
         with LogFile.open(metadata.pkgdir, self.name) as logfile:
-            with pushd(path_values['srcdir']):
-                logfile.check_call(
-                    bfg9000 + ['configure', path_values['builddir']] +
-                    self._toolchain_args(self._this_options.toolchain) +
-                    self._install_args(self._common_options.deploy_paths) +
-                    self.extra_args.fill(**path_values),
-                    env=env
-                )
-            with pushd(path_values['builddir']):
-                logfile.check_call(ninja, env=env)
+            logfile.check_call(
+                bfg9000 + ['configure', path_values['builddir']] +
+                self._toolchain_args(self._this_options.toolchain) +
+                self._install_args(self._common_options.deploy_paths) +
+                self.extra_args.fill(**path_values),
+                env=env, cwd=path_values['srcdir'], **kwargs
+            )
+            with self._ninja_jobs(metadata) as jobs:
+                logfile.check_call(ninja + jobs, env=env,
+                                   cwd=path_values['builddir'], **kwargs)
 
     def deploy(self, metadata, pkg):
         path_values = pkg.path_values(metadata, builder=self)
@@ -87,5 +87,5 @@ class Bfg9000Builder(Builder):
         ninja = get_cmd(env, 'NINJA', 'ninja')
         with LogFile.open(metadata.pkgdir, self.name,
                           kind='deploy') as logfile:
-            with pushd(path_values['builddir']):
-                logfile.check_call(ninja + ['install'], env=env)
+            logfile.check_call(ninja + ['install'], env=env,
+                               cwd=path_values['builddir'])
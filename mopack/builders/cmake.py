@@ -1,11 +1,10 @@
-import os.path
+import os
 
 from . import Builder, BuilderOptions
 from .. import types
 from ..environment import get_cmd
 from ..freezedried import FreezeDried
 from ..log import LogFile
-from ..path import pushd
 from ..shell import ShellArguments
 
 # XXX: Handle exec-prefix, which CMake doesn't work with directly.
@@ -61,19 +60,22 @@ class CMakeBuilder(Builder):
     def build(self, metadata, pkg):
         path_values = pkg.path_values(metadata, builder=self)
 
-        env = self._common_options.env
+        env = self._build_env(metadata)
+        kwargs = self._build_kwargs(metadata)
         cmake = get_cmd(env, 'CMAKE', 'cmake')
         ninja = get_cmd(env, 'NINJA', 'ninja')
+        os.makedirs(path_values['builddir'], exist_ok=True)
         with LogFile.open(metadata.pkgdir, self.name) as logfile:
-            with pushd(path_values['builddir'], makedirs=True, exist_ok=True):
-                logfile.check_call(
-                    cmake + [path_values['srcdir'], '-G', 'Ninja'] +
-                    self._toolchain_args(self._this_options.toolchain) +
-                    self._install_args(self._common_options.deploy_paths) +
-                    self.extra_args.fill(**path_values),
-                    env=env
-                )
-                logfile.check_call(ninja, env=env)
+            logfile.check_call(
+                cmake + [path_values['srcdir'], '-G', 'Ninja'] +
+                self._toolchain_args(self._this_options.toolchain) +
+                self._install_args(self._common_options.deploy_paths) +
+                self.extra_args.fill(**path_values),
+                env=env, cwd=path_values['builddir'], **kwargs
+            )
+            with self._ninja_jobs(metadata) as jobs:
+                logfile.check_call(ninja + jobs, env=env,
+                                   cwd=path_values['builddir'], **kwargs)
 
     def deploy(self, metadata, pkg):
         path_values = pkg.path_values(metadata, builder=self)
@@ -82,5 +84,5 @@ class CMakeBuilder(Builder):
         ninja = get_cmd(env, 'NINJA', 'ninja')
         with LogFile.open(metadata.pkgdir, self.name,
                           kind='deploy') as logfile:
-            with pushd(path_values['builddir']):
-                logfile.check_call(ninja + ['install'], env=env)
+            logfile.check_call(ninja + ['install'], env=env,
+                               cwd=path_values['builddir'])
@@ -4,7 +4,6 @@ from . import Builder
 from .. import types
 from ..freezedried import FreezeDried, ListFreezeDryer
 from ..log import LogFile
-from ..path import pushd
 from ..shell import ShellArguments
 
 _known_install_types = ('prefix', 'exec-prefix', 'bindir', 'libdir',
@@ -35,28 +34,36 @@ class CustomBuilder(Builder):
         T.build_commands(cmds_type)
         T.deploy_commands(cmds_type)
 
-    def _execute(self, logfile, commands, path_values):
+    def artifact_dirs(self):
+        # Custom build commands run in the source directory, so they may put
+        # their outputs there too.
+        return ('srcdir', 'builddir')
+
+    def _execute(self, logfile, commands, path_values, cwd, env, **kwargs):
+        # Track the working directory ourselves rather than calling
+        # `os.chdir`, since other packages may be building at the same time.
         for line in commands:
             line = line.fill(**path_values)
             if line[0] == 'cd':
                 with logfile.synthetic_command(line):
                     if len(line) != 2:
                         raise RuntimeError('invalid command format')
-                    os.chdir(line[1])
+                    cwd = os.path.join(cwd, line[1])
             else:
-                logfile.check_call(line, env=self._common_options.env)
+                logfile.check_call(line, env=env, cwd=cwd, **kwargs)
 
     def build(self, metadata, pkg):
         path_values = pkg.path_values(metadata, builder=self)
 
         with LogFile.open(metadata.pkgdir, self.name) as logfile:
-            with pushd(path_values['srcdir']):
-                self._execute(logfile, self.build_commands, path_values)
+            self._execute(logfile, self.build_commands, path_values,
+                          path_values['srcdir'], self._build_env(metadata),
+                          **self._build_kwargs(metadata))
 
     def deploy(self, metadata, pkg):
         path_values = pkg.path_values(metadata, builder=self)
 
         with LogFile.open(metadata.pkgdir, self.name,
                           kind='deploy') as logfile:
-            with pushd(path_values['builddir']):
-                self._execute(logfile, self.deploy_commands, path_values)
+            self._execute(logfile, self.deploy_commands, path_values,
+                          path_values['builddir'], self._common_options.env)
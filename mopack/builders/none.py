@@ -15,6 +15,9 @@ class NoneBuilder(Builder):
     def path_values(self, metadata):
         return {}
 
+    def artifact_dirs(self):
+        return ()
+
     def clean(self, metadata, pkg):
         pass
 
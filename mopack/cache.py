@@ -0,0 +1,583 @@
+import hashlib
+import json
+import os
+import re
+import shutil
+import sys
+import tempfile
+import time
+import warnings
+from contextlib import suppress
+from urllib.request import urlopen
+
+from .exceptions import ConfigurationError
+from .platforms import platform_name
+
+__all__ = ['ArtifactCache', 'cache_dir', 'check_sha256', 'ChecksumError',
+           'DownloadCache', 'format_size', 'git_mirror_path', 'HashingReader',
+           'parse_size']
+
+_size_ex = re.compile(r'^(\d+)\s*([KMGT]?)(?:i?B)?$', re.IGNORECASE)
+_size_units = {'': 1, 'k': 1024, 'm': 1024 ** 2, 'g': 1024 ** 3,
+               't': 1024 ** 4}
+
+_chunk_size = 1024 * 1024
+_tmp_prefix = '.tmp-'
+
+# Temporary files older than this (in seconds) are assumed to have been left
+# behind by a process that died mid-download, and are removed during eviction.
+_stale_tmp_age = 24 * 60 * 60
+
+# The `FICLONE` ioctl, which makes a copy-on-write clone of a file on
+# filesystems that support it (e.g. Btrfs and XFS).
+_ficlone = 0x40049409
+
+
+class ChecksumError(ValueError):
+    pass
+
+
+def cache_dir(env):
+    # Setting `MOPACK_CACHE_DIR` to an empty string disables the cache.
+    if 'MOPACK_CACHE_DIR' in env:
+        return env['MOPACK_CACHE_DIR'] or None
+    if env.get('XDG_CACHE_HOME'):
+        return os.path.join(env['XDG_CACHE_HOME'], 'mopack')
+    if platform_name() == 'windows' and env.get('LOCALAPPDATA'):
+        return os.path.join(env['LOCALAPPDATA'], 'mopack', 'cache')
+    if env.get('HOME'):
+        return os.path.join(env['HOME'], '.cache', 'mopack')
+    return None
+
+
+def git_mirror_path(env, repository):
+    # Get the path to the local bare mirror of a git repository, or None if
+    # mirrors are disabled (they're opt-in via `MOPACK_GIT_MIRRORS`).
+    if env.get('MOPACK_GIT_MIRRORS', '') in ('', '0'):
+        return None
+    root = cache_dir(env)
+    if root is None:
+        return None
+    name = hashlib.sha256(repository.encode('utf-8')).hexdigest()
+    return os.path.join(root, 'git', name + '.git')
+
+
+def parse_size(s):
+    m = _size_ex.match(s.strip())
+    if not m:
+        raise ValueError('invalid size {!r}'.format(s))
+    return int(m.group(1)) * _size_units[m.group(2).lower()]
+
+
+def _env_size(env, name, default):
+    value = env.get(name)
+    if not value:
+        return default
+    try:
+        return parse_size(value)
+    except ValueError:
+        raise ConfigurationError('invalid ${}: {!r}'.format(name, value))
+
+
+def format_size(n):
+    for unit in ('', 'K', 'M', 'G'):
+        if n < 1024:
+            break
+        n /= 1024
+    else:
+        unit = 'T'
+    return '{}{}'.format(n if unit == '' else '{:.1f}'.format(n), unit)
+
+
+def check_sha256(digest, expected, source):
+    if expected is not None and digest != expected:
+        raise ChecksumError('SHA-256 mismatch for {}: expected {}, got {}'
+                            .format(source, expected, digest))
+
+
+def _remove(path):
+    with suppress(OSError):
+        os.remove(path)
+
+
+def _reflink(src, dst):
+    if not sys.platform.startswith('linux'):
+        raise OSError('reflinks not supported')
+
+    import fcntl
+    with open(src, 'rb') as s, open(dst, 'wb') as d:
+        try:
+            fcntl.ioctl(d.fileno(), _ficlone, s.fileno())
+        except BaseException:
+            d.close()
+            _remove(dst)
+            raise
+    shutil.copystat(src, dst)
+
+
+def _clone_file(src, dst):
+    try:
+        _reflink(src, dst)
+    except OSError:
+        shutil.copy2(src, dst)
+
+
+def _normalize_paths(paths):
+    return {k: os.path.normpath(v) for k, v in paths.items()}
+
+
+def _relocate_tree(root, relocations):
+    # Rewrite the absolute paths in `relocations` (a dict mapping old paths to
+    # new ones) wherever they appear in the text files and symlinks under
+    # `root`. Binary files are left alone, so any paths embedded in them will
+    # still refer to the old locations.
+    relocations = {os.fsencode(k): os.fsencode(v)
+                   for k, v in relocations.items()}
+    # Only match whole path components, so that e.g. `/build/foo` doesn't
+    # match the start of `/build/foobar`.
+    pattern = re.compile(b'(' + b'|'.join(
+        re.escape(i) for i in sorted(relocations, key=len, reverse=True)
+    ) + br')(?![\w.+-])')
+
+    def relocate(data):
+        return pattern.sub(lambda m: relocations[m.group(1)], data)
+
+    for dirpath, dirs, files in os.walk(os.fsencode(root)):
+        for i in dirs + files:
+            path = os.path.join(dirpath, i)
+            if os.path.islink(path):
+                target = os.readlink(path)
+                new_target = relocate(target)
+                if new_target != target:
+                    os.remove(path)
+                    os.symlink(new_target, path)
+            elif i in files:
+                with open(path, 'rb') as f:
+                    data = f.read(_chunk_size)
+                    if b'\0' in data:
+                        continue
+                    data += f.read()
+                new_data = relocate(data)
+                if new_data != data:
+                    # Write to a new file, since the restored one may be
+                    # read-only.
+                    fd, tmp = tempfile.mkstemp(dir=dirpath,
+                                               prefix=_tmp_prefix.encode())
+                    try:
+                        with os.fdopen(fd, 'wb') as f:
+                            f.write(new_data)
+                        shutil.copymode(path, tmp)
+                        os.replace(tmp, path)
+                    except BaseException:
+                        _remove(tmp)
+                        raise
+
+
+def _tree_size(path):
+    total = 0
+    for root, dirs, files in os.walk(path):
+        for i in files:
+            with suppress(OSError):
+                total += os.lstat(os.path.join(root, i)).st_size
+    return total
+
+
+class HashingReader:
+    # Wrap a binary file, computing the SHA-256 of its contents as it's read
+    # (and optionally copying them to another file). Once the file has been
+    # fully read, the digest is checked against `expected`. Exiting a `with`
+    # block normally reads any remaining data first so that the check always
+    # happens.
+
+    def __init__(self, file, expected=None, source=None, copy=None):
+        self._file = file
+        self._expected = expected
+        self._source = source
+        self._copy = copy
+        self._hash = hashlib.sha256()
+        self.digest = None
+
+    def read(self, size=-1):
+        data = self._file.read(size)
+        if data:
+            self._hash.update(data)
+            if self._copy is not None:
+                self._copy.write(data)
+        elif size != 0:
+            self._finish()
+        return data
+
+    def _finish(self):
+        if self.digest is None:
+            digest = self._hash.hexdigest()
+            check_sha256(digest, self._expected, self._source)
+            self.digest = digest
+
+    def finish(self):
+        while self.read(_chunk_size):
+            pass
+        return self.digest
+
+    def close(self):
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        try:
+            if exc_type is None:
+                self.finish()
+        finally:
+            self.close()
+
+
+class _Download(HashingReader):
+    # A download that's written to a temporary file in the cache as it's read.
+    # Once it's been fully read and verified, it's renamed into place. If we
+    # can't write to the cache (e.g. because it's on a read-only filesystem),
+    # just stream the download without caching it.
+
+    def __init__(self, cache, url, sha256, file):
+        try:
+            os.makedirs(cache._blobdir, exist_ok=True)
+            fd, self._tmp = tempfile.mkstemp(dir=cache._blobdir,
+                                             prefix=_tmp_prefix)
+            copy = os.fdopen(fd, 'wb')
+        except OSError as e:
+            warnings.warn('unable to use download cache for {!r}: {}'
+                          .format(url, e))
+            self._tmp = copy = None
+        except BaseException:
+            file.close()
+            raise
+
+        super().__init__(file, sha256, url, copy)
+        self._cache = cache
+        self._url = url
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        try:
+            if exc_type is None:
+                self.finish()
+                if self._tmp:
+                    self._copy.close()
+                    try:
+                        self._cache._add(self._url, self.digest, self._tmp)
+                        self._tmp = None
+                    except OSError as e:
+                        warnings.warn(('unable to store {!r} in download ' +
+                                       'cache: {}').format(self._url, e))
+        finally:
+            self.close()
+
+    def close(self):
+        try:
+            super().close()
+        finally:
+            if self._copy is not None:
+                self._copy.close()
+            if self._tmp:
+                _remove(self._tmp)
+                self._tmp = None
+
+
+class DownloadCache:
+    # A content-addressed store of downloaded files, shared by all mopack
+    # processes for a user. Files are stored by the SHA-256 of their contents,
+    # and each URL has an index entry pointing to the digest of the file last
+    # downloaded from it. All writes go to a temporary file which is then
+    # renamed into place, so concurrent processes never see a partial file.
+    # When the cache grows past `max_size`, the least-recently-used files are
+    # evicted.
+
+    default_max_size = 4 * 1024 ** 3
+
+    def __init__(self, path, max_size=default_max_size):
+        self.path = path
+        self.max_size = max_size
+
+    @classmethod
+    def from_env(cls, env):
+        root = cache_dir(env)
+        if root is None:
+            return None
+        max_size = _env_size(env, 'MOPACK_CACHE_SIZE', cls.default_max_size)
+        return cls(os.path.join(root, 'downloads'), max_size)
+
+    @property
+    def _blobdir(self):
+        return os.path.join(self.path, 'blobs')
+
+    @property
+    def _urldir(self):
+        return os.path.join(self.path, 'urls')
+
+    def _blob_path(self, digest):
+        return os.path.join(self._blobdir, digest)
+
+    def _index_path(self, url):
+        return os.path.join(self._urldir,
+                            hashlib.sha256(url.encode('utf-8')).hexdigest())
+
+    def lookup(self, url, sha256=None):
+        if sha256 is None:
+            try:
+                with open(self._index_path(url)) as f:
+                    sha256 = f.read().strip()
+            except OSError:
+                return None
+
+        blob = self._blob_path(sha256)
+        try:
+            f = open(blob, 'rb')
+        except OSError:
+            return None
+
+        # Bump the modification time to mark this file as recently used. If
+        # this fails (e.g. for a read-only cache), that's ok; it just makes
+        # this file more likely to be evicted.
+        with suppress(OSError):
+            os.utime(blob)
+        return f
+
+    def _write_index(self, url, digest):
+        os.makedirs(self._urldir, exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=self._urldir, prefix=_tmp_prefix)
+        try:
+            with os.fdopen(fd, 'w') as f:
+                f.write(digest)
+            os.replace(tmp, self._index_path(url))
+        except BaseException:
+            _remove(tmp)
+            raise
+
+    def _add(self, url, digest, tmp):
+        blob = self._blob_path(digest)
+        if os.path.exists(blob):
+            # Another process beat us to it; since the contents are identical,
+            # just use theirs.
+            _remove(tmp)
+        else:
+            os.replace(tmp, blob)
+        self._write_index(url, digest)
+        self.evict(keep=blob)
+
+    def open(self, url, sha256=None, opener=urlopen):
+        # Return a file object for the contents of `url`. If it's not already
+        # cached, the result streams from `opener(url)`, and the file is added
+        # to the cache when the result is closed via `__exit__` (after being
+        # read in full and verified).
+        f = self.lookup(url, sha256)
+        if f is not None:
+            return f
+        return _Download(self, url, sha256, opener(url))
+
+    def evict(self, keep=None):
+        try:
+            entries = list(os.scandir(self._blobdir))
+        except FileNotFoundError:
+            return
+
+        now = time.time()
+        blobs = []
+        for i in entries:
+            try:
+                stat = i.stat()
+            except OSError:
+                continue
+            if i.name.startswith(_tmp_prefix):
+                if now - stat.st_mtime > _stale_tmp_age:
+                    _remove(i.path)
+            elif i.path != keep:
+                blobs.append((stat.st_mtime, stat.st_size, i.path))
+            else:
+                blobs.append((float('inf'), stat.st_size, i.path))
+
+        total = sum(size for _, size, _ in blobs)
+        for _, size, path in sorted(blobs):
+            if total <= self.max_size or path == keep:
+                break
+            # If another process is evicting at the same time, or has the file
+            # open on a platform that forbids removing it, just move on.
+            _remove(path)
+            total -= size
+
+
+class ArtifactEntry:
+    def __init__(self, key, name, size, last_used):
+        self.key = key
+        self.name = name
+        self.size = size
+        self.last_used = last_used
+
+
+class ArtifactCache:
+    # A store of build outputs for source distributions, keyed by their build
+    # fingerprints. Each entry holds copies of one or more directory trees
+    # (e.g. the build directory). Entries are written to a temporary directory
+    # which is then renamed into place, so concurrent processes never see a
+    # partial entry. Restoring an entry clones its files back out of the cache
+    # where possible, and copies them otherwise; we never hardlink them, since
+    # builds can modify their outputs in place (e.g. when installing). When
+    # the cache grows past `max_size`, the least-recently used entries are
+    # evicted.
+    #
+    # Since build outputs usually refer to their source and build directories
+    # by absolute path, each entry records the paths it was built with. When
+    # restoring an entry to different paths, we rewrite them in the restored
+    # text files, so that entries can be shared between build directories.
+
+    default_max_size = 16 * 1024 ** 3
+    _info_filename = 'info.json'
+
+    def __init__(self, path, max_size=default_max_size):
+        self.path = path
+        self.max_size = max_size
+
+    @staticmethod
+    def enabled(env):
+        return env.get('MOPACK_ARTIFACT_CACHE', '') not in ('', '0')
+
+    @classmethod
+    def from_env(cls, env, force=False):
+        # The artifact cache is opt-in, since it can use a lot of disk space.
+        # Pass `force` to get the cache even if it's not enabled (e.g. to prune
+        # it).
+        root = cache_dir(env)
+        if root is None or not (force or cls.enabled(env)):
+            return None
+        max_size = _env_size(env, 'MOPACK_ARTIFACT_CACHE_SIZE',
+                             cls.default_max_size)
+        return cls(os.path.join(root, 'artifacts'), max_size)
+
+    def _entry_path(self, key):
+        return os.path.join(self.path, key)
+
+    def _info_path(self, key):
+        return os.path.join(self._entry_path(key), self._info_filename)
+
+    def _read_info(self, key):
+        info_path = self._info_path(key)
+        with open(info_path) as f:
+            info = json.load(f)
+        return info, os.stat(info_path).st_mtime
+
+    def restore(self, key, dirs, paths=None):
+        # Restore the directories stored in the entry for `key` to the paths
+        # in `dirs` (a dict mapping names to paths), replacing anything that's
+        # already there. `paths` holds all the paths the build may refer to
+        # (defaulting to `dirs`); any that differ from the ones the entry was
+        # built with are rewritten in the restored files. Return True if the
+        # entry was found.
+        paths = _normalize_paths(dirs if paths is None else paths)
+        try:
+            info, _ = self._read_info(key)
+        except (OSError, ValueError):
+            return False
+        if set(info['dirs']) != set(dirs) or 'paths' not in info:
+            return False
+
+        # Mark this entry as recently used. If this fails (e.g. for a
+        # read-only cache), that's ok; it just makes this entry more likely to
+        # be evicted.
+        with suppress(OSError):
+            os.utime(self._info_path(key))
+
+        entry = self._entry_path(key)
+        relocations = {v: paths[k] for k, v in info['paths'].items()
+                       if k in paths and paths[k] != v}
+        try:
+            for name, path in dirs.items():
+                shutil.rmtree(path, ignore_errors=True)
+                if name in info['stored']:
+                    shutil.copytree(os.path.join(entry, name), path,
+                                    symlinks=True, copy_function=_clone_file)
+                    if relocations:
+                        _relocate_tree(path, relocations)
+        except BaseException:
+            # Don't leave a partially-restored build behind.
+            for path in dirs.values():
+                shutil.rmtree(path, ignore_errors=True)
+            raise
+        return True
+
+    def store(self, key, name, dirs, paths=None):
+        # Add an entry for `key` holding copies of the directories in `dirs`
+        # (a dict mapping names to paths). Directories that don't exist are
+        # recorded as empty and will simply be removed when restoring. `paths`
+        # holds all the paths the build may refer to (defaulting to `dirs`),
+        # so that we can relocate them when restoring.
+        paths = _normalize_paths(dirs if paths is None else paths)
+        os.makedirs(self.path, exist_ok=True)
+        tmp = tempfile.mkdtemp(dir=self.path, prefix=_tmp_prefix)
+        try:
+            stored = []
+            for k, v in dirs.items():
+                if os.path.isdir(v):
+                    shutil.copytree(v, os.path.join(tmp, k), symlinks=True,
+                                    copy_function=_clone_file)
+                    stored.append(k)
+
+            with open(os.path.join(tmp, self._info_filename), 'w') as f:
+                json.dump({'name': name, 'dirs': sorted(dirs),
+                           'stored': stored, 'paths': paths,
+                           'size': _tree_size(tmp)}, f)
+
+            try:
+                os.rename(tmp, self._entry_path(key))
+            except OSError:
+                # Another process beat us to it; since the contents are
+                # equivalent, just use theirs.
+                if not os.path.exists(self._info_path(key)):
+                    raise
+                shutil.rmtree(tmp, ignore_errors=True)
+        except BaseException:
+            shutil.rmtree(tmp, ignore_errors=True)
+            raise
+        self.evict(keep=key)
+
+    def entries(self):
+        try:
+            names = os.listdir(self.path)
+        except FileNotFoundError:
+            return []
+
+        result = []
+        for i in names:
+            if i.startswith(_tmp_prefix):
+                continue
+            try:
+                info, mtime = self._read_info(i)
+            except (OSError, ValueError):
+                continue
+            result.append(ArtifactEntry(i, info['name'], info['size'], mtime))
+        return sorted(result, key=lambda i: i.last_used, reverse=True)
+
+    def remove(self, key):
+        # Remove the info file first so that nobody tries to restore this
+        # entry while we're deleting it.
+        _remove(self._info_path(key))
+        shutil.rmtree(self._entry_path(key), ignore_errors=True)
+
+    def evict(self, keep=None, max_size=None):
+        if max_size is None:
+            max_size = self.max_size
+
+        with suppress(FileNotFoundError):
+            now = time.time()
+            for i in os.scandir(self.path):
+                if i.name.startswith(_tmp_prefix):
+                    with suppress(OSError):
+                        if now - i.stat().st_mtime > _stale_tmp_age:
+                            shutil.rmtree(i.path, ignore_errors=True)
+
+        entries = self.entries()
+        total = sum(i.size for i in entries)
+        for i in reversed(entries):
+            if total <= max_size:
+                break
+            if i.key == keep:
+                continue
+            self.remove(i.key)
+            total -= i.size
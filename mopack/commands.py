@@ -1,10 +1,15 @@
+import functools
 import os
 import shutil
+import threading
 
 from . import log
 from .config import PlaceholderPackage
 from .exceptions import ConfigurationError
+from .jobserver import Jobserver
 from .metadata import Metadata
+from .scheduler import Scheduler
+from .types import dependency_string
 
 mopack_dirname = 'mopack'
 
@@ -24,35 +29,65 @@ def clean(pkgdir):
     shutil.rmtree(pkgdir)
 
 
-def _do_fetch(config, old_metadata, pkgdir):
-    child_configs = []
-    for pkg in config.packages.values():
-        # If we have a placeholder package, a parent config has a definition
-        # for it, so skip it.
-        if pkg is PlaceholderPackage:
-            continue
-
+def _fetch_package(pkg, config, old_metadata, lock):
+    # Packages with the same name can be defined by multiple child configs
+    # (so long as the definitions are identical), so make sure we don't try to
+    # fetch them into the same directory at the same time.
+    with lock:
         # Clean out the old package sources if needed.
         if pkg.name in old_metadata.packages:
             old_metadata.packages[pkg.name].clean_pre(old_metadata, pkg)
 
         # Fetch the new package and check for child mopack configs.
         try:
-            # XXX: Since this is a new package, maybe it would be more sensible
-            # to pass the *new* metadata object to it. However, in the current
-            # implementation, the new metadata object hasn't been created yet.
-            # Currently, this doesn't cause any real issues though, since the
-            # pkgdir should be the same either way, and fetch() shouldn't need
-            # any other info.
-            child_config = pkg.fetch(old_metadata, config)
+            # XXX: Since this is a new package, maybe it would be more
+            # sensible to pass the *new* metadata object to it. However, in
+            # the current implementation, the new metadata object hasn't been
+            # created yet. Currently, this doesn't cause any real issues
+            # though, since the pkgdir should be the same either way, and
+            # fetch() shouldn't need any other info.
+            return pkg.fetch(old_metadata, config)
         except Exception:
             pkg.clean_pre(old_metadata, None, quiet=True)
             raise
 
+
+def _do_fetch(config, old_metadata, scheduler, locks, on_done=None):
+    # If we have a placeholder package, a parent config has a definition for
+    # it, so skip it.
+    packages = [i for i in config.packages.values()
+                if i is not PlaceholderPackage]
+
+    # Child configs are stored by the index of their parent package so that
+    # they're always added in a deterministic order, regardless of when each
+    # fetch finishes.
+    child_configs = [None] * len(packages)
+    pending = len(packages)
+
+    def finish():
+        config.add_children([i for i in child_configs if i])
+        if on_done:
+            on_done()
+
+    def child_done():
+        nonlocal pending
+        pending -= 1
+        if pending == 0:
+            finish()
+
+    def fetched(index, child_config):
         if child_config:
-            child_configs.append(child_config)
-            _do_fetch(child_config, old_metadata, pkgdir)
-    config.add_children(child_configs)
+            child_configs[index] = child_config
+            _do_fetch(child_config, old_metadata, scheduler, locks, child_done)
+        else:
+            child_done()
+
+    if not packages:
+        finish()
+    for i, pkg in enumerate(packages):
+        lock = locks.setdefault(pkg.name, threading.Lock())
+        scheduler.submit(_fetch_package, pkg, config, old_metadata, lock,
+                         callback=functools.partial(fetched, i))
 
 
 def _fill_metadata(config, pkgdir):
@@ -64,12 +99,14 @@ def _fill_metadata(config, pkgdir):
     return metadata
 
 
-def fetch(config, pkgdir):
+def fetch(config, pkgdir, jobs=1):
     log.LogFile.clean_logs(pkgdir)
 
     old_metadata = Metadata.try_load(pkgdir)
     try:
-        _do_fetch(config, old_metadata, pkgdir)
+        scheduler = Scheduler(jobs)
+        _do_fetch(config, old_metadata, scheduler, {})
+        scheduler.run()
     except ConfigurationError:
         raise
     except Exception:
@@ -91,12 +128,77 @@ def fetch(config, pkgdir):
     return metadata
 
 
-def resolve(config, pkgdir):
+def _package_dependencies(pkg, packages):
+    # A package depends on its children (i.e. the packages defined in its own
+    # mopack.yml) and on the packages listed in its usage's dependencies.
+    deps = {i.name for i in packages.values() if i.parent == pkg.name}
+    for name, submodules in getattr(pkg.usage, 'dependencies', None) or []:
+        deps.add(name)
+    deps.discard(pkg.name)
+    return {i for i in deps if i in packages}
+
+
+def _resolve_package(pkg, metadata):
+    if metadata.jobserver is None:
+        return pkg.resolve(metadata)
+    with metadata.jobserver.slot():
+        return pkg.resolve(metadata)
+
+
+def _resolve_packages(metadata, packages, jobs):
+    packages = {i.name: i for i in packages}
+    deps = {k: _package_dependencies(v, packages) for k, v in
+            packages.items()}
+    waiting = list(packages.values())
+    running = set()
+    done = set()
+    scheduler = Scheduler(jobs)
+
+    def start(pkg):
+        waiting.remove(pkg)
+        running.add(pkg.name)
+        # Ensure metadata is up-to-date for packages that need it.
+        if pkg.needs_dependencies:
+            metadata.save()
+        scheduler.submit(_resolve_package, pkg, metadata,
+                         callback=lambda _: resolved(pkg),
+                         errback=lambda _: failed(pkg))
+
+    def start_ready():
+        if scheduler.failed:
+            return
+        for pkg in list(waiting):
+            if deps[pkg.name] <= done:
+                start(pkg)
+        if waiting and not running:
+            # Everything left has a dependency cycle, so just resolve the
+            # packages in order, like we'd do without any dependency info.
+            start(waiting[0])
+
+    def resolved(pkg):
+        running.discard(pkg.name)
+        done.add(pkg.name)
+        metadata.mark_dirty(pkg.name)
+        start_ready()
+
+    def failed(pkg):
+        running.discard(pkg.name)
+        pkg.clean_post(metadata, None, quiet=True)
+        metadata.mark_dirty(pkg.name)
+
+    start_ready()
+    scheduler.run()
+
+
+def resolve(config, pkgdir, jobs=None):
+    # If `jobs` is set, it's the budget for the total number of jobs to run at
+    # once; in addition to building that many packages in parallel, we share
+    # it with the build tools for each package via a jobserver.
     if not config:
         log.info('no inputs')
         return
 
-    metadata = fetch(config, pkgdir)
+    metadata = fetch(config, pkgdir, jobs or 1)
 
     packages, batch_packages = [], {}
     for pkg in metadata.packages.values():
@@ -111,19 +213,24 @@ def resolve(config, pkgdir):
         except Exception:
             for i in pkgs:
                 i.clean_post(metadata, None, quiet=True)
+            metadata.mark_dirty(*(i.name for i in pkgs))
             metadata.save()
             raise
+        metadata.mark_dirty(*(i.name for i in pkgs))
 
-    for pkg in packages:
-        try:
-            # Ensure metadata is up-to-date for packages that need it.
-            if pkg.needs_dependencies:
-                metadata.save()
-            pkg.resolve(metadata)
-        except Exception:
-            pkg.clean_post(metadata, None, quiet=True)
-            metadata.save()
-            raise
+    jobserver = (Jobserver(jobs) if jobs is not None and Jobserver.supported
+                 else None)
+    metadata.jobserver = jobserver
+    try:
+        _resolve_packages(metadata, packages, jobs or 1)
+    except Exception:
+        metadata.mark_dirty(*metadata.packages)
+        metadata.save()
+        raise
+    finally:
+        metadata.jobserver = None
+        if jobserver:
+            jobserver.close()
 
     metadata.save()
 
@@ -149,29 +256,101 @@ def deploy(pkgdir):
 
 
 def usage(pkgdir, name, submodules=None, strict=False):
-    metadata = Metadata.try_load(pkgdir, strict)
-    package = metadata.get_package(name)
-    return package.get_usage(metadata, submodules)
+    metadata = Metadata.try_load(pkgdir, strict, lazy=True)
+    return metadata.get_usage(name, submodules)
+
+
+def usages(pkgdir, dependencies, strict=False):
+    # Get the usage of many dependencies at once, sharing a single metadata
+    # object (and its usage cache). Each result is keyed by its dependency
+    # string; dependencies that fail produce an `error` entry rather than
+    # stopping the batch.
+    metadata = Metadata.try_load(pkgdir, strict, lazy=True)
+    results = {}
+    for name, submodules in dependencies:
+        key = dependency_string(name, submodules)
+        if key in results:
+            continue
+        try:
+            results[key] = metadata.get_usage(name, submodules)
+        except Exception as e:
+            results[key] = {'error': str(e)}
+    return results
 
 
 def list_files(pkgdir, implicit=False, strict=False):
-    metadata = Metadata.try_load(pkgdir, strict)
+    metadata = Metadata.try_load(pkgdir, strict, lazy=True)
     if implicit:
         return metadata.files + metadata.implicit_files
     return metadata.files
 
 
-def list_packages(pkgdir, flat=False):
-    metadata = Metadata.load(pkgdir)
+def list_packages(pkgdir, flat=False, jobs=None):
+    return package_tree(Metadata.load(pkgdir), flat, jobs)
+
+
+def package_versions(metadata, packages=None, jobs=None):
+    # Get the versions of many packages at once. Versions from a previous run
+    # are reused if the package hasn't changed since then; the rest are
+    # probed in bulk by each source and usage type (e.g. a single `dpkg-query`
+    # for all apt packages) and then queried concurrently.
+    if packages is None:
+        packages = list(metadata.packages.values())
+    if jobs is None:
+        jobs = os.cpu_count() or 1
+
+    cache = metadata.version_cache
+    versions = {}
+    pending = []
+    for pkg in packages:
+        try:
+            versions[pkg.name] = cache.lookup(
+                pkg.name, metadata.package_record(pkg.name)
+            )
+        except KeyError:
+            pending.append(pkg)
+    if not pending:
+        return versions
+
+    by_source = {}
+    by_usage = {}
+    for pkg in pending:
+        by_source.setdefault(type(pkg), []).append(pkg)
+        usage = getattr(pkg, 'usage', None)
+        if usage is not None:
+            by_usage.setdefault(type(usage), []).append((usage, pkg))
+
+    scheduler = Scheduler(jobs)
+    for kind, pkgs in by_source.items():
+        scheduler.submit(kind.prefetch_versions, metadata, pkgs)
+    for kind, items in by_usage.items():
+        scheduler.submit(kind.prefetch_versions, metadata, items)
+    scheduler.run()
+
+    def done(pkg, version):
+        versions[pkg.name] = version
+        cache.add(pkg.name, metadata.package_record(pkg.name), version)
+
+    for pkg in pending:
+        scheduler.submit(pkg.version, metadata,
+                         callback=functools.partial(done, pkg))
+    try:
+        scheduler.run()
+    finally:
+        cache.save()
+    return versions
+
 
+def package_tree(metadata, flat=False, jobs=None):
+    versions = package_versions(metadata, jobs=jobs)
     if flat:
-        return [PackageTreeItem(pkg, pkg.version(metadata)) for pkg in
+        return [PackageTreeItem(pkg, versions[pkg.name]) for pkg in
                 metadata.packages.values()]
 
     packages = []
     pending = {}
     for pkg in metadata.packages.values():
-        item = PackageTreeItem(pkg, pkg.version(metadata),
+        item = PackageTreeItem(pkg, versions[pkg.name],
                                pending.pop(pkg.name, None))
         if pkg.parent:
             pending.setdefault(pkg.parent, []).append(item)
@@ -2,10 +2,14 @@ import os
 import functools
 import json
 import sys
+import time
 
-from . import arguments, commands, config, log, yaml_tools
+from . import (arguments, commands, config, expression, log, server,
+               yaml_tools)
 from .app_version import version
+from .cache import ArtifactCache, format_size, parse_size
 from .environment import nested_invoke
+from .jobserver import env_jobs
 from .types import dependency
 
 logger = log.getLogger(__name__)
@@ -24,6 +28,8 @@ project (e.g. by building them).
 usage_desc = """
 Retrieve information about how to use a dependency. This returns metadata in
 YAML format (or JSON if `--json` is passed) pointing to a pkg-config .pc file.
+If multiple dependencies are passed (or `-` to read them from stdin), return a
+map of results keyed by dependency.
 """
 
 deploy_desc = """
@@ -43,6 +49,19 @@ list_packages_desc = """
 List all the package dependencies.
 """
 
+serve_desc = """
+Run a server that keeps the package metadata loaded in memory and answers
+`usage`, `list-files`, and `list-packages` queries over a Unix domain socket.
+The metadata is reloaded automatically whenever it changes.
+"""
+
+cache_desc = """
+Show the contents of the artifact cache, which stores the build outputs of
+source distributions so that they can be reused by later builds (including
+builds in other directories). Pass `--prune` to evict the least-recently-used
+entries until the cache fits within its maximum size.
+"""
+
 generate_completion_desc = """
 Generate shell-completion functions for mopack and write them to standard
 output. This requires the Python package `shtab`.
@@ -54,20 +73,62 @@ def dependency_type(s):
     return dependency(None, s)
 
 
+def positive_int(s):
+    value = int(s)
+    if value < 1:
+        raise arguments.ArgumentTypeError('expected a positive integer')
+    return value
+
+
+def size_type(s):
+    try:
+        return parse_size(s)
+    except ValueError as e:
+        raise arguments.ArgumentTypeError(str(e))
+
+
 def resolve(parser, args):
     if os.environ.get(nested_invoke):
         return 3
 
     config_data = config.Config(args.file, args.options, args.deploy_paths)
     os.environ[nested_invoke] = args.directory
-    commands.resolve(config_data, commands.get_package_dir(args.directory))
+    commands.resolve(config_data, commands.get_package_dir(args.directory),
+                     args.jobs or env_jobs(os.environ))
+
+
+def _read_dependencies(parser, args):
+    for i in args.dependency:
+        if i == ('-', None):
+            for n, line in enumerate(sys.stdin, 1):
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    yield dependency_type(line)
+                except (arguments.ArgumentTypeError, TypeError,
+                        ValueError) as e:
+                    parser.error('invalid dependency on line {} of stdin: {}'
+                                 .format(n, e))
+        else:
+            yield i
 
 
 def usage(parser, args):
     directory = os.environ.get(nested_invoke, args.directory)
+    if len(args.dependency) > 1 or args.dependency[0] == ('-', None):
+        usages = commands.usages(commands.get_package_dir(directory),
+                                 _read_dependencies(parser, args),
+                                 strict=args.strict)
+        if args.json:
+            print(json.dumps(usages))
+        else:
+            print(yaml_tools.dump(usages))
+        return 1 if any('error' in i for i in usages.values()) else 0
+
     try:
         usage = commands.usage(commands.get_package_dir(directory),
-                               *args.dependency, strict=args.strict)
+                               *args.dependency[0], strict=args.strict)
     except Exception as e:
         if not args.json:
             raise
@@ -128,7 +189,7 @@ def list_packages(parser, args):
             list_level(p.children, prefix + next_prefix)
 
     packages = commands.list_packages(commands.get_package_dir(args.directory),
-                                      args.flat)
+                                      args.flat, args.jobs)
     if args.flat:
         for p in packages:
             print(pkg_fmt.format(package=p.package, version=get_version(p)))
@@ -136,6 +197,35 @@ def list_packages(parser, args):
         list_level(packages)
 
 
+def serve(parser, args):
+    pkgdir = commands.get_package_dir(args.directory)
+    server.serve(pkgdir, args.socket, strict=args.strict)
+
+
+def cache(parser, args):
+    artifacts = ArtifactCache.from_env(os.environ, force=True)
+    if artifacts is None:
+        raise ValueError('no cache directory found')
+
+    if args.prune:
+        artifacts.evict(max_size=args.max_size)
+
+    entries = artifacts.entries()
+    if args.json:
+        print(json.dumps([{'key': i.key, 'name': i.name, 'size': i.size,
+                           'last_used': i.last_used} for i in entries]))
+    else:
+        for i in entries:
+            print('{} {:<20} {:>8}  {}'.format(
+                i.key[:12], i.name, format_size(i.size),
+                time.strftime('%Y-%m-%d %H:%M', time.localtime(i.last_used))
+            ))
+        print('total: {} of {}'.format(
+            format_size(sum(i.size for i in entries)),
+            format_size(artifacts.max_size)
+        ))
+
+
 def help(parser, args):
     parser.parse_args(args.subcommand + ['--help'])
 
@@ -197,6 +287,11 @@ def main():
                            key=['builders'], dest='options',
                            metavar='OPTION=VALUE',
                            help='additional builder options')
+    resolve_p.add_argument('-j', '--jobs', type=positive_int, metavar='N',
+                           help=('maximum number of jobs to run in ' +
+                                 'parallel, across all package builds ' +
+                                 '(default: $MOPACK_JOBS, or 1 package at ' +
+                                 'a time)'))
     resolve_p.add_argument('--strict', action=arguments.ConfigOptionAction,
                            key=['strict'], const=True, dest='options',
                            help=('return an error during usage if package ' +
@@ -216,9 +311,10 @@ def main():
                          help='display results as JSON')
     usage_p.add_argument('--strict', action='store_true',
                          help='return an error if package is not defined')
-    usage_p.add_argument('dependency', type=dependency_type,
+    usage_p.add_argument('dependency', type=dependency_type, nargs='+',
                          metavar='DEPENDENCY',
-                         help='the name of the dependency to query')
+                         help=('the name of the dependency to query (or `-` ' +
+                               'to read dependencies from stdin)'))
 
     deploy_p = subparsers.add_parser(
         'deploy', description=deploy_desc, help='deploy packages'
@@ -262,6 +358,37 @@ def main():
                                  help='directory storing local package data')
     list_packages_p.add_argument('--flat', action='store_true',
                                  help='list packages without hierarchy')
+    list_packages_p.add_argument('-j', '--jobs', type=positive_int,
+                                 metavar='N',
+                                 help=('number of package versions to query ' +
+                                       'in parallel (default: number of ' +
+                                       'CPUs)'))
+
+    serve_p = subparsers.add_parser(
+        'serve', description=serve_desc, help='run a usage query server'
+    )
+    serve_p.set_defaults(func=serve)
+    serve_p.add_argument('--directory', default='.', type=os.path.abspath,
+                         metavar='PATH', complete='directory',
+                         help='directory storing local package data')
+    serve_p.add_argument('--socket', type=os.path.abspath, metavar='PATH',
+                         complete='file',
+                         help=('path to the socket to listen on (default: ' +
+                               '`mopack/mopack.sock` in the directory)'))
+    serve_p.add_argument('--strict', action='store_true',
+                         help='return an error if package is not defined')
+
+    cache_p = subparsers.add_parser(
+        'cache', description=cache_desc, help='manage the artifact cache'
+    )
+    cache_p.set_defaults(func=cache)
+    cache_p.add_argument('--prune', action='store_true',
+                         help='evict old entries from the cache')
+    cache_p.add_argument('--max-size', type=size_type, metavar='SIZE',
+                         help=('the size to prune the cache to (default: ' +
+                               '`$MOPACK_ARTIFACT_CACHE_SIZE`)'))
+    cache_p.add_argument('--json', action='store_true',
+                         help='display results as JSON')
 
     help_p = subparsers.add_parser(
         'help', help='show this help message and exit', add_help=False
@@ -284,8 +411,15 @@ def main():
     log.init(args.color, debug=args.debug, verbose=args.verbose,
              warn_once=args.warn_once)
 
+    expr_cache = os.environ.get('MOPACK_EXPR_CACHE')
+    if expr_cache:
+        expression.load_parse_cache(expr_cache)
+
     try:
         return args.func(parser, args)
     except Exception as e:
         logger.exception(e)
         return 1
+    finally:
+        if expr_cache:
+            expression.save_parse_cache(expr_cache)
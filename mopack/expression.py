@@ -1,15 +1,48 @@
+import hashlib
+import json
 import operator
-import pyparsing as pp
+import os
+import re
+import string
+from contextlib import suppress
 from functools import reduce
-from pyparsing import ParseBaseException, ParseException
 
-pp.ParserElement.enable_packrat(512)
+from .app_version import version as _app_version
+from .path import atomic_open
 
-__all__ = ['evaluate', 'evaluate_token', 'parse', 'ParseBaseException',
-           'ParseException', 'SemanticException', 'Token']
+__all__ = ['evaluate', 'evaluate_token', 'load_parse_cache', 'parse',
+           'ParseBaseException', 'ParseException', 'save_parse_cache',
+           'SemanticException', 'Token']
 
 
-class SemanticException(pp.ParseBaseException):
+class ParseBaseException(Exception):
+    def __init__(self, pstr, loc=0, msg=None):
+        super().__init__(pstr, loc, msg)
+        self.pstr = pstr
+        self.loc = loc
+        self.msg = msg
+
+    @property
+    def lineno(self):
+        return self.pstr.count('\n', 0, self.loc) + 1
+
+    @property
+    def col(self):
+        return self.loc - self.pstr.rfind('\n', 0, self.loc)
+
+    column = col
+
+    def __str__(self):
+        return '{}  (at char {}), (line:{}, col:{})'.format(
+            self.msg, self.loc, self.lineno, self.col
+        )
+
+
+class ParseException(ParseBaseException):
+    pass
+
+
+class SemanticException(ParseBaseException):
     pass
 
 
@@ -135,93 +168,337 @@ class StringOp(Token):
         ))
 
 
-def left_assoc(operands, operator=None, index=None):
-    if index is None:
-        index = len(operands) - 1
-    if index == 0:
-        return operands[0]
-
-    if operator is None:
-        return BinaryOp(left_assoc(operands, operator, index - 2),
-                        operands[index - 1], operands[index])
-    return BinaryOp(left_assoc(operands, operator, index - 1),
-                    operator, operands[index])
-
+_whitespace = re.compile(r'[ \t\n\r]*')
+_identifier = re.compile(r'[A-Za-z_][A-Za-z0-9_]*')
+_keyword_chars = frozenset(string.ascii_letters + string.digits + '_$')
+_keywords = {'true': True, 'false': False, 'null': None}
+
+# The tokens that can start an operand and the tokens that can follow one.
+# These overlap (e.g. `-` is both negation and subtraction, and `+1` is an
+# integer literal), so the parser asks for whichever kind it expects next.
+_operand_token = re.compile(r"""
+    (?P<integer>\+?\d+) |
+    (?P<string>"[^"\n\r]*"|'[^'\n\r]*') |
+    (?P<identifier>[A-Za-z_][A-Za-z0-9_]*) |
+    (?P<punct>[!\-\[(])
+""", re.VERBOSE)
+_operator_token = re.compile(r'>=|<=|==|!=|&&|\|\||[*/%+\-<>?]')
+
+_escapes = (('\\t', '\t'), ('\\n', '\n'), ('\\f', '\f'), ('\\r', '\r'))
+
+# Binding powers for our infix operators; higher binds more tightly. Unary
+# operators and indexing bind more tightly than all of these.
+_binding_power = {
+    '*': 7, '/': 7, '%': 7,
+    '+': 6, '-': 6,
+    '>': 5, '>=': 5, '<': 5, '<=': 5,
+    '==': 4, '!=': 4,
+    '&&': 3,
+    '||': 2,
+    '?': 1,
+}
+
+
+def _unquote(s):
+    s = s[1:-1]
+    if '\\' in s:
+        for escape, char in _escapes:
+            s = s.replace(escape, char)
+    return s
+
+
+class _Parser:
+    # A Pratt parser for our expression language. Like a PEG parser, this
+    # backtracks over any operator whose operands fail to parse, ending the
+    # expression just before that operator; this lets us report errors at the
+    # same locations as the original pyparsing-based grammar.
+
+    def __init__(self, text):
+        self.text = text
+        self.pos = 0
+        # Positions where we already know the expression must end.
+        self._dead_ends = set()
+
+    def _skip(self):
+        self.pos = _whitespace.match(self.text, self.pos).end()
+        return self.pos
+
+    def _accept(self, s):
+        loc = self._skip()
+        if self.text.startswith(s, loc):
+            self.pos = loc + len(s)
+            return True
+        return False
+
+    def _expect(self, s):
+        if not self._accept(s):
+            raise ParseException(self.text, self.pos,
+                                 'Expected {!r}'.format(s))
+
+    def _expect_end(self):
+        loc = self._skip()
+        if loc != len(self.text):
+            raise ParseException(self.text, loc, 'Expected end of text')
+
+    def expression(self, min_bp=0):
+        left = self._unary()
+        while self.pos not in self._dead_ends:
+            start = self.pos
+            m = _operator_token.match(self.text, self._skip())
+            bp = _binding_power.get(m.group()) if m else None
+            if bp is None or bp < min_bp:
+                self.pos = start
+                break
+
+            self.pos = m.end()
+            try:
+                if m.group() == '?':
+                    middle = self.expression()
+                    self._expect(':')
+                    left = TernaryOp(left, '?', middle, ':',
+                                     self.expression())
+                else:
+                    left = BinaryOp(left, m.group(), self.expression(bp + 1))
+            except ParseException:
+                self.pos = start
+                self._dead_ends.add(start)
+                break
+        return left
+
+    def _unary(self):
+        loc = self._skip()
+        if self.text.startswith(('!', '-'), loc):
+            self.pos = loc + 1
+            return UnaryOp(self.text[loc], self._unary())
+        return self._operand()
+
+    def _operand(self):
+        text = self.text
+        loc = self._skip()
+        m = _operand_token.match(text, loc)
+        if not m:
+            raise ParseException(text, loc, 'Expected expression')
+        self.pos = m.end()
+
+        kind, value = m.lastgroup, m.group()
+        if kind == 'integer':
+            return Literal(int(value))
+        elif kind == 'string':
+            return Literal(_unquote(value))
+        elif kind == 'identifier':
+            following = text[self.pos:self.pos + 1]
+            if value in _keywords and following not in _keyword_chars:
+                return Literal(_keywords[value])
+            return self._index(Symbol(text, loc, value))
+        elif value == '[':
+            return self._array()
+        else:  # '('
+            result = self.expression()
+            self._expect(')')
+            return self._index(result)
+
+    def _array(self):
+        items = []
+        start = self.pos
+        try:
+            items.append(self.expression())
+            while True:
+                start = self.pos
+                if not self._accept(','):
+                    break
+                items.append(self.expression())
+        except ParseException:
+            self.pos = start
+        self._expect(']')
+        return ArrayLiteral(items)
+
+    def _index(self, left):
+        while self.pos not in self._dead_ends:
+            start = self.pos
+            try:
+                if not self._accept('['):
+                    self.pos = start
+                    break
+                index = self.expression()
+                self._expect(']')
+            except ParseException:
+                self.pos = start
+                self._dead_ends.add(start)
+                break
+            left = BinaryOp(left, '[]', index)
+        return left
+
+    def dollar(self):
+        # Parse `$$`, `$identifier`, or `${{ expression }}`.
+        text = self.text
+        loc = self._skip()
+        if text.startswith('$$', loc):
+            self.pos = loc + 2
+            return '$'
+
+        self.pos = loc + 1
+        m = _identifier.match(text, self._skip())
+        if m:
+            self.pos = m.end()
+            return Symbol(text, m.start(), m.group())
+        err_loc = self.pos
+
+        if text.startswith('${{', loc):
+            self.pos = loc + 3
+            try:
+                result = self.expression()
+                self._expect('}}')
+                return result
+            except ParseException as e:
+                err_loc = max(err_loc, e.loc)
+        raise ParseException(text, err_loc, 'Expected expression')
+
+    def if_expression(self):
+        if self.text.startswith('$', self._skip()):
+            result = self.dollar()
+        else:
+            result = self.expression()
+        self._expect_end()
+        return result
+
+    def string_expression(self):
+        text = self.text
+        result = []
+        start = 0
+        while True:
+            loc = text.find('$', start)
+            if loc == -1:
+                if start < len(text):
+                    result.append(text[start:])
+                return result
+            if loc > start:
+                result.append(text[start:loc])
+
+            self.pos = loc
+            try:
+                result.append(self.dollar())
+            except ParseException:
+                raise ParseException(text, loc, 'Expected end of text')
+            start = self.pos
 
-expr = pp.Forward()
 
-integer_literal = pp.common.signed_integer.set_parse_action(
-    lambda t: [Literal(int(t[0]))]
-)
+def evaluate_token(symbols, tok):
+    if isinstance(tok, Token):
+        return tok(symbols)
+    return tok
 
-string_literal = (
-    pp.QuotedString('"') | pp.QuotedString("'")
-).set_parse_action(lambda t: [Literal(t[0])])
 
-array_literal = (
-    pp.Suppress('[') + pp.Optional(pp.delimited_list(expr)) + pp.Suppress(']')
-).set_parse_action(lambda t: [ArrayLiteral(t.copy())])
+# A process-wide cache of parsed expressions, keyed by the expression's text
+# and whether it's in an `if` context. Tokens are never modified after parsing,
+# so it's safe to share them.
+_parse_cache = {}
+_parse_cache_dirty = False
+_parse_cache_max_size = 65536
 
-true_literal = pp.Keyword('true').set_parse_action(lambda: [Literal(True)])
-false_literal = pp.Keyword('false').set_parse_action(lambda: [Literal(False)])
-bool_literal = true_literal | false_literal
 
-null_literal = pp.Keyword('null').set_parse_action(lambda: [Literal(None)])
+def _parse(expression, if_context):
+    parser = _Parser(expression)
+    if if_context:
+        return parser.if_expression()
+    else:
+        ast = parser.string_expression()
+        if len(ast) == 0:
+            return expression
+        elif len(ast) == 1:
+            return ast[0]
+        else:
+            return StringOp(ast)
 
-literal = (integer_literal | string_literal | array_literal | bool_literal |
-           null_literal)
 
-identifier = pp.Word(pp.alphas + '_', pp.alphanums + '_').set_parse_action(
-    lambda s, loc, t: [Symbol(s, loc, t[0])]
-)
+def parse(expression, if_context=False):
+    global _parse_cache_dirty
+    key = (expression, if_context)
+    try:
+        result = _parse_cache[key]
+    except KeyError:
+        result = _parse_cache[key] = _parse(expression, if_context)
+        _parse_cache_dirty = True
+    return result
 
-pre_expr = literal | identifier | (pp.Suppress('(') + expr + pp.Suppress(')'))
 
-index = (
-    pre_expr + (pp.Suppress('[') + expr + pp.Suppress(']'))[1, ...]
-).set_parse_action(lambda t: [left_assoc(t, '[]')])
+_cache_version = None
 
-expr_atom = literal | index | identifier
-expr <<= pp.infix_notation(expr_atom, [
-    (pp.one_of('! -'), 1, pp.opAssoc.RIGHT, lambda t: [UnaryOp(*t[0])]),
-    (pp.one_of('* / %'), 2, pp.opAssoc.LEFT, lambda t: [left_assoc(t[0])]),
-    (pp.one_of('+ -'), 2, pp.opAssoc.LEFT, lambda t: [left_assoc(t[0])]),
-    (pp.one_of('> >= < <='), 2, pp.opAssoc.LEFT, lambda t: [left_assoc(t[0])]),
-    (pp.one_of('== !='), 2, pp.opAssoc.LEFT, lambda t: [left_assoc(t[0])]),
-    ('&&', 2, pp.opAssoc.LEFT, lambda t: [left_assoc(t[0])]),
-    ('||', 2, pp.opAssoc.LEFT, lambda t: [left_assoc(t[0])]),
-    (('?', ':'), 3, pp.opAssoc.RIGHT, lambda t: [TernaryOp(*t[0])]),
-])
 
-expr_holder = ('${{' + expr + '}}').set_parse_action(lambda t: t[1])
-identifier_holder = ('$' + identifier).set_parse_action(lambda t: t[1])
-escaped_dollar = pp.Literal('$$').set_parse_action(lambda: ['$'])
-dollar_expr = escaped_dollar | identifier_holder | expr_holder
+def _get_cache_version():
+    # Saved ASTs are only valid for the same parser, so key them on the
+    # contents of this file as well as mopack's version (which doesn't change
+    # when editing a development install).
+    global _cache_version
+    if _cache_version is None:
+        with open(__file__, 'rb') as f:
+            digest = hashlib.sha256(f.read()).hexdigest()
+        _cache_version = '{}:{}'.format(_app_version, digest)
+    return _cache_version
 
-bare_string = (pp.SkipTo(pp.Literal('$') | pp.StringEnd()).leave_whitespace()
-               .set_parse_action(lambda t: t if len(t[0]) else []))
 
-if_expr = dollar_expr | expr
-str_expr = bare_string + (dollar_expr + bare_string)[...]
+# Token types that can be saved in the parse cache. We store tokens as plain
+# JSON data (rather than e.g. pickling them) so that loading the cache can't
+# run arbitrary code.
+_cached_token_types = {i.__name__: i for i in (
+    Literal, ArrayLiteral, Symbol, UnaryOp, BinaryOp, TernaryOp, StringOp
+)}
 
 
-def evaluate_token(symbols, tok):
+def _dump_token(tok):
     if isinstance(tok, Token):
-        return tok(symbols)
+        result = {k: _dump_token(v) for k, v in vars(tok).items()}
+        result['type'] = type(tok).__name__
+        return result
+    elif isinstance(tok, list):
+        return [_dump_token(i) for i in tok]
     return tok
 
 
-def parse(expression, if_context=False):
-    if if_context:
-        return if_expr.parse_string(expression, parseAll=True)[0]
-    else:
-        ast = str_expr.parse_string(expression, parseAll=True)
-        if len(ast) == 0:
-            return expression
-        elif len(ast) == 1:
-            return ast[0]
-        else:
-            return StringOp(ast)
+def _load_token(data):
+    if isinstance(data, dict):
+        data = dict(data)
+        result = object.__new__(_cached_token_types[data.pop('type')])
+        result.__dict__.update({k: _load_token(v) for k, v in data.items()})
+        return result
+    elif isinstance(data, list):
+        return [_load_token(i) for i in data]
+    return data
+
+
+def load_parse_cache(path):
+    # Load previously-parsed expressions from disk. This is purely an
+    # optimization, so if anything goes wrong, just start from scratch.
+    global _parse_cache_dirty
+    try:
+        with open(path) as f:
+            data = json.load(f)
+        if data['version'] != _get_cache_version():
+            return
+        entries = {(k, c): _load_token(v) for k, c, v in data['entries']}
+    except Exception:
+        return
+
+    entries.update(_parse_cache)
+    _parse_cache.clear()
+    _parse_cache.update(entries)
+    _parse_cache_dirty = False
+
+
+def save_parse_cache(path):
+    global _parse_cache_dirty
+    if not _parse_cache_dirty:
+        return
+
+    # Keep the most-recently added entries if the cache has grown too large.
+    items = list(_parse_cache.items())[-_parse_cache_max_size:]
+    entries = [[str(k), c, _dump_token(v)] for (k, c), v in items]
+    with suppress(OSError):
+        dirname = os.path.dirname(path)
+        if dirname:
+            os.makedirs(dirname, exist_ok=True)
+        with atomic_open(path) as f:
+            json.dump({'version': _get_cache_version(), 'entries': entries}, f)
+        _parse_cache_dirty = False
 
 
 def evaluate(symbols, expression, if_context=False):
@@ -6,7 +6,7 @@ from itertools import zip_longest
 
 from .iterutils import iterate, list_view
 
-__all__ = ['filter_glob', 'Glob']
+__all__ = ['filter_glob', 'Glob', 'GlobSet']
 
 
 class Glob:
@@ -17,6 +17,7 @@ class Glob:
         if pattern == '':
             self._directory = False
             self._glob = [self._glob_run([], 0)]
+            self.prefix = ()
         else:
             bits = pattern.replace('\\', '/').split(posixpath.sep)
             self._directory = bits[-1] == ''
@@ -24,6 +25,7 @@ class Glob:
                 del bits[-1]
 
             self._glob = self._compile_glob(bits)
+            self.prefix = self._literal_prefix(bits)
 
     @classmethod
     def _is_glob(cls, s):
@@ -67,6 +69,21 @@ class Glob:
             lengths[i] += lengths[i + 1]
         return [cls._glob_run(i, j) for i, j in zip(globs, lengths)]
 
+    @classmethod
+    def _literal_prefix(cls, bits):
+        # Get the leading path components of an absolute pattern that are
+        # plain strings; any matching path must start with these.
+        if bits[0] != '':
+            return ()
+
+        prefix = []
+        for i in bits[1:]:
+            if i == '**' or cls._is_glob(i):
+                break
+            elif i:
+                prefix.append(i)
+        return tuple(prefix)
+
     @staticmethod
     def _match_string(s):
         return lambda x: x == s
@@ -129,10 +146,41 @@ class Glob:
         return is_directory if self._directory else True
 
 
+class GlobSet:
+    # A set of globs compiled into a single matcher. Absolute globs are stored
+    # in a trie keyed on their literal leading components, so matching a path
+    # only has to check the globs along that path (plus any globs with no
+    # literal prefix) instead of every glob in the set.
+
+    class _Node:
+        def __init__(self):
+            self.children = {}
+            self.globs = []
+
+    def __init__(self, patterns):
+        self._root = self._Node()
+        for i in iterate(patterns):
+            g = i if isinstance(i, Glob) else Glob(i)
+            node = self._root
+            for bit in g.prefix:
+                node = node.children.setdefault(bit, self._Node())
+            node.globs.append(g)
+
+    def _candidates(self, path):
+        node = self._root
+        yield from node.globs
+        for bit in path.replace('\\', '/').split(posixpath.sep):
+            node = node.children.get(bit)
+            if node is None:
+                return
+            yield from node.globs
+
+    def match(self, path, **kwargs):
+        return any(g.match(path, **kwargs) for g in self._candidates(path))
+
+
 def filter_glob(patterns, paths, **kwargs):
-    globs = [i if isinstance(i, Glob) else Glob(i) for i in iterate(patterns)]
+    globs = patterns if isinstance(patterns, GlobSet) else GlobSet(patterns)
     for p in paths:
-        for g in globs:
-            if g.match(p, **kwargs):
-                yield p
-                break
+        if globs.match(p, **kwargs):
+            yield p
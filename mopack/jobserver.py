@@ -0,0 +1,168 @@
+import os
+import select
+import shutil
+import tempfile
+import threading
+from collections import ChainMap
+from contextlib import contextmanager
+
+__all__ = ['env_jobs', 'Jobserver']
+
+
+def env_jobs(env):
+    # Get the global job budget from `MOPACK_JOBS`, or None if it's unset.
+    value = env.get('MOPACK_JOBS')
+    if not value:
+        return None
+    try:
+        jobs = int(value)
+    except ValueError:
+        jobs = 0
+    if jobs < 1:
+        raise ValueError(('invalid MOPACK_JOBS {!r}: expected a positive ' +
+                          'integer').format(value))
+    return jobs
+
+
+class Jobserver:
+    # A GNU make-compatible jobserver, which lets mopack share a fixed number
+    # of job slots among all the package builds it runs at once (including
+    # the jobs that `make` runs within each build). Like make, we hand out
+    # `jobs - 1` tokens via a pipe; the remaining slot is the "implicit" one
+    # that every jobserver client gets for free. Each package build holds a
+    # slot for as long as it's running, and the build tool inside it takes
+    # further tokens from the pipe for its parallel jobs.
+    #
+    # Child processes find the pipe through file descriptors that they
+    # inherit (see `pass_fds`), using the `R,W` style of `--jobserver-auth`.
+    # This is the only style that GNU make before 4.4 understands; it rejects
+    # the newer `fifo:` style outright. Tools that only support the `fifo:`
+    # style (e.g. ninja) can't join the jobserver, so instead, we take as many
+    # free tokens as we can for them up front (see `extra_slots()`) and tell
+    # them how many jobs to run.
+    #
+    # The pipe is a named one so that we can open a separate, non-blocking
+    # read end for ourselves without affecting the blocking one that our
+    # children inherit.
+
+    supported = hasattr(os, 'mkfifo')
+
+    # How long to wait for a token before checking whether the implicit slot
+    # has come free.
+    _poll_interval = 0.1
+
+    def __init__(self, jobs):
+        if jobs < 1:
+            raise ValueError('jobs must be at least 1')
+        self.jobs = jobs
+        self._lock = threading.Lock()
+        self._implicit_free = True
+
+        self._tmpdir = tempfile.mkdtemp(prefix='mopack-jobserver-')
+        fds = []
+        try:
+            path = os.path.join(self._tmpdir, 'fifo')
+            os.mkfifo(path, 0o600)
+            # Open the read ends without blocking (since there's no writer
+            # yet), and then switch our children's back to blocking mode, as
+            # make expects.
+            self._rfd = os.open(path, os.O_RDONLY | os.O_NONBLOCK)
+            fds.append(self._rfd)
+            self._child_rfd = os.open(path, os.O_RDONLY | os.O_NONBLOCK)
+            fds.append(self._child_rfd)
+            os.set_blocking(self._child_rfd, True)
+            self._wfd = os.open(path, os.O_WRONLY)
+            fds.append(self._wfd)
+            os.write(self._wfd, b'+' * (jobs - 1))
+        except BaseException:
+            for fd in fds:
+                os.close(fd)
+            shutil.rmtree(self._tmpdir, ignore_errors=True)
+            raise
+
+    @property
+    def pass_fds(self):
+        # The file descriptors that child processes need to inherit in order
+        # to use the jobserver.
+        return (self._child_rfd, self._wfd)
+
+    @property
+    def makeflags(self):
+        # Pass `--jobserver-fds` as well for the benefit of make before 4.2.
+        fds = '{},{}'.format(*self.pass_fds)
+        return '-j{} --jobserver-fds={} --jobserver-auth={}'.format(
+            self.jobs, fds, fds
+        )
+
+    def environ(self, env):
+        # Get an environment for child processes that points them to our
+        # jobserver.
+        return ChainMap({'MAKEFLAGS': self.makeflags}, env)
+
+    def _acquire(self):
+        # Take the implicit slot if it's free (returning None), or else a
+        # token from the pipe. If a child process dies while holding tokens,
+        # they're gone for good (as with make itself), so rather than blocking
+        # on the pipe, we keep checking for the implicit slot too. This way,
+        # we always make progress, even if only one package at a time.
+        while True:
+            with self._lock:
+                if self._implicit_free:
+                    self._implicit_free = False
+                    return None
+            try:
+                return os.read(self._rfd, 1)
+            except BlockingIOError:
+                select.select([self._rfd], [], [], self._poll_interval)
+
+    def _release(self, token):
+        if token is None:
+            with self._lock:
+                self._implicit_free = True
+        else:
+            os.write(self._wfd, token)
+
+    @contextmanager
+    def slot(self):
+        # Hold a job slot for the duration of this context.
+        token = self._acquire()
+        try:
+            yield
+        finally:
+            self._release(token)
+
+    @contextmanager
+    def extra_slots(self, limit=None):
+        # Take as many free tokens as we can (up to `limit`) without waiting,
+        # and hold them for the duration of this context. This yields the
+        # number of tokens we got, which is the number of jobs the caller can
+        # run in addition to the slot it already holds.
+        if limit is None:
+            limit = self.jobs - 1
+        tokens = b''
+        while len(tokens) < limit:
+            try:
+                data = os.read(self._rfd, limit - len(tokens))
+            except BlockingIOError:
+                break
+            if not data:
+                break
+            tokens += data
+
+        try:
+            yield len(tokens)
+        finally:
+            if tokens:
+                os.write(self._wfd, tokens)
+
+    def close(self):
+        os.close(self._rfd)
+        os.close(self._child_rfd)
+        os.close(self._wfd)
+        shutil.rmtree(self._tmpdir, ignore_errors=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
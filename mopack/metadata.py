@@ -1,10 +1,16 @@
+import hashlib
 import json
 import os
+from collections.abc import MutableMapping
+from contextlib import suppress
 
 from .config import Options
 from .freezedried import DictToListFreezeDryer
+from .path import atomic_open, DirectoryCache, JSONCache
+from .pkg_config import generated_pkg_config_dir
 from .sources import Package
 from .sources.system import fallback_system_package
+from .types import dependency_string
 from .yaml_tools import MarkedJSONEncoder
 
 
@@ -12,10 +18,105 @@ class MetadataVersionError(RuntimeError):
     pass
 
 
+class DependencyCycleError(ValueError):
+    pass
+
+
+class LazyPackages(MutableMapping):
+    # A dict of packages that calls `load(name, record)` to get each package
+    # the first time it's accessed.
+
+    class _Unloaded:
+        def __init__(self, record):
+            self.record = record
+
+    def __init__(self, load, records):
+        self._load = load
+        self._packages = {k: self._Unloaded(v) for k, v in records.items()}
+
+    def __getitem__(self, key):
+        pkg = self._packages[key]
+        if isinstance(pkg, self._Unloaded):
+            pkg = self._packages[key] = self._load(key, pkg.record)
+        return pkg
+
+    def __contains__(self, key):
+        return key in self._packages
+
+    def __setitem__(self, key, value):
+        self._packages[key] = value
+
+    def __delitem__(self, key):
+        del self._packages[key]
+
+    def __iter__(self):
+        return iter(self._packages)
+
+    def __len__(self):
+        return len(self._packages)
+
+    @property
+    def loaded(self):
+        return [k for k, v in self._packages.items()
+                if not isinstance(v, self._Unloaded)]
+
+
+class VersionCache(JSONCache):
+    # Getting a package's version usually means running some external tool,
+    # which can be slow, so save the results to disk. Each entry is tied to
+    # the record of the package it came from, and the whole cache is thrown
+    # away whenever the metadata is saved (e.g. by `mopack resolve`), since
+    # resolving can change the installed versions even if the package records
+    # are unchanged.
+
+    version = 1
+
+    def __init__(self, path=None):
+        self._versions = {}
+        super().__init__(path)
+
+    def _rehydrate(self, data):
+        self._versions = {k: (v['record'], v['version'])
+                          for k, v in data['packages'].items()}
+
+    def _dehydrate(self):
+        # Entries for packages without a saved record can't be validated
+        # later, so only keep them in memory.
+        return {'packages': {
+            k: {'record': record, 'version': version}
+            for k, (record, version) in self._versions.items()
+            if record is not None
+        }}
+
+    def lookup(self, name, record):
+        entry = self._versions.get(name)
+        if entry is None or entry[0] != record:
+            raise KeyError(name)
+        return entry[1]
+
+    def add(self, name, record, version):
+        self._versions[name] = (record, version)
+        self._dirty = True
+
+
 class Metadata:
+    # Metadata is stored as a small manifest (`mopack.json`) along with a set
+    # of records in the `metadata/` directory: one for the options and one for
+    # each package. Records are named by the hash of their contents, so saving
+    # only needs to write the records that have changed, and then atomically
+    # replace the manifest to point to them. (Version 1 of the metadata stored
+    # everything in `mopack.json`; we can still load that.)
+    #
+    # We also keep each package's serialized record in memory, so that saving
+    # only needs to re-serialize packages that have been added or marked as
+    # changed via `mark_dirty()` since the last save.
+
     _PackagesFD = DictToListFreezeDryer(Package, lambda x: x.name)
     metadata_filename = 'mopack.json'
-    version = 1
+    records_dirname = 'metadata'
+    dir_cache_filename = '.dircache.json'
+    version_cache_filename = '.versions.json'
+    version = 2
 
     def __init__(self, pkgdir, options=None, files=None, implicit_files=None):
         self.pkgdir = pkgdir
@@ -23,13 +124,67 @@ class Metadata:
         self.files = files or []
         self.implicit_files = implicit_files or []
         self.packages = {}
+        self._records = {}
+        self._reset_serialized()
+        self._dir_cache = None
+        self.jobserver = None
+        self._reset_usages()
+        self._reset_versions()
 
     @property
     def path(self):
         return os.path.join(self.pkgdir, self.metadata_filename)
 
+    @property
+    def dir_cache(self):
+        # Directory listings used to find headers and libraries, saved next to
+        # the generated pkg-config files.
+        if self._dir_cache is None:
+            self._dir_cache = DirectoryCache(os.path.join(
+                generated_pkg_config_dir(self.pkgdir), self.dir_cache_filename
+            ))
+        return self._dir_cache
+
+    @property
+    def version_cache(self):
+        if self._version_cache is None:
+            self._version_cache = VersionCache(os.path.join(
+                self.pkgdir, self.version_cache_filename
+            ))
+        return self._version_cache
+
+    def package_record(self, name):
+        # The name of the saved record for a package, if any.
+        return self._records.get(name)
+
+    @property
+    def _records_dir(self):
+        return os.path.join(self.pkgdir, self.records_dirname)
+
+    def _reset_serialized(self):
+        self._serialized = {}
+        self._dirty = set()
+
+    def _reset_usages(self):
+        self._usages = {}
+        self._pending_usages = []
+
+    def _reset_versions(self):
+        self._version_cache = None
+        # The results of probing external tools for versions in bulk, used to
+        # answer individual packages' version queries; see
+        # `commands.package_versions()`.
+        self.version_probes = {}
+
     def add_package(self, package):
         self.packages[package.name] = package
+        self._dirty.add(package.name)
+        self._reset_usages()
+
+    def mark_dirty(self, *names):
+        # Note that the named packages have changed, so that the next save
+        # will write them out again.
+        self._dirty.update(names)
 
     def get_package(self, name):
         if name in self.packages:
@@ -44,9 +199,64 @@ class Metadata:
                              .format(name))
         return package
 
+    def get_usage(self, name, submodules=None):
+        # Get the usage for a dependency, caching the result so that packages
+        # depended upon by many others (e.g. via diamond-shaped dependency
+        # graphs) are only processed once. While a dependency's usage is being
+        # computed, it's marked as pending so that we can detect cycles instead
+        # of recursing forever.
+        key = (name, tuple(submodules) if submodules else None)
+        if key in self._usages:
+            return self._usages[key]
+        if key in self._pending_usages:
+            cycle = self._pending_usages[self._pending_usages.index(key):]
+            raise DependencyCycleError('dependency cycle: {}'.format(
+                ' -> '.join(dependency_string(*i) for i in cycle + [key])
+            ))
+
+        self._pending_usages.append(key)
+        try:
+            usage = self.get_package(name).get_usage(self, submodules)
+        finally:
+            self._pending_usages.pop()
+            if not self._pending_usages and self._dir_cache:
+                self._dir_cache.save()
+        self._usages[key] = usage
+        return usage
+
     def save(self):
-        os.makedirs(self.pkgdir, exist_ok=True)
-        with open(os.path.join(self.path), 'w') as f:
+        os.makedirs(self._records_dir, exist_ok=True)
+        existing = set(os.listdir(self._records_dir))
+        records = set()
+
+        def serialize(data):
+            text = json.dumps(data, cls=MarkedJSONEncoder)
+            name = (hashlib.sha256(text.encode('utf-8')).hexdigest()[:32] +
+                    '.json')
+            return name, text
+
+        def write_record(name, text):
+            if name not in existing and name not in records:
+                with atomic_open(os.path.join(self._records_dir, name)) as f:
+                    f.write(text)
+            records.add(name)
+            return name
+
+        def package_record(name, pkg):
+            cached = self._serialized.get(name)
+            if cached is None or cached[0] is not pkg or name in self._dirty:
+                cached = self._serialized[name] = (pkg,) + serialize(
+                    pkg.dehydrate()
+                )
+            return write_record(*cached[1:])
+
+        options = write_record(*serialize(self.options.dehydrate()))
+        packages = {k: package_record(k, v) for k, v in self.packages.items()}
+        for i in set(self._serialized) - set(packages):
+            del self._serialized[i]
+        self._dirty.clear()
+
+        with atomic_open(self.path) as f:
             json.dump({
                 'version': self.version,
                 'config_files': {
@@ -54,41 +264,109 @@ class Metadata:
                     'implicit': self.implicit_files,
                 },
                 'metadata': {
-                    'options': self.options.dehydrate(),
-                    'packages': self._PackagesFD.dehydrate(self.packages),
+                    'options': options,
+                    'packages': packages,
                 }
-            }, f, cls=MarkedJSONEncoder)
+            }, f)
+
+        # Clean up any records that the manifest no longer refers to.
+        for i in existing - records:
+            if not i.startswith('.'):
+                with suppress(OSError):
+                    os.remove(os.path.join(self._records_dir, i))
+
+        self._records = packages
+        self._reset_versions()
+        with suppress(OSError):
+            os.remove(os.path.join(self.pkgdir, self.version_cache_filename))
 
     @classmethod
-    def load(cls, pkgdir, strict=False):
+    def _read_state(cls, pkgdir):
         with open(os.path.join(pkgdir, cls.metadata_filename)) as f:
             state = json.load(f)
-            version, data = state['version'], state['metadata']
+        version = state['version']
         if version > cls.version:
             raise MetadataVersionError(
                 'saved version {} exceeds expected version {}'
                 .format(version, cls.version)
             )
+        return state
+
+    @classmethod
+    def _read_record(cls, pkgdir, name):
+        with open(os.path.join(pkgdir, cls.records_dirname, name)) as f:
+            return json.load(f)
+
+    @classmethod
+    def _read_records(cls, pkgdir, data):
+        return (cls._read_record(pkgdir, data['options']),
+                [cls._read_record(pkgdir, i)
+                 for i in data['packages'].values()])
+
+    def _load_package(self, name, record):
+        try:
+            data = self._read_record(self.pkgdir, record)
+        except FileNotFoundError:
+            # The metadata has been saved again since we read the manifest, so
+            # look up the package's current record.
+            state = self._read_state(self.pkgdir)
+            data = self._read_record(self.pkgdir,
+                                     state['metadata']['packages'][name])
+        return Package.rehydrate(data, _options=self.options)
+
+    @classmethod
+    def load(cls, pkgdir, strict=False, lazy=False):
+        # If `lazy` is true, only read the manifest and options up front, and
+        # rehydrate each package the first time it's accessed. This is useful
+        # when we only care about a handful of packages, e.g. for `usage`.
+        # Version 1 metadata is always loaded eagerly.
+        state = cls._read_state(pkgdir)
+        data = state['metadata']
+        lazy = lazy and state['version'] > 1
+        if state['version'] == 1:
+            options, packages = data['options'], data['packages']
+        elif lazy:
+            options = cls._read_record(pkgdir, data['options'])
+        else:
+            try:
+                options, packages = cls._read_records(pkgdir, data)
+            except FileNotFoundError:
+                # Another process may have saved new metadata (and removed the
+                # old records) while we were reading. Try again once.
+                state = cls._read_state(pkgdir)
+                options, packages = cls._read_records(pkgdir,
+                                                      state['metadata'])
 
         metadata = Metadata.__new__(Metadata)
         metadata.pkgdir = pkgdir
         metadata.files = state['config_files']['explicit']
         metadata.implicit_files = state['config_files']['implicit']
+        metadata._records = (state['metadata']['packages']
+                             if state['version'] > 1 else {})
+        metadata._reset_serialized()
+        metadata._dir_cache = None
+        metadata.jobserver = None
+        metadata._reset_usages()
+        metadata._reset_versions()
 
-        metadata.options = Options.rehydrate(data['options'])
+        metadata.options = Options.rehydrate(options)
         if strict:
             metadata.options.common.strict = True
 
-        metadata.packages = cls._PackagesFD.rehydrate(
-            data['packages'], _options=metadata.options
-        )
+        if lazy:
+            metadata.packages = LazyPackages(metadata._load_package,
+                                             data['packages'])
+        else:
+            metadata.packages = cls._PackagesFD.rehydrate(
+                packages, _options=metadata.options
+            )
 
         return metadata
 
     @classmethod
-    def try_load(cls, pkgdir, strict=False):
+    def try_load(cls, pkgdir, strict=False, lazy=False):
         try:
-            return Metadata.load(pkgdir, strict)
+            return Metadata.load(pkgdir, strict, lazy)
         except FileNotFoundError:
             if strict:
                 raise
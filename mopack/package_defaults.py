@@ -1,19 +1,25 @@
 import os
+import pickle
 import re
+from contextlib import suppress
 from copy import deepcopy
-from pkg_resources import resource_filename
 from yaml.error import MarkedYAMLError
 
 from . import expression as expr, iterutils, types
+from .app_version import version as _app_version
 from .objutils import memoize
-from .yaml_tools import load_file, SafeLineLoader
+from .path import atomic_open
+from .yaml_tools import load_file, FastSafeLineLoader
+
+_defaults_dir = os.path.join(os.path.dirname(__file__), 'defaults')
+_bundle_path = os.path.join(_defaults_dir, 'bundle.pickle')
 
 
 class DefaultConfig:
     _known_genera = {'source', 'usage'}
 
     def __init__(self, filename):
-        with load_file(filename, Loader=SafeLineLoader) as cfg:
+        with load_file(filename, Loader=FastSafeLineLoader) as cfg:
             # Store both a raw and parsed copy of the configuration data.
             # Parsing first helps catch syntax errors and should be faster in
             # some cases, but we still want the raw data for some cases, like
@@ -116,12 +122,66 @@ class DefaultConfig:
             return fields.get(field, default)
 
 
+def _defaults_stamp(defaults_dir):
+    # The bundle holds pickled mopack objects, so it's only valid for the
+    # version of mopack that created it. To check that the default files
+    # haven't changed since then without reading them all, compare their
+    # names and sizes. (Modification times aren't preserved when installing
+    # from a wheel, so we can't rely on those.)
+    return [_app_version, sorted(
+        (i.name, i.stat().st_size) for i in os.scandir(defaults_dir)
+        if i.name.endswith('.yml')
+    )]
+
+
+def compile_bundle(defaults_dir=_defaults_dir):
+    # Pickle each config separately so that we only need to unpickle the ones
+    # we actually use.
+    return {
+        'stamp': _defaults_stamp(defaults_dir),
+        'configs': {
+            name[:-4]: pickle.dumps(
+                DefaultConfig(os.path.join(defaults_dir, name))
+            ) for name in os.listdir(defaults_dir) if name.endswith('.yml')
+        },
+    }
+
+
+def save_bundle(path=_bundle_path, defaults_dir=_defaults_dir):
+    bundle = compile_bundle(defaults_dir)
+    with atomic_open(path, 'wb') as f:
+        pickle.dump(bundle, f)
+    return bundle
+
+
+@memoize
+def _load_bundle():
+    # Load all of the default configs, already parsed, from the bundle built
+    # when mopack was installed (see `BuildPy` in `setup.py`). The bundle is
+    # part of the installed package, just like our modules, so we trust it
+    # as much as them; we never write it at runtime. If it's missing or out
+    # of date (e.g. in a development checkout), return None so that we load
+    # each default file on demand instead.
+    with suppress(Exception):
+        with open(_bundle_path, 'rb') as f:
+            bundle = pickle.load(f)
+        if bundle['stamp'] == _defaults_stamp(_defaults_dir):
+            return bundle['configs']
+    return None
+
+
 @memoize
 def _get_default_config(package_name):
     if re.search(r'\W', package_name):
         return None
 
-    path = resource_filename('mopack', 'defaults/{}.yml'.format(package_name))
+    bundle = _load_bundle()
+    if bundle is not None:
+        if package_name in bundle:
+            return pickle.loads(bundle[package_name])
+        return None
+
+    path = os.path.join(_defaults_dir, '{}.yml'.format(package_name))
     if os.path.exists(path):
         return DefaultConfig(path)
     return None
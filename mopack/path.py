@@ -1,13 +1,18 @@
 import functools
+import json
 import os
-from contextlib import contextmanager
+import secrets
+import time
+from contextlib import contextmanager, suppress
 from enum import Enum
 
 from .freezedried import FreezeDried
 from .iterutils import ismapping
 from .placeholder import PlaceholderString
+from .platforms import platform_name
 
-__all__ = ['file_outdated', 'Path', 'pushd']
+__all__ = ['atomic_open', 'DirectoryCache', 'file_outdated', 'JSONCache',
+           'Path', 'pushd']
 
 
 @contextmanager
@@ -23,6 +28,24 @@ def pushd(dirname, makedirs=False, mode=0o777, exist_ok=False):
         os.chdir(old)
 
 
+@contextmanager
+def atomic_open(path, mode='w', **kwargs):
+    # Write to a temporary file next to `path` and then rename it into place,
+    # so that readers only ever see the old file or the complete new one.
+    dirname, basename = os.path.split(path)
+    tmp = os.path.join(dirname, '.tmp-{}-{}'.format(
+        secrets.token_hex(4), basename
+    ))
+    try:
+        with open(tmp, mode.replace('w', 'x'), **kwargs) as f:
+            yield f
+        os.replace(tmp, path)
+    except BaseException:
+        with suppress(OSError):
+            os.remove(tmp)
+        raise
+
+
 def file_outdated(path, compare_path, default=True):
     try:
         basetime = os.path.getmtime(compare_path)
@@ -50,6 +73,133 @@ isfile = _wrap_ospath(os.path.isfile)
 islink = _wrap_ospath(os.path.islink)
 
 
+class JSONCache:
+    # A cache that can be saved to disk as JSON so that later processes can
+    # reuse its contents. Subclasses convert their contents to and from JSON
+    # in `_dehydrate()` and `_rehydrate()`, and set `_dirty` whenever their
+    # contents change. The cache is just an optimization, so if we can't load
+    # or save it, that's ok.
+
+    version = 1
+
+    def __init__(self, path=None):
+        self.path = path
+        self._dirty = False
+        if path:
+            self._load()
+
+    def _load(self):
+        try:
+            with open(self.path) as f:
+                data = json.load(f)
+            if data['version'] == self.version:
+                self._rehydrate(data)
+        except (OSError, ValueError, KeyError, TypeError):
+            pass
+
+    def _rehydrate(self, data):
+        raise NotImplementedError()
+
+    def _dehydrate(self):
+        raise NotImplementedError()
+
+    def save(self):
+        if not self.path or not self._dirty:
+            return
+
+        with suppress(OSError):
+            dirname = os.path.dirname(self.path)
+            if dirname:
+                os.makedirs(dirname, exist_ok=True)
+            with atomic_open(self.path) as f:
+                json.dump(dict(version=self.version, **self._dehydrate()), f)
+            self._dirty = False
+
+
+class DirectoryCache(JSONCache):
+    # Answer file-existence probes by listing each directory once with
+    # `os.scandir` rather than stat-ing every candidate file. Listings can be
+    # saved to disk; each one is revalidated against its directory's mtime the
+    # first time it's used in a process.
+
+    version = 1
+
+    # If a directory was modified this recently (in seconds) before we listed
+    # it, another change in the same mtime tick could go unnoticed, so don't
+    # save its listing to disk.
+    _racy_window = 2
+
+    def __init__(self, path=None):
+        self._listings = {}
+        self._validated = set()
+        self._racy = set()
+        self._casefold = platform_name() in ('windows', 'cygwin', 'darwin')
+        super().__init__(path)
+
+    def _rehydrate(self, data):
+        self._listings = {
+            k: (v['mtime'], set(v['files']) if v['files'] is not None
+                else None)
+            for k, v in data['directories'].items()
+        }
+
+    @staticmethod
+    def _mtime(dirname):
+        try:
+            return os.stat(dirname).st_mtime_ns
+        except (FileNotFoundError, NotADirectoryError):
+            return None
+
+    def _scan(self, dirname):
+        mtime = self._mtime(dirname)
+        if mtime is None:
+            return None, None
+        if time.time() - mtime / 10 ** 9 < self._racy_window:
+            self._racy.add(dirname)
+
+        files = set()
+        try:
+            with os.scandir(dirname) as entries:
+                for i in entries:
+                    try:
+                        if i.is_file():
+                            files.add(i.name.casefold() if self._casefold
+                                      else i.name)
+                    except OSError:
+                        pass
+        except (FileNotFoundError, NotADirectoryError):
+            return None, None
+        return mtime, files
+
+    def _listing(self, dirname):
+        if dirname not in self._validated:
+            listing = self._listings.get(dirname)
+            if listing is None or listing[0] != self._mtime(dirname):
+                self._listings[dirname] = self._scan(dirname)
+                self._dirty = True
+            self._validated.add(dirname)
+        return self._listings[dirname][1]
+
+    def isfile(self, path, variables={}):
+        if isinstance(path, Path):
+            path = path.string(**variables)
+        dirname, basename = os.path.split(os.path.normpath(
+            os.path.abspath(path)
+        ))
+        files = self._listing(dirname)
+        if files is None:
+            return False
+        return (basename.casefold() if self._casefold else basename) in files
+
+    def _dehydrate(self):
+        return {'directories': {
+            k: {'mtime': mtime,
+                'files': None if files is None else sorted(files)}
+            for k, (mtime, files) in self._listings.items()
+            if k not in self._racy
+        }}
+
+
 class Path(FreezeDried):
     class Base(Enum):
         absolute = 0
@@ -1,6 +1,9 @@
 import os
+import re
+import subprocess
 
-from .iterutils import issequence
+from .environment import get_pkg_config, subprocess_run
+from .iterutils import issequence, uniques
 from .path import Path
 from .shell import quote_native, ShellArguments
 
@@ -34,15 +37,90 @@ def _write_field(out, name, value, var_symbols={}, required=False):
     return False
 
 
+_fingerprint_ex = re.compile(r'^# mopack-fingerprint: (\w+)$')
+
+
 def generated_pkg_config_dir(pkgdir):
     return os.path.join(pkgdir, 'pkgconfig')
 
 
+def read_fingerprint(path):
+    # Get the fingerprint of the inputs used to generate a .pc file, or None if
+    # the file doesn't exist or wasn't generated with a fingerprint.
+    try:
+        with open(path) as f:
+            for line, _ in zip(f, range(3)):
+                m = _fingerprint_ex.match(line.rstrip('\n'))
+                if m:
+                    return m.group(1)
+    except FileNotFoundError:
+        pass
+    return None
+
+
+def version_probe_key(env, pcname):
+    return ('pkg-config', env.get('PKG_CONFIG_PATH'), pcname)
+
+
+def _modversions(pkg_config, pcnames, env):
+    try:
+        result = subprocess_run(
+            pkg_config + ['--modversion'] + pcnames, stdout=subprocess.PIPE,
+            stderr=subprocess.DEVNULL, universal_newlines=True, env=env
+        )
+    except OSError:
+        return None
+    versions = result.stdout.splitlines()
+    if result.returncode != 0 or len(versions) != len(pcnames):
+        return None
+    return dict(zip(pcnames, (i.strip() for i in versions)))
+
+
+def probe_versions(metadata, queries):
+    # Get the versions of many pkg-config packages at once, storing them in
+    # `metadata.version_probes`. `queries` is a list of `(env, pcname)` pairs;
+    # we run `pkg-config --modversion` once for each distinct
+    # `PKG_CONFIG_PATH`. Any packages we can't find are simply skipped, leaving
+    # them to be queried individually as usual.
+    groups = {}
+    for env, pcname in queries:
+        if pcname is not None:
+            group = groups.setdefault(env.get('PKG_CONFIG_PATH'), (env, []))
+            group[1].append(pcname)
+
+    for env, pcnames in groups.values():
+        pkg_config = get_pkg_config(env)
+        pcnames = uniques(pcnames)
+        versions = _modversions(pkg_config, pcnames, env)
+        if versions is None and len(pcnames) > 1:
+            # pkg-config fails if *any* of the packages is missing, so filter
+            # out the ones it doesn't know about and try again.
+            try:
+                available = subprocess_run(
+                    pkg_config + ['--list-all'], stdout=subprocess.PIPE,
+                    stderr=subprocess.DEVNULL, universal_newlines=True,
+                    env=env
+                ).stdout
+            except OSError:
+                continue
+            available = {i.split(None, 1)[0] for i in available.splitlines()
+                         if i.strip()}
+            pcnames = [i for i in pcnames if i in available]
+            if pcnames:
+                versions = _modversions(pkg_config, pcnames, env)
+
+        for pcname, version in (versions or {}).items():
+            metadata.version_probes[version_probe_key(env, pcname)] = version
+
+
 def write_pkg_config(out, name, *, desc='mopack-generated package',
                      version=None, requires=None, cflags=None, libs=None,
-                     variables={}):
+                     variables={}, fingerprint=None):
     out.write('# Do not edit this file! It was automatically generated by ' +
-              'mopack.\n\n')
+              'mopack.\n')
+    if fingerprint:
+        out.write('# mopack-fingerprint: {}\n'.format(fingerprint))
+    out.write('\n')
 
     wrote_var = False
     for k, v in variables.items():
@@ -0,0 +1,76 @@
+import importlib
+
+__all__ = ['builtin_plugins', 'load_plugin']
+
+# The plugins that ship with mopack. Looking these up directly lets us avoid
+# scanning every installed distribution's entry points (which can be quite
+# slow) for the common case. Keep this in sync with `entry_points` in
+# `setup.py`.
+builtin_plugins = {
+    'mopack.sources': {
+        'apt': 'mopack.sources.apt:AptPackage',
+        'conan': 'mopack.sources.conan:ConanPackage',
+        'directory': 'mopack.sources.sdist:DirectoryPackage',
+        'git': 'mopack.sources.sdist:GitPackage',
+        'system': 'mopack.sources.system:SystemPackage',
+        'tarball': 'mopack.sources.sdist:TarballPackage',
+    },
+    'mopack.builders': {
+        'bfg9000': 'mopack.builders.bfg9000:Bfg9000Builder',
+        'cmake': 'mopack.builders.cmake:CMakeBuilder',
+        'custom': 'mopack.builders.custom:CustomBuilder',
+        'none': 'mopack.builders.none:NoneBuilder',
+    },
+    'mopack.usage': {
+        'path': 'mopack.usage.path_system:PathUsage',
+        'pkg_config': 'mopack.usage.pkg_config:PkgConfigUsage',
+        'system': 'mopack.usage.path_system:SystemUsage',
+    },
+}
+
+_entry_point_index = {}
+
+
+def _find_entry_points(group):
+    # Only import this when we need it, since it's slow to import and most
+    # runs of mopack only use built-in plugins.
+    try:
+        from importlib.metadata import entry_points
+    except ImportError:  # pragma: no cover
+        # Python < 3.8 doesn't have `importlib.metadata`.
+        import pkg_resources
+        return {i.name: '{}:{}'.format(i.module_name, '.'.join(i.attrs))
+                for i in pkg_resources.iter_entry_points(group)}
+
+    eps = entry_points()
+    if hasattr(eps, 'select'):
+        eps = eps.select(group=group)
+    else:  # pragma: no cover
+        eps = eps.get(group, [])
+    return {i.name: i.value for i in eps}
+
+
+def _get_entry_points(group):
+    if group not in _entry_point_index:
+        _entry_point_index[group] = _find_entry_points(group)
+    return _entry_point_index[group]
+
+
+def _load(spec):
+    module_name, _, attrs = spec.partition(':')
+    result = importlib.import_module(module_name.strip())
+    for i in attrs.strip().split('.'):
+        result = getattr(result, i)
+    return result
+
+
+def load_plugin(group, name):
+    # Look up a plugin by name, checking mopack's built-in plugins first and
+    # falling back to the entry points of all installed distributions.
+    spec = builtin_plugins.get(group, {}).get(name)
+    if spec is None:
+        spec = _get_entry_points(group).get(name)
+        if spec is None:
+            raise ImportError('plugin {!r} not found in {!r}'
+                              .format(name, group))
+    return _load(spec)
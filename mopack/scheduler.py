@@ -0,0 +1,69 @@
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+__all__ = ['Scheduler']
+
+
+class Scheduler:
+    # Run jobs on a bounded pool of worker threads. Callbacks are always called
+    # from the thread calling `run()`, so they can safely submit more jobs or
+    # modify shared state (e.g. configs or metadata) without any locking. If
+    # `jobs` is 1, jobs are run inline on the calling thread instead.
+
+    def __init__(self, jobs=1):
+        if jobs < 1:
+            raise ValueError('jobs must be at least 1')
+        self.jobs = jobs
+        self._queue = deque()
+        self._running = {}
+        self._error = None
+
+    def submit(self, fn, *args, callback=None, errback=None):
+        self._queue.append((fn, args, callback, errback))
+
+    @property
+    def failed(self):
+        return self._error is not None
+
+    def _finish(self, callback, errback, fn):
+        try:
+            result = fn()
+        except Exception as e:
+            if errback:
+                errback(e)
+            if self._error is None:
+                self._error = e
+            # Once something has failed, don't start anything new.
+            self._queue.clear()
+            return
+
+        if callback:
+            callback(result)
+
+    def _run_inline(self):
+        while self._queue:
+            fn, args, callback, errback = self._queue.popleft()
+            self._finish(callback, errback, lambda: fn(*args))
+
+    def _run_pool(self):
+        with ThreadPoolExecutor(self.jobs) as executor:
+            while self._queue or self._running:
+                while self._queue and len(self._running) < self.jobs:
+                    fn, args, callback, errback = self._queue.popleft()
+                    future = executor.submit(fn, *args)
+                    self._running[future] = (callback, errback)
+
+                done, _ = wait(self._running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    callback, errback = self._running.pop(future)
+                    self._finish(callback, errback, future.result)
+
+    def run(self):
+        if self.jobs == 1:
+            self._run_inline()
+        else:
+            self._run_pool()
+
+        if self._error is not None:
+            error, self._error = self._error, None
+            raise error
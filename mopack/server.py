@@ -0,0 +1,180 @@
+import json
+import os
+import socket
+import socketserver
+import threading
+from contextlib import suppress
+
+from .commands import package_tree
+from .metadata import Metadata
+from .types import dependency
+
+__all__ = ['default_socket_path', 'make_server', 'query', 'serve', 'Server',
+           'ServerError']
+
+socket_filename = 'mopack.sock'
+
+
+class ServerError(RuntimeError):
+    pass
+
+
+def default_socket_path(pkgdir):
+    return os.path.join(pkgdir, socket_filename)
+
+
+class Server:
+    # Keep the metadata for a package directory (including its cache of
+    # usages) resident so that queries don't have to pay for starting up and
+    # loading it each time. The metadata is reloaded whenever `mopack.json`
+    # changes (e.g. after `mopack resolve`), which we detect via its inode and
+    # modification time. Requests may come from several connections at once,
+    # so they're handled one at a time to protect the metadata.
+
+    def __init__(self, pkgdir, strict=False):
+        self.pkgdir = pkgdir
+        self.strict = strict
+        self._metadata = None
+        self._stamp = None
+        self._lock = threading.Lock()
+
+    def _get_stamp(self):
+        try:
+            stat = os.stat(os.path.join(self.pkgdir,
+                                        Metadata.metadata_filename))
+        except FileNotFoundError:
+            return None
+        return (stat.st_dev, stat.st_ino, stat.st_mtime_ns, stat.st_size)
+
+    @property
+    def metadata(self):
+        # Get the stamp *before* loading so that if the metadata is replaced
+        # while we're loading it, we'll just reload it again next time.
+        stamp = self._get_stamp()
+        if self._metadata is None or stamp != self._stamp:
+            self._metadata = Metadata.try_load(self.pkgdir, self.strict,
+                                               lazy=True)
+            self._stamp = stamp
+        return self._metadata
+
+    def usage(self, dep):
+        return self.metadata.get_usage(*dependency('dependency', dep))
+
+    def list_files(self, implicit=False):
+        metadata = self.metadata
+        if implicit:
+            return metadata.files + metadata.implicit_files
+        return metadata.files
+
+    def list_packages(self, flat=False):
+        metadata = self.metadata
+
+        def to_json(items):
+            return [{'name': i.package.name, 'source': i.package.source,
+                     'version': i.version, 'children': to_json(i.children)}
+                    for i in items]
+
+        return to_json(package_tree(metadata, flat))
+
+    def handle(self, request):
+        def get(key, default=None, required=False):
+            if required and key not in request:
+                raise ServerError('missing {!r} in request'.format(key))
+            return request.get(key, default)
+
+        try:
+            if not isinstance(request, dict):
+                raise ServerError('expected a request object')
+
+            command = get('command', required=True)
+            with self._lock:
+                if command == 'usage':
+                    result = self.usage(get('dependency', required=True))
+                elif command == 'list-files':
+                    result = self.list_files(get('implicit', False))
+                elif command == 'list-packages':
+                    result = self.list_packages(get('flat', False))
+                else:
+                    raise ServerError('unknown command {!r}'.format(command))
+        except Exception as e:
+            return {'error': str(e)}
+        return {'result': result}
+
+
+class _RequestHandler(socketserver.StreamRequestHandler):
+    # Each request and response is a JSON object on a single line. Clients can
+    # send as many requests as they like over a single connection; each
+    # connection gets its own thread, so an idle client doesn't block others.
+
+    def handle(self):
+        for line in self.rfile:
+            try:
+                request = json.loads(line)
+            except ValueError as e:
+                response = {'error': 'invalid request: {}'.format(e)}
+            else:
+                response = self.server.mopack.handle(request)
+            self.wfile.write(json.dumps(response).encode('utf-8') + b'\n')
+
+
+if hasattr(socket, 'AF_UNIX'):
+    class _UnixServer(socketserver.ThreadingMixIn,
+                      socketserver.UnixStreamServer):
+        # Don't wait for idle clients to disconnect when shutting down.
+        daemon_threads = True
+
+        def server_close(self):
+            super().server_close()
+            with suppress(OSError):
+                os.remove(self.server_address)
+else:  # pragma: no cover
+    _UnixServer = None
+
+
+def _remove_stale_socket(path):
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as s:
+        try:
+            s.connect(path)
+        except FileNotFoundError:
+            return
+        except ConnectionRefusedError:
+            # Nobody's listening, so this was left behind by a server that
+            # didn't shut down cleanly.
+            os.remove(path)
+            return
+    raise ServerError('server already running at {!r}'.format(path))
+
+
+def make_server(pkgdir, path=None, strict=False):
+    if _UnixServer is None:  # pragma: no cover
+        raise ServerError('Unix domain sockets are not supported on this ' +
+                          'platform')
+
+    path = path or default_socket_path(pkgdir)
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    _remove_stale_socket(path)
+
+    server = _UnixServer(path, _RequestHandler)
+    server.mopack = Server(pkgdir, strict)
+    return server
+
+
+def serve(pkgdir, path=None, strict=False):
+    with make_server(pkgdir, path, strict) as server:
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+
+
+def query(path, request):
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as s:
+        s.connect(path)
+        with s.makefile('rwb') as f:
+            f.write(json.dumps(request).encode('utf-8') + b'\n')
+            f.flush()
+            response = json.loads(f.readline())
+
+    if 'error' in response:
+        raise ServerError(response['error'])
+    return response['result']
@@ -1,18 +1,18 @@
 import os
-from pkg_resources import load_entry_point
 
 from .. import types
 from ..base_options import BaseOptions, OptionsHolder
 from ..freezedried import FreezeDried
 from ..iterutils import ismapping, listify
 from ..package_defaults import DefaultResolver
+from ..plugins import load_plugin
 from ..types import FieldKeyError, FieldValueError, try_load_config
 from ..usage import Usage, make_usage
 
 
 def _get_source_type(source, field='source'):
     try:
-        return load_entry_point('mopack', 'mopack.sources', source)
+        return load_plugin('mopack.sources', source)
     except ImportError:
         raise FieldValueError('unknown source {!r}'.format(source), field)
 
@@ -67,9 +67,22 @@ class Package(OptionsHolder):
     def needs_dependencies(self):
         return False
 
+    @classmethod
+    def prefetch_versions(cls, metadata, packages):
+        # Probe the versions of many packages of this type at once, storing
+        # the results in `metadata.version_probes` for `guessed_version()` or
+        # `version()` to use.
+        pass
+
     def guessed_version(self, metadata):
         return None
 
+    def guessed_version_stamp(self, metadata):
+        # Get a value that changes whenever `guessed_version()` might, for
+        # fingerprinting generated files. Packages whose versions are slow to
+        # look up can return something cheaper than the version itself.
+        return self.guessed_version(metadata)
+
     def version(self, metadata):
         return self.usage.version(metadata, self)
 
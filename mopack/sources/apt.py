@@ -1,12 +1,117 @@
+import os
 import subprocess
+import time
+from contextlib import suppress
 from itertools import chain
 
 from . import BinaryPackage
 from .. import log, types
 from ..environment import get_cmd, subprocess_run
+from ..exceptions import ConfigurationError
 from ..iterutils import uniques
 
 
+# Skip `apt-get update` if the package lists have been updated more recently
+# than this (in seconds).
+default_update_interval = 3600
+_apt_lists_dir = '/var/lib/apt/lists'
+# Written by some distros (e.g. Ubuntu) after each successful `apt-get update`.
+_apt_update_stamp = '/var/lib/apt/periodic/update-success-stamp'
+_dpkg_admin_dir = '/var/lib/dpkg'
+
+
+def dpkg_versions(env, names):
+    # Query the installed versions of many packages with a single call to
+    # `dpkg-query`.
+    # This fails if *any* of the packages is unknown, but still reports the
+    # ones it found, so we just use whatever output we get.
+    dpkgq = get_cmd(env, 'DPKG_QUERY', 'dpkg-query')
+    try:
+        output = subprocess_run(
+            dpkgq + ['-W', '-f${db:Status-Abbrev}\t${binary:Package}\t' +
+                     '${Package}\t${Version}\n'] + names,
+            stdout=subprocess.PIPE, stderr=subprocess.DEVNULL,
+            universal_newlines=True, env=env
+        ).stdout
+    except OSError:
+        return {}
+
+    result = {}
+    for line in output.splitlines():
+        fields = line.split('\t')
+        if len(fields) != 4:
+            continue
+        status, binary_name, name, version = fields
+        # The second letter of the status is the package's current state;
+        # anything not fully installed (e.g. "un" or "rc") doesn't count.
+        if status[1:2] != 'i':
+            continue
+        # Depending on how the package was named, `dpkg-query` might report
+        # it with or without an architecture qualifier, so store both.
+        result[binary_name] = version
+        result.setdefault(name, version)
+    return result
+
+
+def _split_remote(remote):
+    # Remotes can request a specific version, like `libfoo-dev=1.2-3`.
+    name, _, version = remote.partition('=')
+    return name, version or None
+
+
+def _missing_remotes(env, remotes):
+    names = uniques(_split_remote(i)[0] for i in remotes)
+    installed = dpkg_versions(env, names)
+    result = []
+    for i in remotes:
+        name, version = _split_remote(i)
+        have = installed.get(name)
+        if have is None or (version is not None and have != version):
+            result.append(i)
+    return result
+
+
+def _update_interval(env):
+    value = env.get('MOPACK_APT_UPDATE_INTERVAL')
+    if not value:
+        return default_update_interval
+    try:
+        return int(value)
+    except ValueError:
+        raise ConfigurationError('invalid $MOPACK_APT_UPDATE_INTERVAL: {!r}'
+                                 .format(value))
+
+
+def _lists_updated():
+    # Get the last time the package lists were updated, or None if there
+    # aren't any lists. We can't just check the lists directory itself, since
+    # removing the lists (as is common in Docker images) would update its
+    # mtime too. Instead, check the index files that only a successful update
+    # writes, along with the update stamp if there is one. (Apt may give the
+    # index files the mirror's modification time, but that only makes them
+    # look older than they are, so at worst we update when we didn't need to.)
+    try:
+        with os.scandir(_apt_lists_dir) as it:
+            updated = [i.stat().st_mtime for i in it
+                       if '_Packages' in i.name and i.is_file()]
+    except OSError:
+        return None
+    if not updated:
+        return None
+
+    with suppress(OSError):
+        updated.append(os.stat(_apt_update_stamp).st_mtime)
+    return max(updated)
+
+
+def _lists_fresh(env):
+    interval = _update_interval(env)
+    if interval <= 0:
+        return False
+    updated = _lists_updated()
+    return updated is not None and time.time() - updated < interval
+
+
 class AptPackage(BinaryPackage):
     source = 'apt'
     _version = 1
@@ -26,9 +131,20 @@ class AptPackage(BinaryPackage):
         ))
         T.repository(types.maybe(types.string))
 
+    @classmethod
+    def prefetch_versions(cls, metadata, packages):
+        env = packages[0]._common_options.env
+        versions = dpkg_versions(env, uniques(i.remote[0] for i in packages))
+        for name, version in versions.items():
+            metadata.version_probes[('dpkg', name)] = version
+
     def guessed_version(self, metadata):
         # XXX: Maybe try to de-munge the version into something not
         # apt-specific?
+        probed = metadata.version_probes.get(('dpkg', self.remote[0]))
+        if probed is not None:
+            return probed
+
         env = self._common_options.env
         dpkgq = get_cmd(env, 'DPKG_QUERY', 'dpkg-query')
         return subprocess_run(
@@ -37,23 +153,54 @@ class AptPackage(BinaryPackage):
             env=env
         ).stdout
 
+    def guessed_version_stamp(self, metadata):
+        # dpkg records the installed packages in its status file, so if that
+        # hasn't changed, neither has our version. This lets us avoid running
+        # `dpkg-query` just to see if a generated .pc file is up to date.
+        env = self._common_options.env
+        status = os.path.join(env.get('DPKG_ADMINDIR', _dpkg_admin_dir),
+                              'status')
+        try:
+            stat = os.stat(status)
+        except OSError:
+            return super().guessed_version_stamp(metadata)
+        return [self.remote[0], stat.st_mtime_ns, stat.st_size]
+
     @classmethod
     def resolve_all(cls, metadata, packages):
+        env = packages[0]._common_options.env
+        remotes = uniques(chain.from_iterable(i.remote for i in packages))
+        missing = _missing_remotes(env, remotes)
+        missing_set = set(missing)
+        to_install = []
         for i in packages:
-            log.pkg_resolve(i.name, 'from {}'.format(cls.source))
+            if any(j in missing_set for j in i.remote):
+                log.pkg_resolve(i.name, 'from {}'.format(cls.source))
+                to_install.append(i)
+            else:
+                log.pkg_resolve(i.name, 'already installed')
+
+        if not missing:
+            for i in packages:
+                i.resolved = True
+            return
 
-        env = packages[0]._common_options.env
         apt = get_cmd(env, 'APT_GET', 'sudo apt-get')
         aptrepo = get_cmd(env, 'ADD_APT_REPOSITORY', 'sudo add-apt-repository')
 
-        remotes = list(chain.from_iterable(i.remote for i in packages))
-        repositories = uniques(i.repository for i in packages if i.repository)
+        # Only add the repositories for packages we actually need to install.
+        repositories = uniques(i.repository for i in to_install
+                               if i.repository)
 
         with log.LogFile.open(metadata.pkgdir, 'apt') as logfile:
             for i in repositories:
                 logfile.check_call(aptrepo + ['-y', i], env=env)
-            logfile.check_call(apt + ['update'], env=env)
-            logfile.check_call(apt + ['install', '-y'] + remotes, env=env)
+            # Newly-added repositories always need to be fetched, but
+            # otherwise, we can use the existing package lists if they're
+            # recent enough.
+            if repositories or not _lists_fresh(env):
+                logfile.check_call(apt + ['update'], env=env)
+            logfile.check_call(apt + ['install', '-y'] + missing, env=env)
 
         for i in packages:
             i.resolved = True
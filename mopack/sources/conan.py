@@ -1,6 +1,9 @@
+import hashlib
+import json
 import os
 import subprocess
 import warnings
+from io import StringIO
 from itertools import chain
 
 from . import BinaryPackage, PackageOptions
@@ -11,9 +14,10 @@ from ..iterutils import uniques
 from ..shell import ShellArguments
 
 
+@FreezeDried.fields(skip_compare={'installed_version', 'install_digest'})
 class ConanPackage(BinaryPackage):
     source = 'conan'
-    _version = 1
+    _version = 3
 
     @FreezeDried.fields(rehydrate={'extra_args': ShellArguments})
     class Options(PackageOptions):
@@ -39,6 +43,12 @@ class ConanPackage(BinaryPackage):
 
     @staticmethod
     def upgrade(config, version):
+        # v2 adds `installed_version`.
+        if version < 2:
+            config['installed_version'] = None
+        # v3 adds `install_digest`.
+        if version < 3:
+            config['install_digest'] = None
         return config
 
     def __init__(self, name, remote, build=False, options=None, usage=None,
@@ -53,10 +63,43 @@ class ConanPackage(BinaryPackage):
         value_type = types.one_of(types.string, types.boolean, desc='a value')
         T.options(types.maybe(types.dict_of(types.string, value_type), {}))
 
+        # The version of this package that conan actually installed, which we
+        # get from the output of `conan install` during `resolve_all()`.
+        self.installed_version = None
+        # A digest of the inputs to the last successful `conan install` that
+        # included this package.
+        self.install_digest = None
+
     @staticmethod
     def _installdir(metadata):
         return os.path.join(metadata.pkgdir, 'conan')
 
+    @classmethod
+    def _install_info(cls, metadata):
+        return os.path.join(cls._installdir(metadata), 'install.json')
+
+    @classmethod
+    def _installed_versions(cls, metadata):
+        # Get the versions of all the packages that conan installed (including
+        # indirect dependencies) from the JSON output of `conan install`.
+        try:
+            with open(cls._install_info(metadata)) as f:
+                installed = json.load(f)['installed']
+            result = {}
+            for i in installed:
+                recipe = i['recipe']
+                name, version = recipe.get('name'), recipe.get('version')
+                if not name or not version:
+                    # Older versions of conan only give us the full reference,
+                    # like `name/version@user/channel#revision`.
+                    ref = recipe['id'].split('#')[0].split('@')[0]
+                    name, _, version = ref.partition('/')
+                if name and version:
+                    result[name] = version
+            return result
+        except (OSError, ValueError, LookupError, TypeError, AttributeError):
+            return {}
+
     @staticmethod
     def _build_opts(value):
         if not value:
@@ -77,8 +120,12 @@ class ConanPackage(BinaryPackage):
         return {'builddir': self._installdir(metadata)} if builder else {}
 
     def version(self, metadata):
-        # Inspect the local conan cache to get the package's version.
-        # XXX: There might be a better way to do this...
+        if self.installed_version is not None:
+            return self.installed_version
+
+        # We don't know what version conan installed (e.g. because the
+        # package was resolved by an older version of mopack), so inspect the
+        # local conan cache to get the package's version.
         conan = get_cmd(self._common_options.env, 'CONAN', 'conan')
         return subprocess.run(
             conan + ['inspect', '--raw=version', self.remote],
@@ -87,8 +134,14 @@ class ConanPackage(BinaryPackage):
 
     def clean_post(self, metadata, new_package, quiet=False):
         if new_package and self.source == new_package.source:
+            # Pass on what we know about the last install so that we can tell
+            # if we need to run `conan install` again.
+            new_package.installed_version = self.installed_version
+            new_package.install_digest = self.install_digest
             return False
 
+        self.install_digest = None
+
         if not quiet:
             log.pkg_clean(self.name)
 
@@ -100,42 +153,73 @@ class ConanPackage(BinaryPackage):
             pass
         return True
 
-    @classmethod
-    def resolve_all(cls, metadata, packages):
+    @staticmethod
+    def _conanfile(packages):
+        out = StringIO()
+        print('[requires]', file=out)
         for i in packages:
-            log.pkg_resolve(i.name, 'from {}'.format(cls.source))
+            print(i.remote, file=out)
+        print('', file=out)
 
-        options = packages[0]._this_options
-        os.makedirs(metadata.pkgdir, exist_ok=True)
-        with open(os.path.join(metadata.pkgdir, 'conanfile.txt'),
-                  'w') as conan:
-            print('[requires]', file=conan)
-            for i in packages:
-                print(i.remote, file=conan)
-            print('', file=conan)
+        print('[options]', file=out)
+        for i in packages:
+            for k, v in i.options.items():
+                print('{}:{}={}'.format(i.remote_name, k, v), file=out)
+        print('', file=out)
 
-            print('[options]', file=conan)
-            for i in packages:
-                for k, v in i.options.items():
-                    print('{}:{}={}'.format(i.remote_name, k, v), file=conan)
-            print('', file=conan)
+        print('[generators]', file=out)
+        print('pkg_config', file=out)
+        return out.getvalue()
 
-            print('[generators]', file=conan)
-            print('pkg_config', file=conan)
+    @classmethod
+    def _is_installed(cls, metadata, packages, digest):
+        if any(i.install_digest != digest for i in packages):
+            return False
+        # Conan's pkg_config generator names its .pc files after each
+        # package's `cpp_info` names, which needn't match the package's name,
+        # so check conan's own record of what it installed instead.
+        installed = cls._installed_versions(metadata)
+        return all(i.remote_name in installed for i in packages)
 
+    @classmethod
+    def resolve_all(cls, metadata, packages):
+        options = packages[0]._this_options
+        conanfile = cls._conanfile(packages)
         build = [i.remote_name for i in packages if i.build]
 
         env = packages[0]._common_options.env
         conan = get_cmd(env, 'CONAN', 'conan')
-        with log.LogFile.open(metadata.pkgdir, 'conan') as logfile:
-            logfile.check_call(
-                conan + ['install', '-if', cls._installdir(metadata)] +
+        args = (conan + ['install', '-if', cls._installdir(metadata),
+                         '--json', cls._install_info(metadata)] +
                 cls._build_opts(uniques(options.build + build)) +
-                options.extra_args.fill() + ['--', metadata.pkgdir],
-                env=env
-            )
+                options.extra_args.fill() + ['--', metadata.pkgdir])
+
+        # If nothing that goes into `conan install` has changed since the last
+        # time we ran it, and its outputs are still there, skip it.
+        digest = hashlib.sha256(json.dumps({
+            'conanfile': conanfile, 'args': args,
+        }).encode('utf-8')).hexdigest()
+        if cls._is_installed(metadata, packages, digest):
+            for i in packages:
+                log.pkg_resolve(i.name, 'already installed')
+                i.resolved = True
+            return
+
+        for i in packages:
+            log.pkg_resolve(i.name, 'from {}'.format(cls.source))
+            i.install_digest = None
+
+        os.makedirs(metadata.pkgdir, exist_ok=True)
+        with open(os.path.join(metadata.pkgdir, 'conanfile.txt'), 'w') as f:
+            f.write(conanfile)
+
+        with log.LogFile.open(metadata.pkgdir, 'conan') as logfile:
+            logfile.check_call(args, env=env)
 
+        versions = cls._installed_versions(metadata)
         for i in packages:
+            i.installed_version = versions.get(i.remote_name)
+            i.install_digest = digest
             i.resolved = True
 
     @staticmethod
@@ -1,24 +1,36 @@
+import hashlib
+import json
 import os
 import shutil
-from io import BytesIO
+import subprocess
+import tempfile
+import warnings
 from urllib.request import urlopen
 
 from . import Package, submodules_type
 from .. import archive, log, types
 from ..builders import Builder, make_builder
+from ..cache import (ArtifactCache, DownloadCache, git_mirror_path,
+                     HashingReader)
 from ..config import ChildConfig
-from ..environment import get_cmd
+from ..environment import get_cmd, subprocess_run
 from ..freezedried import FreezeDried
-from ..glob import filter_glob
+from ..glob import GlobSet
 from ..log import LogFile
 from ..package_defaults import DefaultResolver
-from ..path import Path, pushd
+from ..path import Path
 from ..usage import make_usage, Usage
 from ..yaml_tools import to_parse_error
 
+# Environment variables that can affect the result of building a package. If
+# any of these change, we'll rebuild the package even if nothing else has.
+_fingerprint_env = ('PATH', 'PKG_CONFIG_PATH', 'CC', 'CXX', 'CPPFLAGS',
+                    'CFLAGS', 'CXXFLAGS', 'LDFLAGS', 'LDLIBS', 'AR', 'LD',
+                    'CMAKE', 'NINJA', 'BFG9000', 'MAKE')
+
 
 @FreezeDried.fields(rehydrate={'builder': Builder, 'usage': Usage},
-                    skip_compare={'pending_usage'})
+                    skip_compare={'pending_usage', 'build_fingerprint'})
 class SDistPackage(Package):
     @staticmethod
     def upgrade(config, version):
@@ -44,6 +56,10 @@ class SDistPackage(Package):
             self.builder = make_builder(self, build)
             self.usage = self._make_usage(usage)
 
+        # The fingerprint of the inputs to the last successful build; see
+        # `_build_fingerprint()`.
+        self.build_fingerprint = None
+
     def dehydrate(self):
         if hasattr(self, 'pending_usage'):
             raise types.ConfigurationError(
@@ -120,16 +136,129 @@ class SDistPackage(Package):
 
     def clean_post(self, metadata, new_package, quiet=False):
         if self == new_package:
+            # Since we're keeping the old build around, pass its fingerprint
+            # on to the new package so that we can tell if it's up to date.
+            new_package.build_fingerprint = self.build_fingerprint
             return False
 
         if not quiet:
             log.pkg_clean(self.name)
         self.builder.clean(metadata, self)
+        self.build_fingerprint = None
         return True
 
-    def resolve(self, metadata):
+    def _source_fingerprint(self, metadata):
+        # Return something identifying the current state of this package's
+        # source tree, or None if we can't tell (in which case we'll always
+        # rebuild the package).
+        return None
+
+    def _dependency_fingerprints(self, metadata):
+        names = {i.name for i in metadata.packages.values()
+                 if i.parent == self.name}
+        names.update(i[0] for i in
+                     getattr(self.usage, 'dependencies', None) or [])
+        names.discard(self.name)
+
+        result = {}
+        for i in sorted(names):
+            dep = metadata.packages.get(i)
+            if dep is None:
+                continue
+            # Only source distributions have fingerprints; for other packages,
+            # we assume that nothing changes unless their config does.
+            if isinstance(dep, SDistPackage):
+                if dep.build_fingerprint is None:
+                    return None
+                result[i] = dep.build_fingerprint
+            else:
+                result[i] = dep.dehydrate()
+        return result
+
+    def _build_fingerprint(self, metadata):
+        # Hash everything that goes into building this package so that we can
+        # skip rebuilding it when nothing relevant has changed.
+        source = self._source_fingerprint(metadata)
+        if source is None:
+            return None
+        dependencies = self._dependency_fingerprints(metadata)
+        if dependencies is None:
+            return None
+
+        package = self.dehydrate()
+        for i in ('resolved', 'build_fingerprint'):
+            package.pop(i, None)
+
+        common = self._common_options.dehydrate()
+        env = common.pop('env')
+        builder_options = self.builder._this_options
+
+        data = json.dumps({
+            'package': package,
+            'common_options': common,
+            'builder_options': (builder_options.dehydrate()
+                                if builder_options else None),
+            'env': {k: env.get(k) for k in _fingerprint_env},
+            'source': source,
+            'dependencies': dependencies,
+        }, sort_keys=True, default=str)
+        return hashlib.sha256(data.encode('utf-8')).hexdigest()
+
+    def _is_built(self, metadata, fingerprint):
+        if fingerprint is None or fingerprint != self.build_fingerprint:
+            return False
+        builddir = self.builder.path_values(metadata).get('builddir')
+        return builddir is None or os.path.isdir(builddir)
+
+    def _artifact_dirs(self, metadata):
+        path_values = self.path_values(metadata, builder=True)
+        return {i: path_values[i] for i in self.builder.artifact_dirs()}
+
+    def _build(self, metadata, fingerprint):
+        cache = ArtifactCache.from_env(self._common_options.env)
+        if cache is None or fingerprint is None:
+            log.pkg_resolve(self.name)
+            self.builder.build(metadata, self)
+            return
+
+        dirs = self._artifact_dirs(metadata)
+        if not dirs:
+            log.pkg_resolve(self.name)
+            self.builder.build(metadata, self)
+            return
+
+        # The fingerprint doesn't depend on where we're building, so entries
+        # are shared between build directories; the cache relocates the paths
+        # in the build outputs when restoring them elsewhere.
+        paths = self.path_values(metadata, builder=True)
+        try:
+            restored = cache.restore(fingerprint, dirs, paths)
+        except OSError as e:
+            warnings.warn('unable to restore {!r} from artifact cache: {}'
+                          .format(self.name, e))
+            restored = False
+        if restored:
+            log.pkg_resolve(self.name, 'from artifact cache')
+            return
+
         log.pkg_resolve(self.name)
         self.builder.build(metadata, self)
+        try:
+            cache.store(fingerprint, self.name, dirs, paths)
+        except OSError as e:
+            warnings.warn('unable to store {!r} in artifact cache: {}'
+                          .format(self.name, e))
+
+    def resolve(self, metadata):
+        fingerprint = self._build_fingerprint(metadata)
+        if self._is_built(metadata, fingerprint):
+            log.pkg_resolve(self.name, 'already built')
+        else:
+            # Forget the old fingerprint first so that a failed build is
+            # never mistaken for a successful one.
+            self.build_fingerprint = None
+            self._build(metadata, fingerprint)
+            self.build_fingerprint = fingerprint
         self.resolved = True
 
     def deploy(self, metadata):
@@ -141,7 +270,14 @@ class SDistPackage(Package):
 @FreezeDried.fields(rehydrate={'path': Path})
 class DirectoryPackage(SDistPackage):
     source = 'directory'
-    _version = 1
+    _version = 2
+
+    @staticmethod
+    def upgrade(config, version):
+        # v2 adds `build_fingerprint`.
+        if version < 2:
+            config['build_fingerprint'] = None
+        return config
 
     def __init__(self, name, *, path, **kwargs):
         super().__init__(name, **kwargs)
@@ -161,15 +297,26 @@ class DirectoryPackage(SDistPackage):
 @FreezeDried.fields(rehydrate={'path': Path}, skip_compare={'guessed_srcdir'})
 class TarballPackage(SDistPackage):
     source = 'tarball'
-    _version = 1
+    _version = 3
+
+    @staticmethod
+    def upgrade(config, version):
+        # v2 adds `sha256`.
+        if version < 2:
+            config['sha256'] = None
+        # v3 adds `build_fingerprint`.
+        if version < 3:
+            config['build_fingerprint'] = None
+        return config
 
-    def __init__(self, name, *, path=None, url=None, files=None, srcdir=None,
-                 patch=None, **kwargs):
+    def __init__(self, name, *, path=None, url=None, sha256=None, files=None,
+                 srcdir=None, patch=None, **kwargs):
         super().__init__(name, **kwargs)
 
         T = types.TypeCheck(locals(), self._expr_symbols)
         T.path(types.maybe(types.any_path('cfgdir')))
         T.url(types.maybe(types.url))
+        T.sha256(types.maybe(types.sha256))
         T.files(types.list_of(types.string, listify=True))
         T.srcdir(types.maybe(types.path_fragment))
         T.patch(types.maybe(types.any_path('cfgdir')))
@@ -186,8 +333,40 @@ class TarballPackage(SDistPackage):
                             self.srcdir or self.guessed_srcdir)
 
     def _urlopen(self, url):
-        with urlopen(url) as f:
-            return BytesIO(f.read())
+        return urlopen(url)
+
+    def _source_fingerprint(self, metadata):
+        # The extracted sources only change when our configuration does (see
+        # `clean_pre()`), but a local archive or patch can still be modified
+        # in place, so check those too.
+        def stat(path):
+            if path is None:
+                return None
+            st = os.stat(path.string(cfgdir=self.config_dir))
+            return [st.st_size, st.st_mtime_ns]
+
+        try:
+            return {'archive': self.sha256 or stat(self.path),
+                    'patch': stat(self.patch)}
+        except OSError:
+            return None
+
+    def _open_archive(self):
+        # Return a stream of the archive's contents. If we have a SHA-256 to
+        # check, this is verified as the stream is consumed.
+        if self.url:
+            cache = DownloadCache.from_env(self._common_options.env)
+            if cache:
+                return cache.open(self.url, self.sha256, self._urlopen)
+            where = self.url
+            f = self._urlopen(self.url)
+        else:
+            where = self.path.string(cfgdir=self.config_dir)
+            f = open(where, 'rb')
+
+        if self.sha256:
+            return HashingReader(f, self.sha256, where)
+        return f
 
     def clean_pre(self, metadata, new_package, quiet=False):
         if self.equal(new_package, skip_fields={'builder'}):
@@ -210,19 +389,27 @@ class TarballPackage(SDistPackage):
             where = self.url or self.path.string(cfgdir=self.config_dir)
             log.pkg_fetch(self.name, 'from {}'.format(where))
 
-            with (self._urlopen(self.url) if self.url else
-                  open(self.path.string(cfgdir=self.config_dir), 'rb')) as f:
-                with archive.open(f) as arc:
-                    names = arc.getnames()
-                    self.guessed_srcdir = (names[0].split('/', 1)[0] if names
-                                           else None)
-                    if self.files:
-                        # XXX: This doesn't extract parents of our globs, so
-                        # owners/permissions won't be applied to them...
-                        for i in filter_glob(self.files, names):
-                            arc.extract(i, base_srcdir)
-                    else:
-                        arc.extractall(base_srcdir)
+            # Extract into a staging directory and only move it into place
+            # once the archive's checksum has been verified (which happens
+            # when the archive stream is closed). That way, we never leave
+            # unverified files in the source directory.
+            staging = base_srcdir + '.partial'
+            shutil.rmtree(staging, ignore_errors=True)
+            match = GlobSet(self.files).match if self.files else None
+            try:
+                with self._open_archive() as f, \
+                     archive.open(f, 'r|*') as arc:
+                    names = arc.extractmatching(staging, match)
+                # An archive with no (matching) files won't have created the
+                # staging directory.
+                if not os.path.isdir(staging):
+                    os.makedirs(staging)
+                os.rename(staging, base_srcdir)
+            except BaseException:
+                shutil.rmtree(staging, ignore_errors=True)
+                raise
+            self.guessed_srcdir = (min(names).split('/', 1)[0] if names
+                                   else None)
 
             if self.patch:
                 env = self._common_options.env
@@ -230,19 +417,33 @@ class TarballPackage(SDistPackage):
                 patch = self.patch.string(cfgdir=self.config_dir)
                 log.pkg_patch(self.name, 'with {}'.format(patch))
                 with LogFile.open(metadata.pkgdir, self.name) as logfile, \
-                     open(patch) as f, \
-                     pushd(self._srcdir(metadata)):
-                    logfile.check_call(patch_cmd + ['-p1'], stdin=f, env=env)
+                     open(patch) as f:
+                    logfile.check_call(patch_cmd + ['-p1'], stdin=f, env=env,
+                                       cwd=self._srcdir(metadata))
 
         return self._find_mopack(parent_config, self._srcdir(metadata))
 
 
 class GitPackage(SDistPackage):
     source = 'git'
-    _version = 1
+    _version = 4
+
+    @staticmethod
+    def upgrade(config, version):
+        # v2 adds `build_fingerprint`.
+        if version < 2:
+            config['build_fingerprint'] = None
+        # v3 adds `shallow`. Existing checkouts are full clones, but that's
+        # fine, so don't make them get cloned again.
+        if version < 3:
+            config['shallow'] = True
+        # v4 adds `sparse_paths`.
+        if version < 4:
+            config['sparse_paths'] = []
+        return config
 
     def __init__(self, name, *, repository, tag=None, branch=None, commit=None,
-                 srcdir='.', **kwargs):
+                 srcdir='.', sparse_paths=None, shallow=True, **kwargs):
         super().__init__(name, **kwargs)
 
         T = types.TypeCheck(locals(), self._expr_symbols)
@@ -251,6 +452,8 @@ class GitPackage(SDistPackage):
             desc='a repository'
         ))
         T.srcdir(types.maybe(types.path_fragment))
+        T.sparse_paths(types.list_of(types.path_fragment, listify=True))
+        T.shallow(types.boolean)
 
         rev = {}
         T.tag(types.maybe(types.string), dest=rev)
@@ -274,6 +477,27 @@ class GitPackage(SDistPackage):
     def _srcdir(self, metadata):
         return os.path.join(self._base_srcdir(metadata), self.srcdir)
 
+    def _source_fingerprint(self, metadata):
+        # Use the current commit, unless there are local changes, since we
+        # can't easily tell what those are.
+        env = self._common_options.env
+        git = get_cmd(env, 'GIT', 'git')
+        base_srcdir = self._base_srcdir(metadata)
+
+        def run(args):
+            return subprocess_run(
+                git + args, check=True, stdout=subprocess.PIPE,
+                stderr=subprocess.DEVNULL, universal_newlines=True, env=env,
+                cwd=base_srcdir
+            ).stdout
+
+        try:
+            if run(['status', '--porcelain']):
+                return None
+            return run(['rev-parse', 'HEAD']).strip()
+        except (OSError, subprocess.CalledProcessError):
+            return None
+
     def clean_pre(self, metadata, new_package, quiet=False):
         if self.equal(new_package, skip_fields={'builder'}):
             return False
@@ -283,6 +507,103 @@ class GitPackage(SDistPackage):
         shutil.rmtree(self._base_srcdir(metadata), ignore_errors=True)
         return True
 
+    def _sparse_checkout_paths(self):
+        # If our sources are in a subdirectory, only check out that directory
+        # (plus any other paths the user asked for).
+        if self.srcdir == '.':
+            return []
+        return [self.srcdir] + self.sparse_paths
+
+    def _repository_url(self):
+        if isinstance(self.repository, Path):
+            return self.repository.string(cfgdir=self.config_dir)
+        return self.repository
+
+    def _has_rev(self, git, env, repo):
+        if self.rev[0] == 'branch':
+            return False
+        ref = ('refs/tags/' if self.rev[0] == 'tag' else '') + self.rev[1]
+        return subprocess_run(
+            git + ['rev-parse', '--verify', '--quiet', ref + '^{commit}'],
+            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, env=env,
+            cwd=repo
+        ).returncode == 0
+
+    def _update_mirror(self, logfile, git, env):
+        # Get a local bare mirror of the repository, if mirrors are enabled,
+        # creating or updating it as needed. If the mirror already has the
+        # revision we want, we don't need to touch the network at all.
+        url = self._repository_url()
+        mirror = git_mirror_path(env, url)
+        if mirror is None:
+            return None
+
+        if os.path.exists(mirror):
+            if not self._has_rev(git, env, mirror):
+                logfile.check_call(git + ['remote', 'update', '--prune'],
+                                   env=env, cwd=mirror)
+            return mirror
+
+        # Clone into a temporary directory first so that other processes
+        # never see a partial mirror.
+        os.makedirs(os.path.dirname(mirror), exist_ok=True)
+        tmp = tempfile.mkdtemp(dir=os.path.dirname(mirror), prefix='.tmp-')
+        try:
+            logfile.check_call(git + ['clone', '--mirror', url, tmp],
+                               env=env)
+            try:
+                os.rename(tmp, mirror)
+            except OSError:
+                # Another process beat us to it, so just use theirs.
+                if not os.path.exists(mirror):
+                    raise
+        finally:
+            shutil.rmtree(tmp, ignore_errors=True)
+        return mirror
+
+    def _clone(self, logfile, git, env, base_srcdir):
+        url = self._repository_url()
+        mirror = self._update_mirror(logfile, git, env)
+        sparse_paths = self._sparse_checkout_paths()
+        rev_kind, rev = self.rev
+
+        clone = git + ['clone']
+        if mirror:
+            # Cloning from the mirror is a purely local operation, so there's
+            # no need for a shallow clone.
+            source = mirror
+        else:
+            source = url
+            if self.shallow:
+                # We can only make a shallow clone of a named ref; for
+                # commits, fetch the history, but only the blobs we need. For
+                # sparse checkouts, we also only need the blobs in the
+                # checked-out paths.
+                if rev_kind != 'commit':
+                    clone.extend(['--depth', '1'])
+                if rev_kind == 'commit' or sparse_paths:
+                    clone.append('--filter=blob:none')
+        if sparse_paths:
+            clone.append('--sparse')
+
+        if rev_kind in ['branch', 'tag']:
+            clone.extend(['--branch', rev])
+        elif rev_kind == 'commit':
+            clone.append('--no-checkout')
+        else:  # pragma: no cover
+            raise ValueError('unknown revision type {!r}'.format(rev_kind))
+
+        logfile.check_call(clone + [source, base_srcdir], env=env)
+        if mirror:
+            logfile.check_call(git + ['remote', 'set-url', 'origin', url],
+                               env=env, cwd=base_srcdir)
+        if sparse_paths:
+            logfile.check_call(git + ['sparse-checkout', 'set', '--cone'] +
+                               sparse_paths, env=env, cwd=base_srcdir)
+        if rev_kind == 'commit':
+            logfile.check_call(git + ['checkout', rev], env=env,
+                               cwd=base_srcdir)
+
     def fetch(self, metadata, parent_config):
         base_srcdir = self._base_srcdir(metadata)
         env = self._common_options.env
@@ -290,22 +611,20 @@ class GitPackage(SDistPackage):
 
         with LogFile.open(metadata.pkgdir, self.name) as logfile:
             if os.path.exists(base_srcdir):
+                # Tags and commits are pinned, so if we've already checked
+                # them out, there's nothing to do.
                 if self.rev[0] == 'branch':
-                    with pushd(base_srcdir):
-                        logfile.check_call(git + ['pull'], env=env)
+                    logfile.check_call(git + ['pull'], env=env,
+                                       cwd=base_srcdir)
             else:
-                log.pkg_fetch(self.name, 'from {}'.format(self.repository))
-                clone = ['git', 'clone', self.repository, base_srcdir]
-                if self.rev[0] in ['branch', 'tag']:
-                    clone.extend(['--branch', self.rev[1]])
-                    logfile.check_call(clone, env=env)
-                elif self.rev[0] == 'commit':
-                    logfile.check_call(clone, env=env)
-                    with pushd(base_srcdir):
-                        logfile.check_call(git + ['checkout', self.rev[1]],
-                                           env=env)
-                else:  # pragma: no cover
-                    raise ValueError('unknown revision type {!r}'
-                                     .format(self.rev[0]))
+                log.pkg_fetch(self.name,
+                              'from {}'.format(self._repository_url()))
+                try:
+                    self._clone(logfile, git, env, base_srcdir)
+                except BaseException:
+                    # Don't leave a partial checkout around, or we'd think it
+                    # was already fetched next time.
+                    shutil.rmtree(base_srcdir, ignore_errors=True)
+                    raise
 
         return self._find_mopack(parent_config, self._srcdir(metadata))
@@ -33,6 +33,8 @@ _url_ex = re.compile(
     r'$'
 )
 
+_sha256_ex = re.compile(r'^[0-9A-Fa-f]{64}$')
+
 _dependency_ex = re.compile(
     r'^'
     r'([^,[\]]+)'      # package name
@@ -376,6 +378,13 @@ def url(field, value):
     return value
 
 
+def sha256(field, value):
+    value = string(field, value)
+    if not _sha256_ex.match(value):
+        raise FieldValueError('expected a SHA-256 digest', field)
+    return value.lower()
+
+
 def dependency(field, value):
     value = string(field, value)
     m = _dependency_ex.match(value)
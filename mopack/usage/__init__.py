@@ -1,12 +1,11 @@
-from pkg_resources import load_entry_point
-
 from ..base_options import OptionsHolder
+from ..plugins import load_plugin
 from ..types import FieldValueError, dependency_string, wrap_field_error
 
 
 def _get_usage_type(type, field='type'):
     try:
-        return load_entry_point('mopack', 'mopack.usage', type)
+        return load_plugin('mopack.usage', type)
     except ImportError:
         raise FieldValueError('unknown usage {!r}'.format(type), field)
 
@@ -28,6 +27,13 @@ class Usage(OptionsHolder):
     def __init__(self, pkg, *, inherit_defaults=False):
         super().__init__(pkg._options)
 
+    @classmethod
+    def prefetch_versions(cls, metadata, items):
+        # Probe the versions of many `(usage, package)` pairs of this type at
+        # once, storing the results in `metadata.version_probes` for
+        # `version()` to use.
+        pass
+
     def version(self, metadata, pkg):
         raise NotImplementedError('Usage.version not implemented')
 
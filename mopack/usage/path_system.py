@@ -1,3 +1,5 @@
+import hashlib
+import json
 import os
 import re
 import subprocess
@@ -10,10 +12,13 @@ from ..environment import get_pkg_config, subprocess_run
 from ..freezedried import DictFreezeDryer, FreezeDried, ListFreezeDryer
 from ..iterutils import ismapping, listify, uniques
 from ..package_defaults import DefaultResolver
-from ..path import file_outdated, isfile, Path
-from ..pkg_config import generated_pkg_config_dir, write_pkg_config
+from ..path import Path
+from ..pkg_config import (generated_pkg_config_dir, probe_versions,
+                          read_fingerprint, version_probe_key,
+                          write_pkg_config)
 from ..shell import ShellArguments, split_paths
 from ..types import dependency_string, Unset
+from ..yaml_tools import MarkedJSONEncoder
 
 
 # XXX: Getting build configuration like this from the environment is a bit
@@ -31,6 +36,36 @@ def _system_lib_names(env=os.environ):
     return split_paths(env.get('MOPACK_LIB_NAMES'))
 
 
+class _FingerprintEncoder(MarkedJSONEncoder):
+    def default(self, thing):
+        if hasattr(thing, 'dehydrate'):
+            return thing.dehydrate()
+        return super().default(thing)
+
+
+class _LazyVersion:
+    # A package's version, which can be slow to compute (e.g. if it requires
+    # querying the system package manager), so only get it when we actually
+    # need it. `stamp` is a cheap stand-in for the version that changes
+    # whenever the version might have.
+
+    def __init__(self, stamp, get):
+        self.stamp = stamp
+        self._get = get
+
+    @property
+    def value(self):
+        if self._get is not None:
+            self._value = self._get()
+            self._get = None
+        return self._value
+
+
+def _system_path_vars(env=os.environ):
+    return {k: env.get(k) for k in ('MOPACK_INCLUDE_PATH', 'MOPACK_LIB_PATH',
+                                    'MOPACK_LIB_NAMES')}
+
+
 def _library(field, value):
     try:
         return types.string(field, value)
@@ -227,7 +262,7 @@ class PathUsage(Usage):
         return list(filtered.keys())
 
     @classmethod
-    def _include_dirs(cls, headers, include_path, path_vars):
+    def _include_dirs(cls, isfile, headers, include_path, path_vars):
         headers = listify(headers, scalar_ok=False)
         include_path = (listify(include_path, scalar_ok=False) or
                         _system_include_path())
@@ -237,7 +272,8 @@ class PathUsage(Usage):
         )
 
     @classmethod
-    def _library_dirs(cls, auto_link, libraries, library_path, path_vars):
+    def _library_dirs(cls, isfile, auto_link, libraries, library_path,
+                      path_vars):
         library_path = (listify(library_path, scalar_ok=False)
                         or _system_lib_path())
         if auto_link:
@@ -284,11 +320,47 @@ class PathUsage(Usage):
         else:
             return pkg.guessed_version(metadata)
 
+    def _version_stamp(self, metadata, pkg, include_dirs, path_vars):
+        if ismapping(self.explicit_version):
+            # Check every header that `_get_version()` might read.
+            stamp = []
+            for path in include_dirs:
+                header = path.append(self.explicit_version['file']).string(
+                    **path_vars
+                )
+                try:
+                    stat = os.stat(header)
+                except FileNotFoundError:
+                    continue
+                stamp.append([header, stat.st_mtime_ns, stat.st_size])
+            return stamp
+        elif self.explicit_version is not None:
+            return self.explicit_version
+        else:
+            return pkg.guessed_version_stamp(metadata)
+
+    def _fingerprint(self, pcname, version, requires, mappings, path_values,
+                     include_dirs, library_dirs):
+        # Hash everything that goes into generating a .pc file so that we only
+        # regenerate it when something relevant has changed.
+        data = json.dumps({
+            'pcname': pcname,
+            'version': version.stamp,
+            'requires': requires,
+            'mappings': [i.dehydrate() for i in mappings],
+            'path_values': path_values,
+            'system_paths': _system_path_vars(),
+            'include_dirs': include_dirs,
+            'library_dirs': library_dirs,
+        }, sort_keys=True, cls=_FingerprintEncoder)
+        return hashlib.sha256(data.encode('utf-8')).hexdigest()
+
     def version(self, metadata, pkg):
         path_values = pkg.path_values(metadata, builder=True)
         try:
             include_dirs = self._include_dirs(
-                self.headers, self.include_path, path_values
+                metadata.dir_cache.isfile, self.headers, self.include_path,
+                path_values
             )
         except ValueError:  # pragma: no cover
             # XXX: This is a hack to work around the fact that we currently
@@ -300,7 +372,7 @@ class PathUsage(Usage):
         return self._get_version(metadata, pkg, include_dirs, path_values)
 
     def _write_pkg_config(self, metadata, pkg, submodule=None, version=None,
-                          requires=[], mappings=None, *, get_version=False):
+                          requires=[], mappings=None):
         if mappings is None:
             mappings = [self]
 
@@ -318,32 +390,34 @@ class PathUsage(Usage):
         deps_requires = []
         deps_paths = [pkgconfdir]
         for dep_pkg, dep_sub in chain_attr('dependencies'):
-            # XXX: Cache usage so we don't repeatedly process the same package.
-            usage = metadata.get_package(dep_pkg).get_usage(metadata, dep_sub)
+            usage = metadata.get_usage(dep_pkg, dep_sub)
 
             auto_link |= usage.get('auto_link', False)
             deps_requires.extend(usage.get('pcnames', []))
             deps_paths.extend(usage.get('pkg_config_path', []))
 
-        should_write = file_outdated(pcpath, metadata.path)
-
-        if should_write or get_version:
-            # Get the version so we can sync it across all submodules.
-            include_dirs = self._include_dirs(
-                chain_attr('headers'), chain_attr('include_path'), path_values
+        requires = requires + deps_requires
+        include_dirs = self._include_dirs(
+            metadata.dir_cache.isfile, chain_attr('headers'),
+            chain_attr('include_path'), path_values
+        )
+        libraries = list(chain_attr('libraries'))
+        library_dirs = self._library_dirs(
+            metadata.dir_cache.isfile, self.auto_link, libraries,
+            chain_attr('library_path'), path_values
+        )
+        if version is None:
+            version = _LazyVersion(
+                self._version_stamp(metadata, pkg, include_dirs, path_values),
+                lambda: self._get_version(metadata, pkg, include_dirs,
+                                          path_values)
             )
-            if get_version or version is None:
-                version = self._get_version(metadata, pkg, include_dirs,
-                                            path_values)
 
-        if should_write:
+        fingerprint = self._fingerprint(pcname, version, requires, mappings,
+                                        path_values, include_dirs,
+                                        library_dirs)
+        if read_fingerprint(pcpath) != fingerprint:
             # Generate the pkg-config data...
-            libraries = list(chain_attr('libraries'))
-            library_dirs = self._library_dirs(
-                self.auto_link, libraries, chain_attr('library_path'),
-                path_values
-            )
-
             cflags = (
                 [('-I', i) for i in include_dirs] +
                 ShellArguments(chain_attr('compile_flags'))
@@ -357,16 +431,14 @@ class PathUsage(Usage):
             # ... and write it.
             os.makedirs(pkgconfdir, exist_ok=True)
             with open(pcpath, 'w') as f:
-                write_pkg_config(f, pcname, version=version,
-                                 requires=requires + deps_requires,
-                                 cflags=cflags, libs=libs,
-                                 variables=path_values)
-
-        result = {'auto_link': auto_link, 'pcname': pcname,
-                  'pkg_config_path': uniques(deps_paths)}
-        if get_version:
-            result['version'] = version
-        return result
+                write_pkg_config(f, pcname, version=version.value,
+                                 requires=requires, cflags=cflags, libs=libs,
+                                 variables=path_values,
+                                 fingerprint=fingerprint)
+
+        # Return the version too so we can sync it across all submodules.
+        return {'auto_link': auto_link, 'pcname': pcname,
+                'pkg_config_path': uniques(deps_paths), 'version': version}
 
     def get_usage(self, metadata, pkg, submodules):
         if submodules and self.submodule_map:
@@ -380,7 +452,7 @@ class PathUsage(Usage):
                 mappings = [self]
             else:
                 mappings = []
-                data = self._write_pkg_config(metadata, pkg, get_version=True)
+                data = self._write_pkg_config(metadata, pkg)
                 auto_link |= data['auto_link']
                 requires.append(data['pcname'])
                 pkgconfpath.extend(data['pkg_config_path'])
@@ -440,8 +512,20 @@ class SystemUsage(PathUsage):
         T = types.TypeCheck(locals(), symbols)
         T.pcname(pkg_default(types.string, default=pkg.name))
 
+    @classmethod
+    def prefetch_versions(cls, metadata, items):
+        probe_versions(metadata, [(i._common_options.env, i.pcname)
+                                  for i, pkg in items])
+
     def version(self, metadata, pkg):
-        pkg_config = get_pkg_config(self._common_options.env)
+        env = self._common_options.env
+        probed = metadata.version_probes.get(version_probe_key(
+            env, self.pcname
+        ))
+        if probed is not None:
+            return probed
+
+        pkg_config = get_pkg_config(env)
         try:
             # XXX: Make sure this works when submodules are required.
             return subprocess_run(
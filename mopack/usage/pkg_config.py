@@ -9,6 +9,7 @@ from ..freezedried import DictFreezeDryer, FreezeDried, ListFreezeDryer
 from ..iterutils import listify
 from ..package_defaults import DefaultResolver
 from ..path import Path
+from ..pkg_config import probe_versions, version_probe_key
 from ..shell import join_paths
 
 
@@ -91,13 +92,26 @@ class PkgConfigUsage(Usage):
                 evaluate=False
             ), evaluate=False)
 
-    def version(self, metadata, pkg):
-        pkg_config = get_pkg_config(self._common_options.env)
+    def _version_env(self, metadata, pkg):
         path_values = pkg.path_values(metadata, builder=True)
         pkgconfpath = [i.string(**path_values) for i in self.pkg_config_path]
-        env = ChainMap({'PKG_CONFIG_PATH': join_paths(pkgconfpath)},
-                       self._common_options.env)
+        return ChainMap({'PKG_CONFIG_PATH': join_paths(pkgconfpath)},
+                        self._common_options.env)
+
+    @classmethod
+    def prefetch_versions(cls, metadata, items):
+        probe_versions(metadata, [(i._version_env(metadata, pkg), i.pcname)
+                                  for i, pkg in items])
 
+    def version(self, metadata, pkg):
+        env = self._version_env(metadata, pkg)
+        probed = metadata.version_probes.get(version_probe_key(
+            env, self.pcname
+        ))
+        if probed is not None:
+            return probed
+
+        pkg_config = get_pkg_config(self._common_options.env)
         return subprocess_run(
             pkg_config + [self.pcname, '--modversion'], check=True,
             stdout=subprocess.PIPE, universal_newlines=True, env=env
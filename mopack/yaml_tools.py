@@ -34,7 +34,13 @@ from yaml.constructor import ConstructorError
 
 from .exceptions import ConfigurationError
 
-__all__ = ['load_file', 'make_parse_error', 'to_parse_error', 'MarkedDict',
+try:
+    from yaml import CSafeLoader
+except ImportError:  # pragma: no cover
+    CSafeLoader = None
+
+__all__ = ['CSafeLineLoader', 'FastSafeLineLoader', 'load_file',
+           'make_parse_error', 'to_parse_error', 'MarkedDict',
            'MarkedJSONEncoder', 'MarkedList', 'MarkedYAMLOffsetError',
            'SafeLineLoader', 'YamlParseError']
 
@@ -154,6 +160,14 @@ class MarkRange(namedtuple('MarkRange', ['start', 'end'])):
     def __new__(self, node):
         return super().__new__(self, node.start_mark, node.end_mark)
 
+    def __reduce__(self):
+        # Our constructor takes a node, so we need to unpickle differently.
+        return (_make_mark_range, tuple(self))
+
+
+def _make_mark_range(start, end):
+    return tuple.__new__(MarkRange, (start, end))
+
 
 class MarkedCollection:
     def __init__(self, data, mark, marks):
@@ -285,7 +299,7 @@ class MarkedJSONEncoder(json.JSONEncoder):
         return super().default(thing)
 
 
-class SafeLineLoader(SafeLoader):
+class _LineConstructorMixin:
     def construct_yaml_seq(self, node):
         data = MarkedList()
         yield data
@@ -330,10 +344,24 @@ class SafeLineLoader(SafeLoader):
         return mapping
 
 
-SafeLineLoader.add_constructor('tag:yaml.org,2002:seq',
-                               SafeLineLoader.construct_yaml_seq)
-SafeLineLoader.add_constructor('tag:yaml.org,2002:map',
-                               SafeLineLoader.construct_yaml_map)
+def _make_line_loader(name, base):
+    loader = type(name, (_LineConstructorMixin, base), {})
+    loader.add_constructor('tag:yaml.org,2002:seq', loader.construct_yaml_seq)
+    loader.add_constructor('tag:yaml.org,2002:map', loader.construct_yaml_map)
+    return loader
+
+
+SafeLineLoader = _make_line_loader('SafeLineLoader', SafeLoader)
+
+# libyaml's parser produces the same nodes (and marks) as PyYAML's pure-Python
+# one, so we can build our marked collections on top of it too. This is
+# considerably faster, so use it for loading files whenever it's available.
+if CSafeLoader is not None:
+    CSafeLineLoader = _make_line_loader('CSafeLineLoader', CSafeLoader)
+    FastSafeLineLoader = CSafeLineLoader
+else:  # pragma: no cover
+    CSafeLineLoader = None
+    FastSafeLineLoader = SafeLineLoader
 
 
 # /!\ Hack Alert /!\
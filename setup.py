@@ -2,7 +2,11 @@ import json
 import os
 import re
 import subprocess
+import sys
+import tempfile
+import time
 from setuptools import setup, find_packages, Command
+from setuptools.command.build_py import build_py
 
 from mopack.app_version import version
 
@@ -61,7 +65,125 @@ class Coverage(Command):
                        stdout=subprocess.DEVNULL)
 
 
+class Benchmark(Command):
+    description = ('measure the startup time of `mopack usage` and the ' +
+                   'throughput of the expression parser and YAML loader')
+    user_options = [
+        ('runs=', None, 'number of times to run (default: 20)'),
+    ]
+
+    # A representative sample of the expressions found in mopack.yml files.
+    expressions = [
+        ('foo', False),
+        ('$srcdir/include', False),
+        ('${{ srcdir }}/lib/${{ host_platform }}', False),
+        ('-DFOO=${{ foo ? "on" : "off" }}', False),
+        ('target_platform == "linux"', True),
+        ('env["CC"] == "gcc" && !(deploy_dirs["prefix"] == null)', True),
+        ('(x[0] + 1) * -2 >= 4 || y != "bar"', True),
+    ]
+
+    def initialize_options(self):
+        self.runs = 20
+
+    def finalize_options(self):
+        self.runs = int(self.runs)
+
+    def _summarize(self, name, times):
+        times.sort()
+        print('{}: min {:.1f}ms, median {:.1f}ms, max {:.1f}ms'
+              .format(name, times[0] * 1000, times[len(times) // 2] * 1000,
+                      times[-1] * 1000))
+
+    def _startup(self):
+        # Query an empty package directory with `--strict` so that we measure
+        # the fixed cost of starting up, not the cost of finding a package.
+        script = 'import sys; from mopack.driver import main; sys.exit(main())'
+        with tempfile.TemporaryDirectory() as tmpdir:
+            args = [sys.executable, '-c', script, 'usage', '--json',
+                    '--strict', '--directory', tmpdir, 'foo']
+            times = []
+            for i in range(self.runs):
+                start = time.perf_counter()
+                subprocess.run(args, cwd=root_dir, stdout=subprocess.DEVNULL)
+                times.append(time.perf_counter() - start)
+        self._summarize('mopack usage', times)
+
+    def _parse(self):
+        # Bypass the parse cache so that we measure the parser itself.
+        from mopack.expression import _parse
+
+        count = 1000
+        times = []
+        for i in range(self.runs):
+            start = time.perf_counter()
+            for j in range(count):
+                for expr, if_context in self.expressions:
+                    _parse(expr, if_context)
+            times.append(time.perf_counter() - start)
+
+        self._summarize('parse {} expressions'.format(
+            count * len(self.expressions)
+        ), times)
+        print('parse: {:.0f} expressions/s'.format(
+            count * len(self.expressions) / times[len(times) // 2]
+        ))
+
+    def _yaml(self):
+        # Load a synthetic mopack.yml with lots of packages using both the
+        # pure-Python and the libyaml-based loaders.
+        import yaml
+        from mopack.yaml_tools import CSafeLineLoader, SafeLineLoader
+
+        data = 'packages:\n' + ''.join((
+            '  pkg{0}:\n'
+            '    source: git\n'
+            '    repository: https://example.invalid/pkg{0}.git\n'
+            '    rev: [tag, v1.{0}]\n'
+            '    build: bfg9000\n'
+            '    usage:\n'
+            '      type: pkg_config\n'
+            '      path: "${{{{ srcdir }}}}/pkgconfig"\n'
+        ).format(i) for i in range(5000))
+
+        loaders = [('SafeLineLoader', SafeLineLoader)]
+        if CSafeLineLoader is not None:
+            loaders.append(('CSafeLineLoader', CSafeLineLoader))
+        for name, loader in loaders:
+            times = []
+            for i in range(max(self.runs // 4, 1)):
+                start = time.perf_counter()
+                yaml.load(data, Loader=loader)
+                times.append(time.perf_counter() - start)
+            self._summarize('load 5000 packages ({})'.format(name), times)
+
+    def run(self):
+        self._startup()
+        self._parse()
+        self._yaml()
+
+
+class BuildPy(build_py):
+    def run(self):
+        super().run()
+
+        # Precompile the package defaults so that mopack doesn't need to parse
+        # them at runtime. If we can't import mopack's dependencies here,
+        # mopack will just parse each default file on demand instead.
+        try:
+            from mopack.package_defaults import save_bundle
+        except ImportError:  # pragma: no cover
+            return
+
+        defaults_dir = os.path.join(self.build_lib, 'mopack', 'defaults')
+        if not self.dry_run:
+            save_bundle(os.path.join(defaults_dir, 'bundle.pickle'),
+                        defaults_dir)
+
+
 custom_cmds = {
+    'benchmark': Benchmark,
+    'build_py': BuildPy,
     'coverage': Coverage,
 }
 
@@ -162,13 +284,13 @@ setup(
     packages=find_packages(exclude=['test', 'test.*']),
     package_data={'': ['defaults/*.yml']},
 
-    install_requires=['colorama', 'pyparsing >= 3.0', 'pyyaml', 'setuptools'],
+    install_requires=['colorama', 'pyyaml', 'setuptools'],
     extras_require={
         'dev': ['bfg9000', 'conan', 'coverage', 'flake8 >= 3.6',
                 'flake8-quotes', 'mike >= 0.3.1', 'mkdocs-bootswatch-classic',
-                'verspec', 'shtab'],
+                'pyparsing >= 3.0', 'verspec', 'shtab'],
         'test': ['bfg9000', 'conan', 'coverage', 'flake8 >= 3.6',
-                 'flake8-quotes', 'shtab'],
+                 'flake8-quotes', 'pyparsing >= 3.0', 'shtab'],
     },
 
     entry_points={
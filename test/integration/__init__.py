@@ -47,6 +47,21 @@ def slurp(filename):
         return f.read()
 
 
+def slurp_metadata(pkgdir):
+    # Load the metadata manifest and fill in the records it refers to, so that
+    # it's in the same form as the old, monolithic `mopack.json`.
+    def record(name):
+        return json.loads(slurp(os.path.join(pkgdir, 'metadata', name)))
+
+    state = json.loads(slurp(os.path.join(pkgdir, 'mopack.json')))
+    data = state['metadata']
+    state['metadata'] = {
+        'options': record(data['options']),
+        'packages': [record(i) for i in data['packages'].values()],
+    }
+    return state
+
+
 def cfg_common_options(*, strict=False, target_platform=platform_name(),
                        env=AlwaysEqual(), deploy_paths={}):
     return {'_version': 1, 'strict': strict,
@@ -94,42 +109,51 @@ def _cfg_package(source, api_version, name, config_file, parent=None,
     }
 
 
-def cfg_directory_pkg(name, config_file, *, path, builder, usage, **kwargs):
-    result = _cfg_package('directory', 1, name, config_file, **kwargs)
+def cfg_directory_pkg(name, config_file, *, path, builder, usage,
+                      build_fingerprint=AlwaysEqual(), **kwargs):
+    result = _cfg_package('directory', 2, name, config_file, **kwargs)
     result.update({
         'path': path,
         'builder': builder,
         'usage': usage,
+        'build_fingerprint': build_fingerprint,
     })
     return result
 
 
-def cfg_tarball_pkg(name, config_file, *, path=None, url=None, files=[],
-                    srcdir=None, guessed_srcdir=None, patch=None, builder,
-                    usage, **kwargs):
-    result = _cfg_package('tarball', 1, name, config_file, **kwargs)
+def cfg_tarball_pkg(name, config_file, *, path=None, url=None, sha256=None,
+                    files=[], srcdir=None, guessed_srcdir=None, patch=None,
+                    builder, usage, build_fingerprint=AlwaysEqual(),
+                    **kwargs):
+    result = _cfg_package('tarball', 3, name, config_file, **kwargs)
     result.update({
         'path': path,
         'url': url,
+        'sha256': sha256,
         'files': files,
         'srcdir': srcdir,
         'guessed_srcdir': guessed_srcdir,
         'patch': patch,
         'builder': builder,
         'usage': usage,
+        'build_fingerprint': build_fingerprint,
     })
     return result
 
 
-def cfg_git_pkg(name, config_file, *, repository, rev, srcdir='.', builder,
-                usage, **kwargs):
-    result = _cfg_package('git', 1, name, config_file, **kwargs)
+def cfg_git_pkg(name, config_file, *, repository, rev, srcdir='.',
+                sparse_paths=[], shallow=True, builder, usage,
+                build_fingerprint=AlwaysEqual(), **kwargs):
+    result = _cfg_package('git', 4, name, config_file, **kwargs)
     result.update({
         'repository': repository,
         'rev': rev,
         'srcdir': srcdir,
+        'sparse_paths': sparse_paths,
+        'shallow': shallow,
         'builder': builder,
         'usage': usage,
+        'build_fingerprint': build_fingerprint,
     })
     return result
 
@@ -146,13 +170,16 @@ def cfg_apt_pkg(name, config_file, *, remote, repository=None, usage,
 
 
 def cfg_conan_pkg(name, config_file, *, remote, build=False, options={}, usage,
-                  **kwargs):
-    result = _cfg_package('conan', 1, name, config_file, **kwargs)
+                  installed_version=AlwaysEqual(),
+                  install_digest=AlwaysEqual(), **kwargs):
+    result = _cfg_package('conan', 3, name, config_file, **kwargs)
     result.update({
         'remote': remote,
         'build': build,
         'options': options,
         'usage': usage,
+        'installed_version': installed_version,
+        'install_digest': install_digest,
     })
     return result
 
@@ -1,4 +1,3 @@
-import json
 import os
 from unittest import skipIf
 
@@ -21,7 +20,7 @@ class TestApt(IntegrationTest):
         self.assertPathUsage('zlib', type='system', version=AlwaysEqual(),
                              libraries=['z'])
 
-        output = json.loads(slurp('mopack/mopack.json'))
+        output = slurp_metadata('mopack')
         self.assertEqual(output['metadata'], {
             'options': cfg_options(),
             'packages': [
@@ -34,7 +34,7 @@ class TestBoost(IntegrationTest):
                                         else ['boost_regex']),
                              version=version)
 
-        output = json.loads(slurp('mopack/mopack.json'))
+        output = slurp_metadata('mopack')
         self.assertEqual(output['metadata'], {
             'options': cfg_options(),
             'packages': [
@@ -1,4 +1,3 @@
-import json
 import os
 
 from mopack.path import pushd
@@ -22,7 +21,7 @@ class TestBroken(IntegrationTest):
 
         self.assertUsage('hello', returncode=1)
 
-        output = json.loads(slurp('mopack/mopack.json'))
+        output = slurp_metadata('mopack')
         self.assertEqual(output['metadata'], {
             'options': cfg_options(
                 common={'deploy_paths': {'prefix': self.prefix}},
@@ -63,7 +62,7 @@ class TestBrokenPatch(IntegrationTest):
 
         self.assertUsage('hello', returncode=1)
 
-        output = json.loads(slurp('mopack/mopack.json'))
+        output = slurp_metadata('mopack')
         self.assertEqual(output['metadata'], {
             'options': cfg_options(
                 common={'deploy_paths': {'prefix': self.prefix}},
@@ -1,4 +1,3 @@
-import json
 import os
 
 from . import *
@@ -19,7 +18,7 @@ class TestConan(IntegrationTest):
             self.stage, 'mopack', 'conan'
         )])
 
-        output = json.loads(slurp('mopack/mopack.json'))
+        output = slurp_metadata('mopack')
         self.assertEqual(output['metadata'], {
             'options': cfg_options(
                 conan={'build': ['missing'], 'extra_args': ['-gtxt']}
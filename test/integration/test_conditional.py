@@ -1,4 +1,3 @@
-import json
 import os
 
 from mopack.platforms import platform_name
@@ -22,7 +21,7 @@ class TestConditional(IntegrationTest):
 
         self.assertPkgConfigUsage('hello')
 
-        output = json.loads(slurp('mopack/mopack.json'))
+        output = slurp_metadata('mopack')
         if want_tarball:
             hellopkg = cfg_tarball_pkg(
                 'hello', config,
@@ -1,4 +1,3 @@
-import json
 import os
 
 from mopack.path import pushd
@@ -20,7 +19,7 @@ class TestCustomBuilder(IntegrationTest):
 
         self.assertPkgConfigUsage('hello')
 
-        output = json.loads(slurp('mopack/mopack.json'))
+        output = slurp_metadata('mopack')
         self.assertEqual(output['metadata'], {
             'options': cfg_options(),
             'packages': [
@@ -62,7 +61,7 @@ class TestCustomBuilderDeploy(IntegrationTest):
 
         self.assertPkgConfigUsage('hello')
 
-        output = json.loads(slurp('mopack/mopack.json'))
+        output = slurp_metadata('mopack')
         self.assertEqual(output['metadata'], {
             'options': cfg_options(
                 common={'deploy_paths': {'prefix': self.prefix}}
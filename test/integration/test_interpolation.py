@@ -1,4 +1,3 @@
-import json
 import os
 
 from . import *
@@ -18,7 +17,7 @@ class TestInterpolation(IntegrationTest):
 
         self.assertPkgConfigUsage('hello')
 
-        output = json.loads(slurp('mopack/mopack.json'))
+        output = slurp_metadata('mopack')
         self.assertEqual(output['metadata'], {
             'options': cfg_options(bfg9000={}),
             'packages': [
@@ -43,7 +42,7 @@ class TestInterpolation(IntegrationTest):
 
         self.assertPkgConfigUsage('hello')
 
-        output = json.loads(slurp('mopack/mopack.json'))
+        output = slurp_metadata('mopack')
         self.assertEqual(output['metadata'], {
             'options': cfg_options(bfg9000={}),
             'packages': [
@@ -1,4 +1,3 @@
-import json
 import os
 import sys
 from textwrap import dedent
@@ -35,7 +34,7 @@ class TestNested(IntegrationTest):
         self.assertPkgConfigUsage('greeter')
         self.assertPkgConfigUsage('hello')
 
-        output = json.loads(slurp('mopack/mopack.json'))
+        output = slurp_metadata('mopack')
         self.assertEqual(output['metadata'], {
             'options': cfg_options(
                 common={'deploy_paths': {'prefix': self.prefix}},
@@ -98,7 +97,7 @@ class TestNested(IntegrationTest):
         self.assertPkgConfigUsage('greeter')
         self.assertPkgConfigUsage('hello')
 
-        output = json.loads(slurp('mopack/mopack.json'))
+        output = slurp_metadata('mopack')
         self.assertEqual(output['metadata'], {
             'options': cfg_options(
                 common={'deploy_paths': {'prefix': self.prefix}},
@@ -1,4 +1,3 @@
-import json
 import os
 
 from . import *
@@ -21,7 +20,7 @@ class TestSubmodules(IntegrationTest):
             )
         self.assertUsage('hello', returncode=1)
 
-        output = json.loads(slurp('mopack/mopack.json'))
+        output = slurp_metadata('mopack')
         self.assertEqual(output['metadata'], {
             'options': cfg_options(bfg9000={}),
             'packages': [
@@ -73,7 +72,7 @@ class TestSubmodulesPath(IntegrationTest):
             )
         self.assertUsage('hello', returncode=1)
 
-        output = json.loads(slurp('mopack/mopack.json'))
+        output = slurp_metadata('mopack')
         self.assertEqual(output['metadata'], {
             'options': cfg_options(bfg9000={}),
             'packages': [
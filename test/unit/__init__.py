@@ -1,15 +1,11 @@
 import json
 import os
-import pkg_resources
 from contextlib import contextmanager
 from io import StringIO
 from unittest import mock, TestCase
 
 from mopack.options import Options
-
-# Make sure the entry points are loaded so unit tests can reference them as
-# needed.
-pkg_resources.get_entry_map('mopack')
+from mopack.plugins import builtin_plugins, load_plugin
 
 
 @contextmanager
@@ -74,6 +70,9 @@ class MockPackage:
     def guessed_version(self, pkgdir):
         return self._version
 
+    def guessed_version_stamp(self, pkgdir):
+        return self._version
+
 
 def through_json(data, *args, **kwargs):
     return json.loads(json.dumps(data, *args, **kwargs))
@@ -93,13 +92,13 @@ class OptionsTest(TestCase):
         with mock.patch.object(os, 'environ', return_value={}):
             options.common.finalize()
 
-        for i in pkg_resources.iter_entry_points('mopack.sources'):
-            opts_type = i.load().Options
+        for i in builtin_plugins['mopack.sources']:
+            opts_type = load_plugin('mopack.sources', i).Options
             if opts_type:
                 options.sources[opts_type.source] = opts_type()
 
-        for i in pkg_resources.iter_entry_points('mopack.builders'):
-            opts_type = i.load().Options
+        for i in builtin_plugins['mopack.builders']:
+            opts_type = load_plugin('mopack.builders', i).Options
             if opts_type:
                 options.builders[opts_type.type] = opts_type()
 
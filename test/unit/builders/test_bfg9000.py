@@ -20,7 +20,6 @@ class TestBfg9000Builder(BuilderTest):
             pkg = MockPackage(srcdir=self.srcdir, _options=self.make_options())
         builddir = os.path.join(self.pkgdir, 'build', 'foo')
         with mock_open_log() as mopen, \
-             mock.patch('mopack.builders.bfg9000.pushd'), \
              mock.patch('subprocess.run') as mcall:
             builder.build(self.metadata, pkg)
             mopen.assert_called_with(os.path.join(
@@ -29,11 +28,11 @@ class TestBfg9000Builder(BuilderTest):
             mcall.assert_any_call(
                 ['bfg9000', 'configure', builddir] + extra_args,
                 stdout=subprocess.PIPE, stderr=subprocess.STDOUT,
-                universal_newlines=True, check=True, env={}
+                universal_newlines=True, check=True, env={}, cwd=self.srcdir
             )
             mcall.assert_called_with(
                 ['ninja'], stdout=subprocess.PIPE, stderr=subprocess.STDOUT,
-                universal_newlines=True, check=True, env={}
+                universal_newlines=True, check=True, env={}, cwd=builddir
             )
 
     def test_basic(self):
@@ -41,10 +40,10 @@ class TestBfg9000Builder(BuilderTest):
         builder = self.make_builder(pkg)
         self.assertEqual(builder.name, 'foo')
         self.assertEqual(builder.extra_args, ShellArguments())
+        self.assertEqual(builder.artifact_dirs(), ('builddir',))
         self.check_build(builder)
 
         with mock_open_log() as mopen, \
-             mock.patch('mopack.builders.bfg9000.pushd'), \
              mock.patch('subprocess.run') as mcall:
             builder.deploy(self.metadata, pkg)
             mopen.assert_called_with(os.path.join(
@@ -53,7 +52,8 @@ class TestBfg9000Builder(BuilderTest):
             mcall.assert_called_with(
                 ['ninja', 'install'], stdout=subprocess.PIPE,
                 stderr=subprocess.STDOUT, universal_newlines=True,
-                check=True, env={}
+                check=True, env={},
+                cwd=os.path.join(self.pkgdir, 'build', 'foo')
             )
 
     def test_extra_args(self):
@@ -1,12 +1,13 @@
 import os
 import subprocess
-from unittest import mock
+from unittest import mock, skipIf
 
 from . import BuilderTest, MockPackage, OptionsTest, through_json
 from .. import mock_open_log
 
 from mopack.builders import Builder, BuilderOptions
 from mopack.builders.cmake import CMakeBuilder
+from mopack.jobserver import Jobserver
 from mopack.shell import ShellArguments
 from mopack.sources.sdist import DirectoryPackage
 from mopack.types import Unset
@@ -18,8 +19,8 @@ class TestCMakeBuilder(BuilderTest):
     def check_build(self, builder, extra_args=[], *, pkg=None):
         if pkg is None:
             pkg = MockPackage(srcdir=self.srcdir, _options=self.make_options())
+        builddir = os.path.join(self.pkgdir, 'build', 'foo')
         with mock_open_log() as mopen, \
-             mock.patch('mopack.builders.cmake.pushd'), \
              mock.patch('subprocess.run') as mcall:
             builder.build(self.metadata, pkg)
             mopen.assert_called_with(os.path.join(
@@ -28,11 +29,11 @@ class TestCMakeBuilder(BuilderTest):
             mcall.assert_any_call(
                 ['cmake', self.srcdir, '-G', 'Ninja'] + extra_args,
                 stdout=subprocess.PIPE, stderr=subprocess.STDOUT,
-                universal_newlines=True, check=True, env={}
+                universal_newlines=True, check=True, env={}, cwd=builddir
             )
             mcall.assert_called_with(
                 ['ninja'], stdout=subprocess.PIPE, stderr=subprocess.STDOUT,
-                universal_newlines=True, check=True, env={}
+                universal_newlines=True, check=True, env={}, cwd=builddir
             )
 
     def test_basic(self):
@@ -40,10 +41,10 @@ class TestCMakeBuilder(BuilderTest):
         builder = self.make_builder(pkg)
         self.assertEqual(builder.name, 'foo')
         self.assertEqual(builder.extra_args, ShellArguments())
+        self.assertEqual(builder.artifact_dirs(), ('builddir',))
         self.check_build(builder)
 
         with mock_open_log() as mopen, \
-             mock.patch('mopack.builders.cmake.pushd'), \
              mock.patch('subprocess.run') as mcall:
             builder.deploy(self.metadata, pkg)
             mopen.assert_called_with(os.path.join(
@@ -52,9 +53,44 @@ class TestCMakeBuilder(BuilderTest):
             mcall.assert_called_with(
                 ['ninja', 'install'],
                 stdout=subprocess.PIPE, stderr=subprocess.STDOUT,
-                universal_newlines=True, check=True, env={}
+                universal_newlines=True, check=True, env={},
+                cwd=os.path.join(self.pkgdir, 'build', 'foo')
             )
 
+    @skipIf(not Jobserver.supported, 'named pipes unsupported')
+    def test_jobserver(self):
+        pkg = MockPackage(srcdir=self.srcdir, _options=self.make_options())
+        builder = self.make_builder(pkg)
+        builddir = os.path.join(self.pkgdir, 'build', 'foo')
+
+        def check_ninja(jobs):
+            with mock_open_log(), \
+                 mock.patch('subprocess.run') as mcall:
+                builder.build(self.metadata, pkg)
+                env = mcall.call_args[1]['env']
+                mcall.assert_called_with(
+                    ['ninja', '-j', str(jobs)], stdout=subprocess.PIPE,
+                    stderr=subprocess.STDOUT, universal_newlines=True,
+                    check=True, env=env, cwd=builddir,
+                    pass_fds=jobserver.pass_fds
+                )
+                self.assertEqual(env['MAKEFLAGS'], jobserver.makeflags)
+
+        with Jobserver(4) as jobserver:
+            self.metadata.jobserver = jobserver
+            try:
+                # Ninja can use every slot that isn't already taken.
+                with jobserver.slot():
+                    check_ninja(4)
+                    with jobserver.slot():
+                        check_ninja(3)
+
+                # Ninja should give back the slots it took.
+                with jobserver.slot():
+                    check_ninja(4)
+            finally:
+                self.metadata.jobserver = None
+
     def test_extra_args(self):
         builder = self.make_builder('foo', extra_args='--extra args')
         self.assertEqual(builder.name, 'foo')
@@ -15,7 +15,8 @@ from mopack.sources.sdist import DirectoryPackage
 class TestCustomBuilder(BuilderTest):
     builder_type = CustomBuilder
 
-    def check_build(self, builder, build_commands=None, *, pkg=None):
+    def check_build(self, builder, build_commands=None, *, pkg=None,
+                    cwd=None):
         if pkg is None:
             pkg = MockPackage(srcdir=self.srcdir, _options=self.make_options())
         if build_commands is None:
@@ -24,16 +25,17 @@ class TestCustomBuilder(BuilderTest):
                               for i in builder.build_commands]
 
         with mock_open_log() as mopen, \
-             mock.patch('mopack.builders.custom.pushd'), \
              mock.patch('subprocess.run') as mcall:
             builder.build(self.metadata, pkg)
             mopen.assert_called_with(os.path.join(
                 self.pkgdir, 'logs', 'foo.log'
             ), 'a')
-            for line in build_commands:
+            if cwd is None:
+                cwd = [self.srcdir] * len(build_commands)
+            for line, line_cwd in zip(build_commands, cwd):
                 mcall.assert_any_call(
                     line, stdout=subprocess.PIPE, stderr=subprocess.STDOUT,
-                    universal_newlines=True, check=True, env={}
+                    universal_newlines=True, check=True, env={}, cwd=line_cwd
                 )
 
     def test_basic(self):
@@ -46,6 +48,7 @@ class TestCustomBuilder(BuilderTest):
             ShellArguments(['make']),
         ])
         self.assertEqual(builder.deploy_commands, [])
+        self.assertEqual(builder.artifact_dirs(), ('srcdir', 'builddir'))
         self.check_build(builder)
 
     def test_build_list(self):
@@ -90,7 +93,6 @@ class TestCustomBuilder(BuilderTest):
         self.check_build(builder)
 
         with mock_open_log() as mopen, \
-             mock.patch('mopack.builders.custom.pushd'), \
              mock.patch('subprocess.run') as mcall:
             builder.deploy(self.metadata, pkg)
             mopen.assert_called_with(os.path.join(
@@ -99,7 +101,8 @@ class TestCustomBuilder(BuilderTest):
             mcall.assert_called_with(
                 ['make', 'install'], stdout=subprocess.PIPE,
                 stderr=subprocess.STDOUT, universal_newlines=True,
-                check=True, env={}
+                check=True, env={},
+                cwd=os.path.join(self.pkgdir, 'build', 'foo')
             )
 
     def test_cd(self):
@@ -120,15 +123,14 @@ class TestCustomBuilder(BuilderTest):
             self.check_build(builder, build_commands=[
                 ['configure', self.srcdir + '/build'],
                 ['make'],
-            ])
-            mcd.assert_called_once_with(builddir)
+            ], cwd=[self.srcdir, builddir])
+            mcd.assert_not_called()
 
     def test_cd_invalid(self):
         pkg = MockPackage(srcdir=self.srcdir, _options=self.make_options())
         builder = self.make_builder(pkg, build_commands=['cd foo bar'])
 
         with mock_open_log(), \
-             mock.patch('mopack.builders.custom.pushd'), \
              self.assertRaises(RuntimeError):
             builder.build(self.metadata, pkg)
 
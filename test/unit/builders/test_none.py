@@ -25,6 +25,7 @@ class TestNoneBuilder(BuilderTest):
         pkg = MockPackage(srcdir=self.srcdir, _options=self.make_options())
         builder = self.make_builder(pkg)
         self.assertEqual(builder.name, 'foo')
+        self.assertEqual(builder.artifact_dirs(), ())
         self.check_build(builder)
 
         with mock.patch('subprocess.run') as mcall:
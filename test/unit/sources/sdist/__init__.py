@@ -29,15 +29,14 @@ class SDistTestCase(SourceTest):
                      'pkg_config_path': [self.pkgconfdir('foo')]}
 
         with mock_open_log() as mopen, \
-             mock.patch('mopack.builders.bfg9000.pushd'), \
              mock.patch('subprocess.run'):
             pkg.resolve(self.metadata)
             mopen.assert_called_with(os.path.join(
                 self.pkgdir, 'logs', 'foo.log'
             ), 'a')
 
-        with mock.patch('mopack.usage.path_system.file_outdated',
-                        return_value=False):
+        with mock.patch('mopack.usage.path_system.read_fingerprint',
+                        return_value=mock.ANY):
             self.assertEqual(pkg.get_usage(self.metadata, submodules), usage)
 
     def make_builder(self, builder_type, pkg, **kwargs):
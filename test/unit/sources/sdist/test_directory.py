@@ -94,8 +94,8 @@ class TestDirectory(SDistTestCase):
              mock.patch('os.makedirs'), \
              mock.patch('mopack.usage.path_system.PathUsage._filter_path',
                         lambda *args: []), \
-             mock.patch('mopack.usage.path_system.file_outdated',
-                        return_value=True), \
+             mock.patch('mopack.usage.path_system.read_fingerprint',
+                        return_value=None), \
              mock.patch('builtins.open'):
             self.check_resolve(pkg, usage={
                 'name': 'foo', 'type': 'system', 'generated': True,
@@ -117,8 +117,7 @@ class TestDirectory(SDistTestCase):
             self.assertEqual(pkg, self.make_package(
                 'foo', path=self.srcpath, build='cmake', usage='pkg_config'
             ))
-        with mock.patch('mopack.builders.cmake.pushd'):
-            self.check_resolve(pkg)
+        self.check_resolve(pkg)
 
     def test_infer_submodules(self):
         data = 'export:\n  submodules: [french, english]\n  build: bfg9000'
@@ -307,6 +306,19 @@ class TestDirectory(SDistTestCase):
         with self.assertRaises(ValueError):
             pkg.get_usage(self.metadata, ['invalid'])
 
+    def test_always_build(self):
+        pkg = self.make_package('foo', path=self.srcpath, build='bfg9000')
+        self.assertEqual(pkg._build_fingerprint(self.metadata), None)
+
+        for i in range(2):
+            with mock_open_log(), \
+                 mock.patch('os.path.isdir', return_value=True), \
+                 mock.patch('mopack.builders.bfg9000.Bfg9000Builder.build') \
+                 as m:
+                pkg.resolve(self.metadata)
+                m.assert_called_once_with(self.metadata, pkg)
+            self.assertEqual(pkg.build_fingerprint, None)
+
     def test_deploy(self):
         deploy_paths = {'prefix': '/usr/local'}
         pkg = self.make_package('foo', path=self.srcpath, build='bfg9000',
@@ -314,7 +326,6 @@ class TestDirectory(SDistTestCase):
         self.assertEqual(pkg.should_deploy, True)
 
         with mock_open_log() as mopen, \
-             mock.patch('mopack.builders.bfg9000.pushd'), \
              mock.patch('subprocess.run') as mrun:
             pkg.resolve(self.metadata)
             mopen.assert_called_with(os.path.join(
@@ -324,11 +335,10 @@ class TestDirectory(SDistTestCase):
             mrun.assert_any_call(
                 ['bfg9000', 'configure', builddir, '--prefix', '/usr/local'],
                 stdout=subprocess.PIPE, stderr=subprocess.STDOUT,
-                universal_newlines=True, check=True, env={}
+                universal_newlines=True, check=True, env={}, cwd=self.srcpath
             )
 
         with mock_open_log() as mopen, \
-             mock.patch('mopack.builders.bfg9000.pushd'), \
              mock.patch('subprocess.run'):
             pkg.deploy(self.metadata)
             mopen.assert_called_with(os.path.join(
@@ -478,6 +488,7 @@ class TestDirectory(SDistTestCase):
                                side_effect=DirectoryPackage.upgrade) as m:
             pkg = Package.rehydrate(data, _options=opts)
             self.assertIsInstance(pkg, DirectoryPackage)
+            self.assertEqual(pkg.build_fingerprint, None)
             m.assert_called_once()
 
     def test_builder_types(self):
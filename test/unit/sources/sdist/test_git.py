@@ -6,11 +6,12 @@ from . import *
 from .... import *
 
 from mopack.builders.bfg9000 import Bfg9000Builder
+from mopack.cache import git_mirror_path
 from mopack.config import Config
 from mopack.sources import Package
 from mopack.sources.apt import AptPackage
 from mopack.sources.sdist import GitPackage
-from mopack.types import ConfigurationError
+from mopack.types import ConfigurationError, FieldError
 
 
 def mock_exists(p):
@@ -26,23 +27,34 @@ class TestGit(SDistTestCase):
         super().setUp()
         self.config = Config([])
 
-    def check_fetch(self, pkg):
+    def check_fetch(self, pkg, sparse_paths=[]):
         srcdir = os.path.join(self.pkgdir, 'src', 'foo')
-        git_cmds = [['git', 'clone', pkg.repository, srcdir]]
+        sparse_args = ['--sparse'] if sparse_paths else []
         if pkg.rev[0] in ['branch', 'tag']:
-            git_cmds[0].extend(['--branch', pkg.rev[1]])
+            filter_args = ['--filter=blob:none'] if sparse_paths else []
+            git_cmds = [(['git', 'clone', '--depth', '1'] + filter_args +
+                         sparse_args + ['--branch', pkg.rev[1],
+                                        pkg.repository, srcdir], {})]
         else:
-            git_cmds.append(['git', 'checkout', pkg.rev[1]])
+            git_cmds = [(['git', 'clone', '--filter=blob:none'] +
+                         sparse_args + ['--no-checkout', pkg.repository,
+                                        srcdir], {})]
+        if sparse_paths:
+            git_cmds.append((['git', 'sparse-checkout', 'set', '--cone'] +
+                             sparse_paths, {'cwd': srcdir}))
+        if pkg.rev[0] == 'commit':
+            git_cmds.append((['git', 'checkout', pkg.rev[1]],
+                             {'cwd': srcdir}))
 
         with mock_open_log(), \
-             mock.patch('mopack.sources.sdist.pushd'), \
              mock.patch('subprocess.run') as mrun:
             pkg.fetch(self.metadata, self.config)
             mrun.assert_has_calls([
                 mock.call(i, stdout=subprocess.PIPE, stderr=subprocess.STDOUT,
-                          universal_newlines=True, check=True, env={})
-                for i in git_cmds
+                          universal_newlines=True, check=True, env={}, **kw)
+                for i, kw in git_cmds
             ], any_order=True)
+            self.assertEqual(mrun.call_count, len(git_cmds))
 
     def test_url(self):
         pkg = self.make_package('foo', repository=self.srcurl, build='bfg9000')
@@ -123,17 +135,182 @@ class TestGit(SDistTestCase):
                               branch='mybranch', commit='abcdefg',
                               build='bfg9000')
 
+    def test_not_shallow(self):
+        srcdir = os.path.join(self.pkgdir, 'src', 'foo')
+        for rev, clone_args in [({'tag': 'v1.0'}, ['--branch', 'v1.0']),
+                                ({'commit': 'abcdefg'}, ['--no-checkout'])]:
+            pkg = self.make_package('foo', repository=self.srcssh,
+                                    shallow=False, build='bfg9000', **rev)
+            self.assertEqual(pkg.shallow, False)
+            with mock_open_log(), \
+                 mock.patch('subprocess.run') as mrun:
+                pkg.fetch(self.metadata, self.config)
+                mrun.assert_any_call(
+                    ['git', 'clone'] + clone_args + [self.srcssh, srcdir],
+                    stdout=subprocess.PIPE, stderr=subprocess.STDOUT,
+                    universal_newlines=True, check=True, env={}
+                )
+
+    def test_local_path(self):
+        pkg = self.make_package('foo', repository='../repo', build='bfg9000')
+        repo = os.path.join(os.path.abspath('/path/to'), '..', 'repo')
+        srcdir = os.path.join(self.pkgdir, 'src', 'foo')
+        with mock_open_log(), \
+             mock.patch('subprocess.run') as mrun:
+            pkg.fetch(self.metadata, self.config)
+            mrun.assert_called_once_with(
+                ['git', 'clone', '--depth', '1', '--branch', 'master', repo,
+                 srcdir],
+                stdout=subprocess.PIPE, stderr=subprocess.STDOUT,
+                universal_newlines=True, check=True, env={}
+            )
+
+    def test_clone_failed(self):
+        pkg = self.make_package('foo', repository=self.srcssh,
+                                build='bfg9000')
+        srcdir = os.path.join(self.pkgdir, 'src', 'foo')
+        with mock_open_log(), \
+             mock.patch('subprocess.run',
+                        side_effect=subprocess.CalledProcessError(1, 'git')), \
+             mock.patch('shutil.rmtree') as mrmtree:
+            with self.assertRaises(subprocess.SubprocessError):
+                pkg.fetch(self.metadata, self.config)
+            mrmtree.assert_called_once_with(srcdir, ignore_errors=True)
+
+    def check_mirror_fetch(self, pkg, mirror_exists, has_rev, git_cmds):
+        env = {'MOPACK_CACHE_DIR': '/cache', 'MOPACK_GIT_MIRRORS': '1'}
+        mirror = git_mirror_path(env, self.srcssh)
+        srcdir = os.path.join(self.pkgdir, 'src', 'foo')
+
+        def exists(p):
+            return p == mirror and mirror_exists
+
+        def run(args, **kwargs):
+            if args[1] == 'rev-parse':
+                return subprocess.CompletedProcess(args, 0 if has_rev else 1)
+            return subprocess.CompletedProcess(args, 0, '')
+
+        with mock_open_log(), \
+             mock.patch('os.path.exists', exists), \
+             mock.patch('os.makedirs'), \
+             mock.patch('os.rename') as mrename, \
+             mock.patch('shutil.rmtree'), \
+             mock.patch('tempfile.mkdtemp', return_value='/cache/git/tmp'), \
+             mock.patch('subprocess.run', side_effect=run) as mrun:
+            pkg.fetch(self.metadata, self.config)
+            calls = [i for i in mrun.mock_calls if i[1][0][1] != 'rev-parse']
+            self.assertEqual(calls, [
+                mock.call(i, stdout=subprocess.PIPE, stderr=subprocess.STDOUT,
+                          universal_newlines=True, check=True, env=env, **kw)
+                for i, kw in git_cmds(mirror, srcdir)
+            ])
+            if mirror_exists:
+                mrename.assert_not_called()
+            else:
+                mrename.assert_called_once_with('/cache/git/tmp', mirror)
+
+    def test_mirror(self):
+        env = {'MOPACK_CACHE_DIR': '/cache', 'MOPACK_GIT_MIRRORS': '1'}
+        pkg = self.make_package('foo', repository=self.srcssh, tag='v1.0',
+                                build='bfg9000', common_options={'env': env})
+
+        # New mirror.
+        self.check_mirror_fetch(pkg, False, False, lambda mirror, srcdir: [
+            (['git', 'clone', '--mirror', self.srcssh, '/cache/git/tmp'], {}),
+            (['git', 'clone', '--branch', 'v1.0', mirror, srcdir], {}),
+            (['git', 'remote', 'set-url', 'origin', self.srcssh],
+             {'cwd': srcdir}),
+        ])
+
+        # Existing mirror without our tag.
+        self.check_mirror_fetch(pkg, True, False, lambda mirror, srcdir: [
+            (['git', 'remote', 'update', '--prune'], {'cwd': mirror}),
+            (['git', 'clone', '--branch', 'v1.0', mirror, srcdir], {}),
+            (['git', 'remote', 'set-url', 'origin', self.srcssh],
+             {'cwd': srcdir}),
+        ])
+
+        # Existing mirror with our tag; no network access needed.
+        self.check_mirror_fetch(pkg, True, True, lambda mirror, srcdir: [
+            (['git', 'clone', '--branch', 'v1.0', mirror, srcdir], {}),
+            (['git', 'remote', 'set-url', 'origin', self.srcssh],
+             {'cwd': srcdir}),
+        ])
+
+    def test_mirror_commit(self):
+        env = {'MOPACK_CACHE_DIR': '/cache', 'MOPACK_GIT_MIRRORS': '1'}
+        pkg = self.make_package('foo', repository=self.srcssh,
+                                commit='abcdefg', build='bfg9000',
+                                common_options={'env': env})
+        self.check_mirror_fetch(pkg, True, True, lambda mirror, srcdir: [
+            (['git', 'clone', '--no-checkout', mirror, srcdir], {}),
+            (['git', 'remote', 'set-url', 'origin', self.srcssh],
+             {'cwd': srcdir}),
+            (['git', 'checkout', 'abcdefg'], {'cwd': srcdir}),
+        ])
+
+    def test_mirror_sparse(self):
+        env = {'MOPACK_CACHE_DIR': '/cache', 'MOPACK_GIT_MIRRORS': '1'}
+        pkg = self.make_package('foo', repository=self.srcssh, tag='v1.0',
+                                srcdir='dir', build='bfg9000',
+                                common_options={'env': env})
+        self.check_mirror_fetch(pkg, True, True, lambda mirror, srcdir: [
+            (['git', 'clone', '--sparse', '--branch', 'v1.0', mirror, srcdir],
+             {}),
+            (['git', 'remote', 'set-url', 'origin', self.srcssh],
+             {'cwd': srcdir}),
+            (['git', 'sparse-checkout', 'set', '--cone', 'dir'],
+             {'cwd': srcdir}),
+        ])
+
+    def test_mirror_branch(self):
+        env = {'MOPACK_CACHE_DIR': '/cache', 'MOPACK_GIT_MIRRORS': '1'}
+        pkg = self.make_package('foo', repository=self.srcssh,
+                                build='bfg9000', common_options={'env': env})
+        # Branches can move, so always update the mirror.
+        self.check_mirror_fetch(pkg, True, True, lambda mirror, srcdir: [
+            (['git', 'remote', 'update', '--prune'], {'cwd': mirror}),
+            (['git', 'clone', '--branch', 'master', mirror, srcdir], {}),
+            (['git', 'remote', 'set-url', 'origin', self.srcssh],
+             {'cwd': srcdir}),
+        ])
+
     def test_srdir(self):
         pkg = self.make_package('foo', repository=self.srcssh, srcdir='dir',
                                 build='bfg9000')
         self.assertEqual(pkg.repository, self.srcssh)
         self.assertEqual(pkg.rev, ['branch', 'master'])
         self.assertEqual(pkg.srcdir, 'dir')
+        self.assertEqual(pkg.sparse_paths, [])
         self.assertEqual(pkg.builder, self.make_builder(Bfg9000Builder, pkg))
 
-        self.check_fetch(pkg)
+        self.check_fetch(pkg, sparse_paths=['dir'])
         self.check_resolve(pkg)
 
+    def test_sparse_paths(self):
+        pkg = self.make_package('foo', repository=self.srcssh, srcdir='dir',
+                                sparse_paths=['common', 'cmake'],
+                                build='bfg9000')
+        self.assertEqual(pkg.sparse_paths, ['common', 'cmake'])
+        self.check_fetch(pkg, sparse_paths=['dir', 'common', 'cmake'])
+
+        pkg = self.make_package('foo', repository=self.srcssh, srcdir='dir',
+                                commit='abcdefg', sparse_paths='common',
+                                build='bfg9000')
+        self.assertEqual(pkg.sparse_paths, ['common'])
+        self.check_fetch(pkg, sparse_paths=['dir', 'common'])
+
+        # The whole repository is checked out anyway, so don't bother with a
+        # sparse checkout.
+        pkg = self.make_package('foo', repository=self.srcssh,
+                                sparse_paths=['common'], build='bfg9000')
+        self.check_fetch(pkg)
+
+    def test_invalid_sparse_paths(self):
+        with self.assertRaises(FieldError):
+            self.make_package('foo', repository=self.srcssh, srcdir='dir',
+                              sparse_paths=['../outside'], build='bfg9000')
+
     def test_build(self):
         build = {'type': 'bfg9000', 'extra_args': '--extra'}
         pkg = self.make_package('foo', repository=self.srcssh, build=build,
@@ -186,8 +363,8 @@ class TestGit(SDistTestCase):
         with mock.patch('subprocess.run', side_effect=OSError()), \
              mock.patch('mopack.usage.path_system.PathUsage._filter_path',
                         lambda *args: []), \
-             mock.patch('mopack.usage.path_system.file_outdated',
-                        return_value=True), \
+             mock.patch('mopack.usage.path_system.read_fingerprint',
+                        return_value=None), \
              mock.patch('os.makedirs'), \
              mock.patch('builtins.open'):
             self.check_resolve(pkg, usage={
@@ -212,8 +389,7 @@ class TestGit(SDistTestCase):
                 'foo', repository=self.srcssh, build='cmake',
                 usage='pkg_config'
             ))
-        with mock.patch('mopack.builders.cmake.pushd'):
-            self.check_resolve(pkg)
+        self.check_resolve(pkg)
 
     def test_usage(self):
         pkg = self.make_package('foo', repository=self.srcssh, build='bfg9000',
@@ -316,13 +492,12 @@ class TestGit(SDistTestCase):
         pkg = self.make_package('foo', repository=self.srcssh, build='bfg9000')
         with mock_open_log(), \
              mock.patch('os.path.exists', mock_exists), \
-             mock.patch('mopack.sources.sdist.pushd'), \
              mock.patch('subprocess.run') as mrun:
             pkg.fetch(self.metadata, self.config)
             mrun.assert_called_once_with(
                 ['git', 'pull'], stdout=subprocess.PIPE,
                 stderr=subprocess.STDOUT, universal_newlines=True, check=True,
-                env={}
+                env={}, cwd=os.path.join(self.pkgdir, 'src', 'foo')
             )
         self.check_resolve(pkg)
 
@@ -334,7 +509,6 @@ class TestGit(SDistTestCase):
                                 build='bfg9000')
         with mock_open_log(), \
              mock.patch('os.path.exists', mock_exists), \
-             mock.patch('mopack.sources.sdist.pushd'), \
              mock.patch('subprocess.run') as mrun:
             pkg.fetch(self.metadata, self.config)
             mrun.assert_not_called()
@@ -348,12 +522,191 @@ class TestGit(SDistTestCase):
                                 commit='abcdefg', build='bfg9000')
         with mock_open_log(), \
              mock.patch('os.path.exists', mock_exists), \
-             mock.patch('mopack.sources.sdist.pushd'), \
              mock.patch('subprocess.run') as mrun:
             pkg.fetch(self.metadata, self.config)
             mrun.assert_not_called()
         self.check_resolve(pkg)
 
+    def mock_git(self, head='abcdef', status=''):
+        def run(args, **kwargs):
+            if args[1:] == ['status', '--porcelain']:
+                return subprocess.CompletedProcess(args, 0, status)
+            elif args[1:] == ['rev-parse', 'HEAD']:
+                return subprocess.CompletedProcess(args, 0, head + '\n')
+            return subprocess.CompletedProcess(args, 0, '')
+
+        return mock.patch('subprocess.run', side_effect=run)
+
+    def test_build_fingerprint(self):
+        pkg = self.make_package('foo', repository=self.srcssh,
+                                build='bfg9000')
+        with self.mock_git():
+            fingerprint = pkg._build_fingerprint(self.metadata)
+            self.assertIsInstance(fingerprint, str)
+            self.assertEqual(pkg._build_fingerprint(self.metadata),
+                             fingerprint)
+
+        with self.mock_git(head='123456'):
+            self.assertNotEqual(pkg._build_fingerprint(self.metadata),
+                                fingerprint)
+
+        with self.mock_git(status=' M file.cpp\n'):
+            self.assertEqual(pkg._build_fingerprint(self.metadata), None)
+
+        with mock.patch('subprocess.run', side_effect=OSError()):
+            self.assertEqual(pkg._build_fingerprint(self.metadata), None)
+
+        pkg2 = self.make_package('foo', repository=self.srcssh,
+                                 build='bfg9000',
+                                 common_options={'env': {'CC': 'clang'}})
+        with self.mock_git():
+            self.assertNotEqual(pkg2._build_fingerprint(self.metadata),
+                                fingerprint)
+
+    def test_build_fingerprint_dependencies(self):
+        pkg = self.make_package('foo', repository=self.srcssh,
+                                build='bfg9000')
+        dep = self.make_package('bar', repository=self.srcssh,
+                                build='bfg9000', parent=pkg)
+        self.metadata.add_package(pkg)
+        self.metadata.add_package(dep)
+
+        with self.mock_git():
+            self.assertEqual(pkg._build_fingerprint(self.metadata), None)
+
+            dep.build_fingerprint = 'bar1'
+            fingerprint = pkg._build_fingerprint(self.metadata)
+            self.assertIsInstance(fingerprint, str)
+
+            dep.build_fingerprint = 'bar2'
+            self.assertNotEqual(pkg._build_fingerprint(self.metadata),
+                                fingerprint)
+
+    def test_skip_build(self):
+        pkg = self.make_package('foo', repository=self.srcssh,
+                                build='bfg9000')
+        builddir = os.path.join(self.pkgdir, 'build', 'foo')
+
+        with mock_open_log(), \
+             self.mock_git(), \
+             mock.patch('mopack.builders.bfg9000.Bfg9000Builder.build') as m:
+            pkg.resolve(self.metadata)
+            m.assert_called_once_with(self.metadata, pkg)
+        fingerprint = pkg.build_fingerprint
+        self.assertIsNotNone(fingerprint)
+
+        # Nothing has changed, so don't build again.
+        with mock_open_log(), \
+             self.mock_git(), \
+             mock.patch('os.path.isdir', return_value=True) as misdir, \
+             mock.patch('mopack.log.pkg_resolve') as mlog, \
+             mock.patch('mopack.builders.bfg9000.Bfg9000Builder.build') as m:
+            pkg.resolve(self.metadata)
+            misdir.assert_called_once_with(builddir)
+            mlog.assert_called_once_with('foo', 'already built')
+            m.assert_not_called()
+        self.assertEqual(pkg.build_fingerprint, fingerprint)
+        self.assertEqual(pkg.resolved, True)
+
+        # The build directory is gone.
+        with mock_open_log(), \
+             self.mock_git(), \
+             mock.patch('os.path.isdir', return_value=False), \
+             mock.patch('mopack.builders.bfg9000.Bfg9000Builder.build') as m:
+            pkg.resolve(self.metadata)
+            m.assert_called_once_with(self.metadata, pkg)
+
+        # The sources have changed.
+        with mock_open_log(), \
+             self.mock_git(head='123456'), \
+             mock.patch('os.path.isdir', return_value=True), \
+             mock.patch('mopack.builders.bfg9000.Bfg9000Builder.build') as m:
+            pkg.resolve(self.metadata)
+            m.assert_called_once_with(self.metadata, pkg)
+        self.assertNotEqual(pkg.build_fingerprint, fingerprint)
+
+    def test_artifact_cache(self):
+        env = {'MOPACK_CACHE_DIR': '/cache', 'MOPACK_ARTIFACT_CACHE': '1'}
+        pkg = self.make_package('foo', repository=self.srcssh,
+                                build='bfg9000', common_options={'env': env})
+        builddir = os.path.join(self.pkgdir, 'build', 'foo')
+        paths = {'srcdir': os.path.join(self.pkgdir, 'src', 'foo', '.'),
+                 'builddir': builddir}
+        mock_build = 'mopack.builders.bfg9000.Bfg9000Builder.build'
+
+        # Cache miss.
+        with mock_open_log(), \
+             self.mock_git(), \
+             mock.patch('mopack.cache.ArtifactCache.restore',
+                        return_value=False) as mrestore, \
+             mock.patch('mopack.cache.ArtifactCache.store') as mstore, \
+             mock.patch(mock_build) as mbuild:
+            pkg.resolve(self.metadata)
+            key = pkg.build_fingerprint
+            mrestore.assert_called_once_with(key, {'builddir': builddir},
+                                             paths)
+            mbuild.assert_called_once_with(self.metadata, pkg)
+            mstore.assert_called_once_with(key, 'foo', {'builddir': builddir},
+                                           paths)
+
+        # Cache hit.
+        pkg.build_fingerprint = None
+        with mock_open_log(), \
+             self.mock_git(), \
+             mock.patch('mopack.cache.ArtifactCache.restore',
+                        return_value=True) as mrestore, \
+             mock.patch('mopack.cache.ArtifactCache.store') as mstore, \
+             mock.patch('mopack.log.pkg_resolve') as mlog, \
+             mock.patch(mock_build) as mbuild:
+            pkg.resolve(self.metadata)
+            mrestore.assert_called_once_with(key, {'builddir': builddir},
+                                             paths)
+            mlog.assert_called_once_with('foo', 'from artifact cache')
+            mbuild.assert_not_called()
+            mstore.assert_not_called()
+        self.assertIsNotNone(pkg.build_fingerprint)
+
+        # Failing to store the build isn't an error.
+        pkg.build_fingerprint = None
+        with mock_open_log(), \
+             self.mock_git(), \
+             mock.patch('mopack.cache.ArtifactCache.restore',
+                        return_value=False), \
+             mock.patch('mopack.cache.ArtifactCache.store',
+                        side_effect=OSError()), \
+             mock.patch('shutil.rmtree'), \
+             mock.patch(mock_build) as mbuild, \
+             mock.patch('warnings.warn') as mwarn:
+            pkg.resolve(self.metadata)
+            mbuild.assert_called_once_with(self.metadata, pkg)
+            mwarn.assert_called_once()
+        self.assertIsNotNone(pkg.build_fingerprint)
+
+    def test_artifact_cache_disabled(self):
+        env = {'MOPACK_CACHE_DIR': '/cache'}
+        pkg = self.make_package('foo', repository=self.srcssh,
+                                build='bfg9000', common_options={'env': env})
+        with mock_open_log(), \
+             self.mock_git(), \
+             mock.patch('mopack.cache.ArtifactCache.restore') as mrestore, \
+             mock.patch('mopack.builders.bfg9000.Bfg9000Builder.build') \
+             as mbuild:
+            pkg.resolve(self.metadata)
+            mrestore.assert_not_called()
+            mbuild.assert_called_once_with(self.metadata, pkg)
+
+    def test_failed_build(self):
+        pkg = self.make_package('foo', repository=self.srcssh,
+                                build='bfg9000')
+        pkg.build_fingerprint = 'old'
+        with mock_open_log(), \
+             self.mock_git(), \
+             mock.patch('mopack.builders.bfg9000.Bfg9000Builder.build',
+                        side_effect=RuntimeError()):
+            with self.assertRaises(RuntimeError):
+                pkg.resolve(self.metadata)
+        self.assertEqual(pkg.build_fingerprint, None)
+
     def test_deploy(self):
         deploy_paths = {'prefix': '/usr/local'}
         pkg = self.make_package('foo', repository=self.srcssh, build='bfg9000',
@@ -361,7 +714,6 @@ class TestGit(SDistTestCase):
         self.assertEqual(pkg.should_deploy, True)
 
         with mock_open_log() as mopen, \
-             mock.patch('mopack.builders.bfg9000.pushd'), \
              mock.patch('subprocess.run') as mrun:
             pkg.resolve(self.metadata)
             mopen.assert_called_with(os.path.join(
@@ -371,11 +723,11 @@ class TestGit(SDistTestCase):
             mrun.assert_any_call(
                 ['bfg9000', 'configure', builddir, '--prefix', '/usr/local'],
                 stdout=subprocess.PIPE, stderr=subprocess.STDOUT,
-                universal_newlines=True, check=True, env={}
+                universal_newlines=True, check=True, env={},
+                cwd=os.path.join(self.pkgdir, 'src', 'foo', '.')
             )
 
         with mock_open_log() as mopen, \
-             mock.patch('mopack.builders.bfg9000.pushd'), \
              mock.patch('subprocess.run'):
             pkg.deploy(self.metadata)
             mopen.assert_called_with(os.path.join(
@@ -446,11 +798,15 @@ class TestGit(SDistTestCase):
         newpkg2 = self.make_package(AptPackage, 'foo')
 
         # Git -> Git (same)
+        oldpkg.build_fingerprint = 'fingerprint'
+        samepkg = self.make_package('foo', repository=self.srcssh,
+                                    build='bfg9000')
         with mock.patch('mopack.log.pkg_clean') as mlog, \
              mock.patch(mock_bfgclean) as mclean:
-            self.assertEqual(oldpkg.clean_post(self.metadata, oldpkg), False)
+            self.assertEqual(oldpkg.clean_post(self.metadata, samepkg), False)
             mlog.assert_not_called()
             mclean.assert_not_called()
+        self.assertEqual(samepkg.build_fingerprint, 'fingerprint')
 
         # Git -> Git (different)
         with mock.patch('mopack.log.pkg_clean') as mlog, \
@@ -458,6 +814,8 @@ class TestGit(SDistTestCase):
             self.assertEqual(oldpkg.clean_post(self.metadata, newpkg1), True)
             mlog.assert_called_once()
             mclean.assert_called_once_with(self.metadata, oldpkg)
+        self.assertEqual(newpkg1.build_fingerprint, None)
+        self.assertEqual(oldpkg.build_fingerprint, None)
 
         # Git -> Apt
         with mock.patch('mopack.log.pkg_clean') as mlog, \
@@ -569,6 +927,9 @@ class TestGit(SDistTestCase):
                                side_effect=GitPackage.upgrade) as m:
             pkg = Package.rehydrate(data, _options=opts)
             self.assertIsInstance(pkg, GitPackage)
+            self.assertEqual(pkg.build_fingerprint, None)
+            self.assertEqual(pkg.shallow, True)
+            self.assertEqual(pkg.sparse_paths, [])
             m.assert_called_once()
 
     def test_builder_types(self):
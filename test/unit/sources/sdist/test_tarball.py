@@ -1,11 +1,14 @@
+import hashlib
 import os
 import subprocess
+import tempfile
 from unittest import mock
 
 from . import *
 from .... import *
 
 from mopack.builders.bfg9000 import Bfg9000Builder
+from mopack.cache import ChecksumError
 from mopack.config import Config
 from mopack.path import Path
 from mopack.sources import Package
@@ -18,6 +21,17 @@ def mock_exists(p):
     return os.path.basename(p) == 'mopack.yml'
 
 
+def mock_extractall(extracted=None):
+    # Archives are extracted as a stream, so consume the members like the real
+    # `extractall` would.
+    def extractall(path, members):
+        for i in members:
+            if extracted is not None:
+                extracted.append(i.name)
+
+    return mock.patch('tarfile.TarFile.extractall', side_effect=extractall)
+
+
 class TestTarball(SDistTestCase):
     pkg_type = TarballPackage
     srcurl = 'http://example.invalid/hello-bfg.tar.gz'
@@ -32,12 +46,15 @@ class TestTarball(SDistTestCase):
 
     def check_fetch(self, pkg):
         srcdir = os.path.join(self.pkgdir, 'src', 'foo')
-        with mock.patch('mopack.sources.sdist.urlopen', self.mock_urlopen), \
-             mock.patch('tarfile.TarFile.extractall') as mtar, \
+        with mock.patch('mopack.sources.sdist.urlopen',
+                        side_effect=self.mock_urlopen), \
+             mock_extractall() as mtar, \
              mock.patch('os.path.isdir', return_value=True), \
-             mock.patch('os.path.exists', return_value=False):
+             mock.patch('os.path.exists', return_value=False), \
+             mock.patch('os.rename') as mrename:
             pkg.fetch(self.metadata, self.config)
-            mtar.assert_called_once_with(srcdir, None)
+            mtar.assert_called_once_with(srcdir + '.partial', mock.ANY)
+            mrename.assert_called_once_with(srcdir + '.partial', srcdir)
 
     def test_url(self):
         pkg = self.make_package('foo', url=self.srcurl, build='bfg9000')
@@ -63,6 +80,63 @@ class TestTarball(SDistTestCase):
         self.check_fetch(pkg)
         self.check_resolve(pkg)
 
+    def test_sha256(self):
+        with open(self.srcpath, 'rb') as f:
+            sha256 = hashlib.sha256(f.read()).hexdigest()
+
+        pkg = self.make_package('foo', path=self.srcpath, sha256=sha256,
+                                build='bfg9000')
+        self.assertEqual(pkg.sha256, sha256)
+        self.check_fetch(pkg)
+        self.check_resolve(pkg)
+
+        pkg = self.make_package('foo', url=self.srcurl, sha256=sha256,
+                                build='bfg9000')
+        self.assertEqual(pkg.sha256, sha256)
+        self.check_fetch(pkg)
+        self.check_resolve(pkg)
+
+    def test_sha256_mismatch(self):
+        for kwargs in ({'path': self.srcpath}, {'url': self.srcurl}):
+            pkg = self.make_package('foo', sha256='0' * 64, build='bfg9000',
+                                    **kwargs)
+            with mock.patch('mopack.sources.sdist.urlopen',
+                            self.mock_urlopen), \
+                 mock_extractall() as mtar, \
+                 mock.patch('os.path.exists', return_value=False), \
+                 mock.patch('os.rename') as mrename, \
+                 mock.patch('shutil.rmtree') as mrmtree, \
+                 self.assertRaises(ChecksumError):
+                pkg.fetch(self.metadata, self.config)
+            staging = os.path.join(self.pkgdir, 'src', 'foo.partial')
+            mtar.assert_called_once_with(staging, mock.ANY)
+            mrename.assert_not_called()
+            self.assertEqual(mrmtree.mock_calls, [
+                mock.call(staging, ignore_errors=True),
+            ] * 2)
+
+    def test_url_cached(self):
+        with tempfile.TemporaryDirectory() as cachedir:
+            common_options = {'env': {'MOPACK_CACHE_DIR': cachedir}}
+            pkg = self.make_package('foo', url=self.srcurl, build='bfg9000',
+                                    common_options=common_options)
+            srcdir = os.path.join(self.pkgdir, 'src', 'foo')
+            with mock.patch('mopack.sources.sdist.urlopen',
+                            side_effect=self.mock_urlopen) as murl, \
+                 mock_extractall() as mtar, \
+                 mock.patch('os.path.isdir', return_value=True), \
+                 mock.patch('os.rename') as mrename:
+                for i in range(2):
+                    with mock.patch('os.path.exists', return_value=False):
+                        pkg.fetch(self.metadata, self.config)
+                murl.assert_called_once_with(self.srcurl)
+                self.assertEqual(mtar.mock_calls,
+                                 [mock.call(srcdir + '.partial',
+                                            mock.ANY)] * 2)
+                self.assertEqual(mrename.mock_calls,
+                                 [mock.call(srcdir + '.partial', srcdir)] * 2)
+            self.check_resolve(pkg)
+
     def test_zip_path(self):
         srcpath = os.path.join(test_data_dir, 'hello-bfg.zip')
         pkg = self.make_package('foo', build='bfg9000', path=srcpath)
@@ -76,9 +150,11 @@ class TestTarball(SDistTestCase):
         with mock.patch('mopack.sources.sdist.urlopen', self.mock_urlopen), \
              mock.patch('zipfile.ZipFile.extractall') as mtar, \
              mock.patch('os.path.isdir', return_value=True), \
-             mock.patch('os.path.exists', return_value=False):
+             mock.patch('os.path.exists', return_value=False), \
+             mock.patch('os.rename') as mrename:
             pkg.fetch(self.metadata, self.config)
-            mtar.assert_called_once_with(srcdir, None)
+            mtar.assert_called_once_with(srcdir + '.partial', None)
+            mrename.assert_called_once_with(srcdir + '.partial', srcdir)
         self.check_resolve(pkg)
 
     def test_invalid_url_path(self):
@@ -94,14 +170,19 @@ class TestTarball(SDistTestCase):
         self.assertEqual(pkg.files, ['/hello-bfg/include/'])
 
         srcdir = os.path.join(self.pkgdir, 'src', 'foo')
+        extracted = []
         with mock.patch('mopack.sources.sdist.urlopen', self.mock_urlopen), \
-             mock.patch('tarfile.TarFile.extract') as mtar, \
+             mock_extractall(extracted) as mtar, \
              mock.patch('os.path.isdir', return_value=True), \
-             mock.patch('os.path.exists', return_value=False):
+             mock.patch('os.path.exists', return_value=False), \
+             mock.patch('os.rename') as mrename:
             pkg.fetch(self.metadata, self.config)
-            self.assertEqual(mtar.mock_calls, [
-                mock.call('hello-bfg/include', srcdir),
-                mock.call('hello-bfg/include/hello.hpp', srcdir),
+            mtar.assert_called_once_with(srcdir + '.partial', mock.ANY)
+            mrename.assert_called_once_with(srcdir + '.partial', srcdir)
+            self.assertEqual(extracted, [
+                'hello-bfg/include',
+                'hello-bfg',
+                'hello-bfg/include/hello.hpp',
             ])
         self.check_resolve(pkg)
 
@@ -113,19 +194,21 @@ class TestTarball(SDistTestCase):
 
         srcdir = os.path.join(self.pkgdir, 'src', 'foo')
         with mock.patch('mopack.sources.sdist.urlopen', self.mock_urlopen), \
-             mock.patch('mopack.sources.sdist.pushd'), \
-             mock.patch('tarfile.TarFile.extractall') as mtar, \
+             mock_extractall() as mtar, \
              mock.patch('os.path.isdir', return_value=True), \
              mock.patch('os.path.exists', return_value=False), \
+             mock.patch('os.rename') as mrename, \
              mock.patch('builtins.open', mock_open_after_first()) as mopen, \
              mock.patch('os.makedirs'), \
              mock.patch('subprocess.run') as mrun:
             pkg.fetch(self.metadata, self.config)
-            mtar.assert_called_once_with(srcdir, None)
+            mtar.assert_called_once_with(srcdir + '.partial', mock.ANY)
+            mrename.assert_called_once_with(srcdir + '.partial', srcdir)
             mrun.assert_called_once_with(
                 ['patch', '-p1'], stdout=subprocess.PIPE,
                 stderr=subprocess.STDOUT, stdin=mopen(),
-                universal_newlines=True, check=True, env={}
+                universal_newlines=True, check=True, env={},
+                cwd=os.path.join(srcdir, 'hello-bfg')
             )
         self.check_resolve(pkg)
 
@@ -147,7 +230,9 @@ class TestTarball(SDistTestCase):
         self.assertEqual(pkg.builder, None)
 
         with mock.patch('os.path.exists', mock_exists), \
-             mock.patch('tarfile.TarFile.extractall'), \
+             mock_extractall(), \
+             mock.patch('os.path.isdir', return_value=True), \
+             mock.patch('os.rename'), \
              mock.patch('builtins.open', mock_open_after_first(
                  read_data='export:\n  build: bfg9000'
              )):
@@ -164,7 +249,9 @@ class TestTarball(SDistTestCase):
         self.assertEqual(pkg.builder, None)
 
         with mock.patch('os.path.exists', mock_exists), \
-             mock.patch('tarfile.TarFile.extractall'), \
+             mock_extractall(), \
+             mock.patch('os.path.isdir', return_value=True), \
+             mock.patch('os.rename'), \
              mock.patch('builtins.open', mock_open_after_first(
                  read_data='export:\n  build: bfg9000'
              )):
@@ -177,8 +264,8 @@ class TestTarball(SDistTestCase):
         with mock.patch('subprocess.run', side_effect=OSError()), \
              mock.patch('mopack.usage.path_system.PathUsage._filter_path',
                         lambda *args: []), \
-             mock.patch('mopack.usage.path_system.file_outdated',
-                        return_value=True), \
+             mock.patch('mopack.usage.path_system.read_fingerprint',
+                        return_value=None), \
              mock.patch('os.makedirs'), \
              mock.patch('builtins.open'):
             self.check_resolve(pkg, usage={
@@ -192,7 +279,9 @@ class TestTarball(SDistTestCase):
                                 usage='pkg_config')
 
         with mock.patch('os.path.exists', mock_exists), \
-             mock.patch('tarfile.TarFile.extractall'), \
+             mock_extractall(), \
+             mock.patch('os.path.isdir', return_value=True), \
+             mock.patch('os.rename'), \
              mock.patch('builtins.open', mock_open_after_first(
                  read_data='export:\n  build: bfg9000'
              )):
@@ -201,8 +290,7 @@ class TestTarball(SDistTestCase):
             self.assertEqual(pkg, self.make_package(
                 'foo', path=self.srcpath, build='cmake', usage='pkg_config'
             ))
-        with mock.patch('mopack.builders.cmake.pushd'):
-            self.check_resolve(pkg)
+        self.check_resolve(pkg)
 
     def test_usage(self):
         pkg = self.make_package('foo', path=self.srcpath, build='bfg9000',
@@ -300,12 +388,35 @@ class TestTarball(SDistTestCase):
         pkg = self.make_package('foo', path=self.srcpath, srcdir='srcdir',
                                 build=build, usage='pkg_config')
         with mock.patch('os.path.exists', mock_exists), \
-             mock.patch('tarfile.TarFile.extractall') as mtar, \
+             mock_extractall() as mtar, \
              mock.patch('os.path.isdir', return_value=True):
             pkg.fetch(self.metadata, self.config)
             mtar.assert_not_called()
         self.check_resolve(pkg)
 
+    def test_build_fingerprint(self):
+        pkg = self.make_package('foo', url=self.srcurl, sha256='0' * 64,
+                                build='bfg9000')
+        fingerprint = pkg._build_fingerprint(self.metadata)
+        self.assertIsInstance(fingerprint, str)
+        self.assertEqual(pkg._build_fingerprint(self.metadata), fingerprint)
+
+        pkg = self.make_package('foo', url=self.srcurl, sha256='1' * 64,
+                                build='bfg9000')
+        self.assertNotEqual(pkg._build_fingerprint(self.metadata),
+                            fingerprint)
+
+        pkg = self.make_package('foo', path=self.srcpath, build='bfg9000')
+        fingerprint = pkg._build_fingerprint(self.metadata)
+        self.assertIsInstance(fingerprint, str)
+        with mock.patch('os.stat', side_effect=lambda p: os.stat_result(
+            (0o644, 0, 0, 1, 0, 0, 1, 0, 0, 0)
+        )):
+            self.assertNotEqual(pkg._build_fingerprint(self.metadata),
+                                fingerprint)
+        with mock.patch('os.stat', side_effect=FileNotFoundError()):
+            self.assertEqual(pkg._build_fingerprint(self.metadata), None)
+
     def test_deploy(self):
         deploy_paths = {'prefix': '/usr/local'}
         pkg = self.make_package('foo', url=self.srcurl, build='bfg9000',
@@ -314,7 +425,6 @@ class TestTarball(SDistTestCase):
         self.check_fetch(pkg)
 
         with mock_open_log() as mopen, \
-             mock.patch('mopack.builders.bfg9000.pushd'), \
              mock.patch('subprocess.run') as mrun:
             pkg.resolve(self.metadata)
             mopen.assert_called_with(os.path.join(
@@ -324,11 +434,11 @@ class TestTarball(SDistTestCase):
             mrun.assert_any_call(
                 ['bfg9000', 'configure', builddir, '--prefix', '/usr/local'],
                 stdout=subprocess.PIPE, stderr=subprocess.STDOUT,
-                universal_newlines=True, check=True, env={}
+                universal_newlines=True, check=True, env={},
+                cwd=os.path.join(self.pkgdir, 'src', 'foo', 'hello-bfg')
             )
 
         with mock_open_log() as mopen, \
-             mock.patch('mopack.builders.bfg9000.pushd'), \
              mock.patch('subprocess.run'):
             pkg.deploy(self.metadata)
             mopen.assert_called_with(os.path.join(
@@ -546,6 +656,8 @@ class TestTarball(SDistTestCase):
                                side_effect=TarballPackage.upgrade) as m:
             pkg = Package.rehydrate(data, _options=opts)
             self.assertIsInstance(pkg, TarballPackage)
+            self.assertEqual(pkg.build_fingerprint, None)
+            self.assertEqual(pkg.sha256, None)
             m.assert_called_once()
 
     def test_builder_types(self):
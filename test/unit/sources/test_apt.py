@@ -1,15 +1,17 @@
 import os
+import shutil
 import subprocess
-from unittest import mock
+import tempfile
+from unittest import mock, TestCase
 
 from . import SourceTest, through_json
 from .. import mock_open_log
 
 from mopack.iterutils import iterate
 from mopack.sources import Package
-from mopack.sources.apt import AptPackage
+from mopack.sources.apt import _lists_fresh, AptPackage
 from mopack.sources.conan import ConanPackage
-from mopack.types import dependency_string
+from mopack.types import ConfigurationError, dependency_string
 
 
 def mock_run(args, **kwargs):
@@ -24,7 +26,9 @@ class TestApt(SourceTest):
 
     def check_resolve_all(self, packages, remotes):
         with mock_open_log() as mopen, \
-             mock.patch('subprocess.run') as mrun:
+             mock.patch('subprocess.run') as mrun, \
+             mock.patch('mopack.sources.apt._lists_fresh',
+                        return_value=False):
             AptPackage.resolve_all(self.metadata, packages)
 
             mopen.assert_called_with(os.path.join(
@@ -64,8 +68,8 @@ class TestApt(SourceTest):
         with mock.patch('subprocess.run', mock_run), \
              mock.patch('mopack.usage.path_system.PathUsage._filter_path',
                         lambda *args: []), \
-             mock.patch('mopack.usage.path_system.file_outdated',
-                        return_value=True), \
+             mock.patch('mopack.usage.path_system.read_fingerprint',
+                        return_value=None), \
              mock.patch('os.makedirs'), \
              mock.patch('builtins.open'):
             self.assertEqual(pkg.get_usage(self.metadata, submodules), usage)
@@ -168,6 +172,144 @@ class TestApt(SourceTest):
 
         self.check_usage(pkg)
 
+    def test_prefetch_versions(self):
+        pkgs = [self.make_package('foo'),
+                self.make_package('bar', remote=['bar-dev', 'bar-extra']),
+                self.make_package('baz', remote='baz-dev')]
+        output = ('ii \tlibfoo-dev:amd64\tlibfoo-dev\t1.2.3\n' +
+                  'ii \tbar-dev\tbar-dev\t2.0\n' +
+                  'rc \tbaz-dev\tbaz-dev\t3.0\n')
+        with mock.patch('subprocess.run', return_value=(
+            subprocess.CompletedProcess([], 1, output)
+        )) as mrun:
+            AptPackage.prefetch_versions(self.metadata, pkgs)
+            mrun.assert_called_once_with(
+                ['dpkg-query', '-W',
+                 '-f${db:Status-Abbrev}\t${binary:Package}\t${Package}\t' +
+                 '${Version}\n',
+                 'libfoo-dev', 'bar-dev', 'baz-dev'],
+                stdout=subprocess.PIPE, stderr=subprocess.DEVNULL,
+                universal_newlines=True, env={}
+            )
+
+        with mock.patch('subprocess.run', side_effect=mock_run) as mrun:
+            self.assertEqual(pkgs[0].guessed_version(self.metadata), '1.2.3')
+            self.assertEqual(pkgs[1].guessed_version(self.metadata), '2.0')
+            mrun.assert_not_called()
+
+            self.assertEqual(pkgs[2].guessed_version(self.metadata), '1.2.3')
+            mrun.assert_called_once_with(
+                ['dpkg-query', '-W', '-f${Version}', 'baz-dev'],
+                check=True, stdout=subprocess.PIPE,
+                universal_newlines=True, env={}
+            )
+
+    def test_guessed_version_stamp(self):
+        pkg = self.make_package('foo')
+        stat = mock.Mock(st_mtime_ns=1, st_size=2)
+        with mock.patch('os.stat', return_value=stat) as mstat, \
+             mock.patch('subprocess.run') as mrun:
+            self.assertEqual(pkg.guessed_version_stamp(self.metadata),
+                             ['libfoo-dev', 1, 2])
+            mstat.assert_called_once_with('/var/lib/dpkg/status')
+            mrun.assert_not_called()
+
+        pkg = self.make_package('foo', common_options={
+            'env': {'DPKG_ADMINDIR': '/dpkg'},
+        })
+        with mock.patch('os.stat', return_value=stat) as mstat:
+            pkg.guessed_version_stamp(self.metadata)
+            mstat.assert_called_once_with('/dpkg/status')
+
+        # If we can't find dpkg's status file, just use the version.
+        with mock.patch('os.stat', side_effect=FileNotFoundError()), \
+             mock.patch('subprocess.run', side_effect=mock_run):
+            self.assertEqual(pkg.guessed_version_stamp(self.metadata),
+                             '1.2.3')
+
+    def resolve_installed(self, packages, installed, fresh=True):
+        def mock_run(args, **kwargs):
+            if args[0] == 'dpkg-query':
+                return subprocess.CompletedProcess(args, 1, ''.join(
+                    'ii \t{0}\t{0}\t{1}\n'.format(k, v)
+                    for k, v in installed.items()
+                ))
+            return subprocess.CompletedProcess(args, 0, '')
+
+        with mock_open_log(), \
+             mock.patch('subprocess.run', side_effect=mock_run) as mrun, \
+             mock.patch('mopack.sources.apt._lists_fresh',
+                        return_value=fresh):
+            AptPackage.resolve_all(self.metadata, packages)
+            for i in packages:
+                self.assertEqual(i.resolved, True)
+            return [i[1][0] for i in mrun.mock_calls]
+
+    def test_resolve_installed(self):
+        pkgs = [self.make_package('foo'),
+                self.make_package('bar', remote=['bar-dev', 'bar-extra'])]
+        calls = self.resolve_installed(pkgs, {
+            'libfoo-dev': '1.0', 'bar-dev': '2.0', 'bar-extra': '2.0',
+        })
+        self.assertEqual(calls, [
+            ['dpkg-query', '-W',
+             '-f${db:Status-Abbrev}\t${binary:Package}\t' +
+             '${Package}\t${Version}\n',
+             'libfoo-dev', 'bar-dev', 'bar-extra'],
+        ])
+
+    def test_resolve_missing(self):
+        pkgs = [self.make_package('foo'),
+                self.make_package('bar', remote='bar-dev')]
+        calls = self.resolve_installed(pkgs, {'libfoo-dev': '1.0'})
+        self.assertEqual(calls[1:], [
+            ['sudo', 'apt-get', 'install', '-y', 'bar-dev'],
+        ])
+
+        calls = self.resolve_installed(pkgs, {'libfoo-dev': '1.0'},
+                                       fresh=False)
+        self.assertEqual(calls[1:], [
+            ['sudo', 'apt-get', 'update'],
+            ['sudo', 'apt-get', 'install', '-y', 'bar-dev'],
+        ])
+
+    def test_resolve_version(self):
+        pkg = self.make_package('foo', remote='libfoo-dev=1.0')
+        calls = self.resolve_installed([pkg], {'libfoo-dev': '1.0'})
+        self.assertEqual(len(calls), 1)
+
+        calls = self.resolve_installed([pkg], {'libfoo-dev': '2.0'})
+        self.assertEqual(calls[1:], [
+            ['sudo', 'apt-get', 'install', '-y', 'libfoo-dev=1.0'],
+        ])
+
+    def test_resolve_repository(self):
+        pkg = self.make_package('foo', repository='ppa:foo/stable')
+        calls = self.resolve_installed([pkg], {})
+        self.assertEqual(calls[1:], [
+            ['sudo', 'add-apt-repository', '-y', 'ppa:foo/stable'],
+            ['sudo', 'apt-get', 'update'],
+            ['sudo', 'apt-get', 'install', '-y', 'libfoo-dev'],
+        ])
+
+    def test_resolve_repository_installed(self):
+        pkgs = [self.make_package('foo', repository='ppa:foo/stable'),
+                self.make_package('bar', remote='bar-dev',
+                                  repository='ppa:bar/stable')]
+        calls = self.resolve_installed(pkgs, {'libfoo-dev': '1.0'})
+        self.assertEqual(calls[1:], [
+            ['sudo', 'add-apt-repository', '-y', 'ppa:bar/stable'],
+            ['sudo', 'apt-get', 'update'],
+            ['sudo', 'apt-get', 'install', '-y', 'bar-dev'],
+        ])
+
+        calls = self.resolve_installed(pkgs[:1] + [
+            self.make_package('bar', remote='bar-dev'),
+        ], {'libfoo-dev': '1.0'})
+        self.assertEqual(calls[1:], [
+            ['sudo', 'apt-get', 'install', '-y', 'bar-dev'],
+        ])
+
     def test_multiple(self):
         pkgs = [self.make_package('foo'),
                 self.make_package('bar', remote='bar-dev')]
@@ -285,3 +427,65 @@ class TestApt(SourceTest):
             pkg = Package.rehydrate(data, _options=opts)
             self.assertIsInstance(pkg, AptPackage)
             m.assert_called_once()
+
+
+class TestListsFresh(TestCase):
+    def setUp(self):
+        self._tempdir = tempfile.TemporaryDirectory()
+        self.addCleanup(self._tempdir.cleanup)
+        self.lists_dir = os.path.join(self._tempdir.name, 'lists')
+        self.stamp = os.path.join(self._tempdir.name, 'update-success-stamp')
+        os.mkdir(self.lists_dir)
+        os.mkdir(os.path.join(self.lists_dir, 'partial'))
+        self.touch(os.path.join(self.lists_dir, 'lock'), 1900)
+
+        patches = [
+            mock.patch('mopack.sources.apt._apt_lists_dir', self.lists_dir),
+            mock.patch('mopack.sources.apt._apt_update_stamp', self.stamp),
+            mock.patch('time.time', return_value=2000),
+        ]
+        for i in patches:
+            i.start()
+            self.addCleanup(i.stop)
+
+    def touch(self, path, mtime):
+        open(path, 'w').close()
+        os.utime(path, (mtime, mtime))
+
+    def touch_list(self, mtime):
+        self.touch(os.path.join(
+            self.lists_dir,
+            'deb.debian.org_debian_dists_stable_main_binary-amd64_Packages'
+        ), mtime)
+
+    def test_fresh(self):
+        self.touch_list(1000)
+        self.assertEqual(_lists_fresh({}), True)
+        self.assertEqual(_lists_fresh({
+            'MOPACK_APT_UPDATE_INTERVAL': '600',
+        }), False)
+        self.assertEqual(_lists_fresh({
+            'MOPACK_APT_UPDATE_INTERVAL': '0',
+        }), False)
+
+    def test_update_stamp(self):
+        env = {'MOPACK_APT_UPDATE_INTERVAL': '600'}
+        self.touch_list(1000)
+        self.assertEqual(_lists_fresh(env), False)
+        self.touch(self.stamp, 1900)
+        self.assertEqual(_lists_fresh(env), True)
+
+    def test_no_lists(self):
+        # The lists directory (and its lock file) were just modified, e.g. by
+        # `rm -rf /var/lib/apt/lists/*`, but there aren't any lists.
+        self.touch(self.stamp, 1900)
+        self.assertEqual(_lists_fresh({}), False)
+
+    def test_missing(self):
+        shutil.rmtree(self.lists_dir)
+        self.assertEqual(_lists_fresh({}), False)
+
+    def test_invalid_interval(self):
+        with self.assertRaisesRegex(ConfigurationError,
+                                    r'\$MOPACK_APT_UPDATE_INTERVAL'):
+            _lists_fresh({'MOPACK_APT_UPDATE_INTERVAL': 'hourly'})
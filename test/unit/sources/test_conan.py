@@ -1,3 +1,4 @@
+import json
 import os
 import subprocess
 from io import StringIO
@@ -15,12 +16,12 @@ from mopack.sources.conan import ConanPackage
 from mopack.types import dependency_string
 
 
-def mock_open_write():
+def mock_open_write(read_data=''):
     class MockFile(StringIO):
         def close(self):
             pass
 
-    mock_open = mock.mock_open()
+    mock_open = mock.mock_open(read_data=read_data)
 
     def non_mock(*args, **kwargs):
         mock_open.side_effect = None
@@ -35,15 +36,17 @@ class TestConan(SourceTest):
     pkg_type = ConanPackage
     pkgconfdir = os.path.join(SourceTest.pkgdir, 'conan')
 
-    def check_resolve_all(self, pkgs, conanfile, extra_args=[]):
-        with mock_open_log(mock_open_write()) as mopen, \
+    def check_resolve_all(self, pkgs, conanfile, extra_args=[],
+                          install_info=''):
+        with mock_open_log(mock_open_write(install_info)) as mopen, \
              mock.patch('subprocess.run') as mrun:
             ConanPackage.resolve_all(self.metadata, pkgs)
 
             self.assertEqual(mopen.mock_file.getvalue(), conanfile)
             conandir = os.path.join(self.pkgdir, 'conan')
             mrun.assert_called_with(
-                (['conan', 'install', '-if', conandir] + extra_args +
+                (['conan', 'install', '-if', conandir, '--json',
+                  os.path.join(conandir, 'install.json')] + extra_args +
                  ['--', self.pkgdir]),
                 stdout=subprocess.PIPE, stderr=subprocess.STDOUT,
                 universal_newlines=True, check=True, env={}
@@ -77,6 +80,7 @@ class TestConan(SourceTest):
             [generators]
             pkg_config
         """))
+        self.assertEqual(pkg.installed_version, None)
 
         with mock.patch('subprocess.run') as mrun:
             pkg.version(self.metadata)
@@ -88,6 +92,107 @@ class TestConan(SourceTest):
 
         self.check_usage(pkg)
 
+    def test_installed_version(self):
+        pkgs = [self.make_package('foo', remote='foo/1.2.3@conan/stable'),
+                self.make_package('bar', remote='bar/[>=2.0]'),
+                self.make_package('baz', remote='baz/3.0')]
+        install_info = json.dumps({'error': False, 'installed': [
+            {'recipe': {'id': 'foo/1.2.3@conan/stable', 'name': 'foo',
+                        'version': '1.2.3'}, 'packages': []},
+            {'recipe': {'id': 'bar/2.1#0123456789abcdef'}, 'packages': []},
+            {'recipe': {'id': 'zlib/1.2.11', 'name': 'zlib',
+                        'version': '1.2.11'}, 'packages': []},
+        ]})
+
+        self.check_resolve_all(pkgs, dedent("""\
+            [requires]
+            foo/1.2.3@conan/stable
+            bar/[>=2.0]
+            baz/3.0
+
+            [options]
+
+            [generators]
+            pkg_config
+        """), install_info=install_info)
+        self.assertEqual([i.installed_version for i in pkgs],
+                         ['1.2.3', '2.1', None])
+
+        with mock.patch('subprocess.run') as mrun:
+            self.assertEqual(pkgs[0].version(self.metadata), '1.2.3')
+            self.assertEqual(pkgs[1].version(self.metadata), '2.1')
+            mrun.assert_not_called()
+
+        # The installed version shouldn't affect equality.
+        self.assertEqual(
+            pkgs[0], self.make_package('foo', remote='foo/1.2.3@conan/stable')
+        )
+
+    def test_skip_install(self):
+        conanfile = dedent("""\
+            [requires]
+            foo/1.2.3@conan/stable
+
+            [options]
+
+            [generators]
+            pkg_config
+        """)
+        install_info = json.dumps({'error': False, 'installed': [
+            {'recipe': {'id': 'foo/1.2.3@conan/stable', 'name': 'foo',
+                        'version': '1.2.3'}, 'packages': []},
+        ]})
+        pkg = self.make_package('foo', remote='foo/1.2.3@conan/stable')
+        self.check_resolve_all([pkg], conanfile, install_info=install_info)
+        digest = pkg.install_digest
+        self.assertIsNotNone(digest)
+
+        # Nothing has changed and conan's install record lists the package,
+        # so skip installing.
+        mopen = mock.mock_open(read_data=install_info)
+        with mock.patch('builtins.open', mopen), \
+             mock.patch('subprocess.run') as mrun:
+            ConanPackage.resolve_all(self.metadata, [pkg])
+            mopen.assert_called_once_with(os.path.join(
+                self.pkgdir, 'conan', 'install.json'
+            ))
+            mrun.assert_not_called()
+            self.assertEqual(pkg.resolved, True)
+            self.assertEqual(pkg.installed_version, '1.2.3')
+
+        # The install record is missing.
+        with mock.patch.object(ConanPackage, '_installed_versions',
+                               return_value={}):
+            self.check_resolve_all([pkg], conanfile)
+        self.assertEqual(pkg.install_digest, digest)
+
+        # The options have changed.
+        pkg = self.make_package('foo', remote='foo/1.2.3@conan/stable',
+                                options={'shared': True})
+        pkg.install_digest = digest
+        with mock.patch.object(ConanPackage, '_installed_versions',
+                               return_value={'foo': '1.2.3'}):
+            self.check_resolve_all([pkg], dedent("""\
+                [requires]
+                foo/1.2.3@conan/stable
+
+                [options]
+                foo:shared=True
+
+                [generators]
+                pkg_config
+            """))
+        self.assertNotEqual(pkg.install_digest, digest)
+
+        # The extra args have changed.
+        pkg = self.make_package('foo', remote='foo/1.2.3@conan/stable',
+                                this_options={'extra_args': '-gcmake'})
+        pkg.install_digest = digest
+        with mock.patch.object(ConanPackage, '_installed_versions',
+                               return_value={'foo': '1.2.3'}):
+            self.check_resolve_all([pkg], conanfile, ['-gcmake'])
+        self.assertNotEqual(pkg.install_digest, digest)
+
     def test_build(self):
         pkg = self.make_package('foo', remote='foo/1.2.3@conan/stable',
                                 build=True)
@@ -284,12 +389,17 @@ class TestConan(SourceTest):
         newpkg1 = self.make_package('foo', remote='foo/1.2.4@conan/stable')
         newpkg2 = self.make_package(AptPackage, 'foo')
 
+        oldpkg.installed_version = '1.2.3'
+        oldpkg.install_digest = 'digest'
+
         # Conan -> Conan
         with mock.patch('mopack.log.pkg_clean') as mlog, \
              mock.patch('os.remove') as mremove:
             self.assertEqual(oldpkg.clean_post(self.metadata, newpkg1), False)
             mlog.assert_not_called()
             mremove.assert_not_called()
+            self.assertEqual(newpkg1.installed_version, '1.2.3')
+            self.assertEqual(newpkg1.install_digest, 'digest')
 
         # Conan -> Apt
         with mock.patch('mopack.log.pkg_clean') as mlog, \
@@ -308,6 +418,7 @@ class TestConan(SourceTest):
             mremove.assert_called_once_with(os.path.join(
                 self.pkgdir, 'conan', 'foo.pc'
             ))
+            self.assertEqual(oldpkg.install_digest, None)
 
         # Conan -> nothing (quiet)
         with mock.patch('mopack.log.pkg_clean') as mlog, \
@@ -409,6 +520,8 @@ class TestConan(SourceTest):
                                side_effect=ConanPackage.upgrade) as m:
             pkg = Package.rehydrate(data, _options=opts)
             self.assertIsInstance(pkg, ConanPackage)
+            self.assertEqual(pkg.installed_version, None)
+            self.assertEqual(pkg.install_digest, None)
             m.assert_called_once()
 
 
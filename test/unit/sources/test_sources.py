@@ -72,8 +72,8 @@ class TestMakePackage(SourceTest):
         with mock.patch('subprocess.run', side_effect=OSError()), \
              mock.patch('mopack.usage.path_system.PathUsage._filter_path',
                         lambda *args: []), \
-             mock.patch('mopack.usage.path_system.file_outdated',
-                        return_value=True), \
+             mock.patch('mopack.usage.path_system.read_fingerprint',
+                        return_value=None), \
              mock.patch('os.makedirs'), \
              mock.patch('builtins.open'):
             self.assertEqual(pkg.get_usage(self.metadata, ['sub']), {
@@ -95,8 +95,8 @@ class TestMakePackage(SourceTest):
         with mock.patch('subprocess.run', side_effect=OSError()), \
              mock.patch('mopack.usage.path_system.PathUsage._filter_path',
                         lambda *args: []), \
-             mock.patch('mopack.usage.path_system.file_outdated',
-                        return_value=True), \
+             mock.patch('mopack.usage.path_system.read_fingerprint',
+                        return_value=None), \
              mock.patch('os.makedirs'), \
              mock.patch('builtins.open'):
             self.assertEqual(pkg.get_usage(self.metadata, ['sub']), {
@@ -121,8 +121,8 @@ class TestMakePackage(SourceTest):
         with mock.patch('subprocess.run', side_effect=OSError()), \
              mock.patch('mopack.usage.path_system.PathUsage._filter_path',
                         lambda *args: []), \
-             mock.patch('mopack.usage.path_system.file_outdated',
-                        return_value=True), \
+             mock.patch('mopack.usage.path_system.read_fingerprint',
+                        return_value=None), \
              mock.patch('os.makedirs'), \
              mock.patch('builtins.open'):
             self.assertEqual(pkg.get_usage(self.metadata, ['sub']), {
@@ -133,8 +133,8 @@ class TestMakePackage(SourceTest):
         with mock.patch('subprocess.run', side_effect=OSError()), \
              mock.patch('mopack.usage.path_system.PathUsage._filter_path',
                         lambda *args: []), \
-             mock.patch('mopack.usage.path_system.file_outdated',
-                        return_value=True), \
+             mock.patch('mopack.usage.path_system.read_fingerprint',
+                        return_value=None), \
              mock.patch('os.makedirs'), \
              mock.patch('builtins.open'):
             self.assertEqual(pkg.get_usage(self.metadata, None), {
@@ -6,7 +6,7 @@ from unittest import mock
 from . import SourceTest
 from ... import call_pkg_config, test_stage_dir
 
-from mopack.path import Path
+from mopack.path import DirectoryCache, Path
 from mopack.sources import Package
 from mopack.sources.apt import AptPackage
 from mopack.sources.system import SystemPackage
@@ -41,16 +41,16 @@ class TestSystemPackage(SourceTest):
         self.clear_pkgdir()
         side_effect = None if find_pkg_config else OSError()
         with mock.patch('subprocess.run', side_effect=side_effect), \
-             mock.patch('mopack.usage.path_system.file_outdated',
-                        return_value=True), \
+             mock.patch('mopack.usage.path_system.read_fingerprint',
+                        return_value=None), \
              mock.patch('mopack.usage.path_system._system_include_path',
                         return_value=[Path('/mock/include')]), \
              mock.patch('mopack.usage.path_system._system_lib_path',
                         return_value=[Path('/mock/lib')]), \
              mock.patch('mopack.usage.path_system._system_lib_names',
                         return_value=['lib{}.so']), \
-             mock.patch('mopack.usage.path_system.isfile',
-                        mock_isfile):
+             mock.patch.object(DirectoryCache, 'isfile',
+                               staticmethod(mock_isfile)):
             self.assertEqual(pkg.get_usage(self.metadata, submodules),
                              expected)
 
@@ -1,4 +1,8 @@
 import os.path
+import posixpath
+import tarfile
+import tempfile
+from io import BytesIO
 from unittest import mock, TestCase
 
 from .. import test_data_dir
@@ -6,6 +10,18 @@ from .. import test_data_dir
 from mopack import archive
 
 
+class Stream:
+    # A non-seekable stream, like an HTTP response.
+    def __init__(self, data):
+        self._data = BytesIO(data)
+        self.read_all = False
+
+    def read(self, size=-1):
+        if size is None or size < 0:
+            self.read_all = True
+        return self._data.read(size)
+
+
 class TestArchive(TestCase):
     def test_open_tar(self):
         f = mock.MagicMock()
@@ -117,3 +133,101 @@ class TestArchive(TestCase):
                 mock.call('path', None),
                 mock.call('.', ['dir/', 'file.txt'])
             ])
+
+    def test_sniff(self):
+        self.assertEqual(archive.sniff(b'PK\x03\x04data'), 'zip')
+        self.assertEqual(archive.sniff(b'PK\x05\x06data'), 'zip')
+        self.assertEqual(archive.sniff(b'\x1f\x8bdata'), 'gz')
+        self.assertEqual(archive.sniff(b'BZhdata'), 'bz2')
+        self.assertEqual(archive.sniff(b'\xfd7zXZ\x00data'), 'xz')
+        self.assertEqual(archive.sniff(b'data'), 'tar')
+        self.assertEqual(archive.sniff(b''), 'tar')
+
+
+class TestStreamArchive(TestCase):
+    d = 'hello-bfg/'
+    names = [d, d + 'build.bfg', d + 'include/', d + 'include/hello.hpp',
+             d + 'src/', d + 'src/hello.cpp']
+
+    def setUp(self):
+        self._tempdir = tempfile.TemporaryDirectory()
+        self.dest = self._tempdir.name
+
+    def tearDown(self):
+        self._tempdir.cleanup()
+
+    def open_stream(self, filename):
+        with open(os.path.join(test_data_dir, filename), 'rb') as f:
+            return Stream(f.read())
+
+    def extracted(self):
+        result = []
+        for path, dirs, files in os.walk(self.dest):
+            rel = os.path.relpath(path, self.dest).replace(os.sep, '/')
+            result.extend(posixpath.join(rel, i) + '/' for i in dirs)
+            result.extend(posixpath.join(rel, i) for i in files)
+        return sorted(i[2:] if i.startswith('./') else i for i in result)
+
+    def test_tar(self):
+        f = self.open_stream('hello-bfg.tar.gz')
+        with archive.open(f, 'r|*') as arc:
+            self.assertEqual(sorted(arc.extractmatching(self.dest)),
+                             self.names)
+        self.assertEqual(self.extracted(), self.names)
+        self.assertFalse(f.read_all)
+
+    def test_zip(self):
+        f = self.open_stream('hello-bfg.zip')
+        with archive.open(f, 'r|*') as arc:
+            self.assertEqual(sorted(arc.extractmatching(self.dest)),
+                             self.names)
+        self.assertEqual(self.extracted(), self.names)
+
+    def test_seekable_zip(self):
+        path = os.path.join(test_data_dir, 'hello-bfg.zip')
+        with open(path, 'rb') as f, \
+             mock.patch('tempfile.TemporaryFile') as mtemp, \
+             archive.open(f, 'r|*') as arc:
+            self.assertEqual(sorted(arc.extractmatching(self.dest)),
+                             self.names)
+            mtemp.assert_not_called()
+        self.assertEqual(self.extracted(), self.names)
+
+    def test_explicit_format(self):
+        f = self.open_stream('hello-bfg.tar.gz')
+        with archive.open(f, 'r|gz') as arc:
+            self.assertEqual(sorted(arc.extractmatching(self.dest)),
+                             self.names)
+        self.assertEqual(self.extracted(), self.names)
+
+    def test_match(self):
+        def match(name):
+            return name.startswith('hello-bfg/include/')
+
+        for filename in ('hello-bfg.tar.gz', 'hello-bfg.zip'):
+            with archive.open(self.open_stream(filename), 'r|*') as arc:
+                self.assertEqual(sorted(arc.extractmatching(self.dest, match)),
+                                 self.names)
+            self.assertEqual(self.extracted(), [
+                'hello-bfg/', 'hello-bfg/include/',
+                'hello-bfg/include/hello.hpp',
+            ])
+
+    def test_match_parent_attrs(self):
+        # Parent directories of matching members should be extracted as well,
+        # even when they appear after their children in the archive.
+        def match(name):
+            return name == 'hello-bfg/include/hello.hpp'
+
+        path = os.path.join(test_data_dir, 'hello-bfg.tar.gz')
+        with tarfile.open(path) as tar:
+            mtimes = {i.name: i.mtime for i in tar}
+
+        with archive.open(self.open_stream('hello-bfg.tar.gz'), 'r|*') as arc:
+            arc.extractmatching(self.dest, match)
+        self.assertEqual(self.extracted(), [
+            'hello-bfg/', 'hello-bfg/include/', 'hello-bfg/include/hello.hpp',
+        ])
+        for i in ('hello-bfg', 'hello-bfg/include'):
+            self.assertEqual(os.path.getmtime(os.path.join(self.dest, i)),
+                             mtimes[i])
@@ -0,0 +1,452 @@
+import hashlib
+import os
+import tempfile
+from io import BytesIO
+from unittest import mock, TestCase
+
+from mopack.cache import *
+from mopack.exceptions import ConfigurationError
+
+url = 'http://example.invalid/file.tar.gz'
+
+
+def digest(data):
+    return hashlib.sha256(data).hexdigest()
+
+
+class TestCacheDir(TestCase):
+    def test_explicit(self):
+        self.assertEqual(cache_dir({'MOPACK_CACHE_DIR': '/cache',
+                                    'HOME': '/home/user'}), '/cache')
+
+    def test_disabled(self):
+        self.assertEqual(cache_dir({'MOPACK_CACHE_DIR': '',
+                                    'HOME': '/home/user'}), None)
+        self.assertEqual(cache_dir({}), None)
+
+    def test_xdg(self):
+        self.assertEqual(cache_dir({'XDG_CACHE_HOME': '/xdg',
+                                    'HOME': '/home/user'}),
+                         os.path.join('/xdg', 'mopack'))
+
+    def test_home(self):
+        with mock.patch('mopack.cache.platform_name', return_value='linux'):
+            self.assertEqual(cache_dir({'HOME': '/home/user'}),
+                             os.path.join('/home/user', '.cache', 'mopack'))
+
+    def test_windows(self):
+        with mock.patch('mopack.cache.platform_name',
+                        return_value='windows'):
+            self.assertEqual(cache_dir({'LOCALAPPDATA': 'C:\\AppData'}),
+                             os.path.join('C:\\AppData', 'mopack', 'cache'))
+
+
+class TestGitMirrorPath(TestCase):
+    def test_enabled(self):
+        path = git_mirror_path({'MOPACK_CACHE_DIR': '/cache',
+                                'MOPACK_GIT_MIRRORS': '1'}, 'repo')
+        self.assertEqual(path, os.path.join('/cache', 'git',
+                                            digest(b'repo') + '.git'))
+
+    def test_disabled(self):
+        self.assertEqual(git_mirror_path({'MOPACK_CACHE_DIR': '/cache'},
+                                         'repo'), None)
+        self.assertEqual(git_mirror_path({'MOPACK_CACHE_DIR': '/cache',
+                                          'MOPACK_GIT_MIRRORS': '0'},
+                                         'repo'), None)
+        self.assertEqual(git_mirror_path({'MOPACK_CACHE_DIR': '',
+                                          'MOPACK_GIT_MIRRORS': '1'},
+                                         'repo'), None)
+
+
+class TestParseSize(TestCase):
+    def test_valid(self):
+        self.assertEqual(parse_size('1024'), 1024)
+        self.assertEqual(parse_size('2k'), 2048)
+        self.assertEqual(parse_size('3M'), 3 * 1024 ** 2)
+        self.assertEqual(parse_size('4GiB'), 4 * 1024 ** 3)
+        self.assertEqual(parse_size(' 5 TB '), 5 * 1024 ** 4)
+
+    def test_invalid(self):
+        for i in ('', 'G', '1.5G', '1X'):
+            with self.assertRaises(ValueError):
+                parse_size(i)
+
+
+class TestHashingReader(TestCase):
+    def test_read(self):
+        copy = BytesIO()
+        f = HashingReader(BytesIO(b'data'), copy=copy)
+        self.assertEqual(f.read(2), b'da')
+        self.assertEqual(f.digest, None)
+        self.assertEqual(f.read(), b'ta')
+        self.assertEqual(f.read(), b'')
+        self.assertEqual(f.digest, digest(b'data'))
+        self.assertEqual(copy.getvalue(), b'data')
+
+    def test_finish_on_exit(self):
+        with HashingReader(BytesIO(b'data'), digest(b'data')) as f:
+            self.assertEqual(f.read(2), b'da')
+        self.assertEqual(f.digest, digest(b'data'))
+
+        with self.assertRaises(ChecksumError):
+            with HashingReader(BytesIO(b'data'), digest(b'other')) as f:
+                f.read(2)
+
+    def test_error_on_exit(self):
+        with self.assertRaises(RuntimeError):
+            with HashingReader(BytesIO(b'data'), digest(b'other')) as f:
+                raise RuntimeError()
+        self.assertEqual(f.digest, None)
+
+
+class TestCheckSha256(TestCase):
+    def test_check(self):
+        check_sha256(digest(b'data'), digest(b'data'), 'file')
+        check_sha256(digest(b'data'), None, 'file')
+        with self.assertRaises(ChecksumError):
+            check_sha256(digest(b'data'), digest(b'other'), 'file')
+
+
+class TestDownloadCache(TestCase):
+    def setUp(self):
+        self._tempdir = tempfile.TemporaryDirectory()
+        self.cache = DownloadCache(self._tempdir.name)
+        self.data = {url: b'data'}
+        self.opener = mock.MagicMock(
+            side_effect=lambda url: BytesIO(self.data[url])
+        )
+
+    def tearDown(self):
+        self._tempdir.cleanup()
+
+    def read(self, *args, **kwargs):
+        with self.cache.open(*args, opener=self.opener, **kwargs) as f:
+            return f.read()
+
+    def blobs(self):
+        if not os.path.exists(self.cache._blobdir):
+            return []
+        return sorted(os.listdir(self.cache._blobdir))
+
+    def test_from_env(self):
+        self.assertEqual(DownloadCache.from_env({}), None)
+
+        cache = DownloadCache.from_env({'MOPACK_CACHE_DIR': '/cache'})
+        self.assertEqual(cache.path, os.path.join('/cache', 'downloads'))
+        self.assertEqual(cache.max_size, DownloadCache.default_max_size)
+
+        cache = DownloadCache.from_env({'MOPACK_CACHE_DIR': '/cache',
+                                        'MOPACK_CACHE_SIZE': '1M'})
+        self.assertEqual(cache.max_size, 1024 ** 2)
+
+        with self.assertRaisesRegex(ConfigurationError,
+                                    r'\$MOPACK_CACHE_SIZE'):
+            DownloadCache.from_env({'MOPACK_CACHE_DIR': '/cache',
+                                    'MOPACK_CACHE_SIZE': 'lots'})
+
+    def test_by_url(self):
+        self.assertEqual(self.read(url), b'data')
+        self.assertEqual(self.read(url), b'data')
+        self.opener.assert_called_once_with(url)
+        self.assertEqual(self.blobs(), [digest(b'data')])
+
+    def test_by_sha256(self):
+        self.assertEqual(self.read(url, digest(b'data')), b'data')
+        self.opener.assert_called_once_with(url)
+
+        # A different URL with the same contents is served from the cache.
+        self.assertEqual(self.read('http://mirror.invalid/file.tar.gz',
+                                   digest(b'data')), b'data')
+        self.opener.assert_called_once_with(url)
+
+        # Changing the expected digest forces a download.
+        self.data[url] = b'new data'
+        self.assertEqual(self.read(url, digest(b'new data')), b'new data')
+        self.assertEqual(self.opener.call_count, 2)
+        self.assertEqual(self.blobs(), sorted([digest(b'data'),
+                                               digest(b'new data')]))
+
+    def test_checksum_mismatch(self):
+        with self.assertRaises(ChecksumError):
+            self.read(url, digest(b'other'))
+        self.assertEqual(self.blobs(), [])
+        self.assertEqual(self.cache.lookup(url), None)
+
+    def test_download_error(self):
+        self.opener.side_effect = OSError()
+        with self.assertRaises(OSError):
+            self.read(url)
+        self.assertEqual(self.blobs(), [])
+
+    def test_unwritable(self):
+        # Block the cache directory with a file so that we can't create it.
+        path = os.path.join(self._tempdir.name, 'file')
+        open(path, 'w').close()
+        self.cache = DownloadCache(os.path.join(path, 'downloads'))
+
+        with mock.patch('warnings.warn') as mwarn:
+            self.assertEqual(self.read(url, digest(b'data')), b'data')
+            mwarn.assert_called_once()
+            self.assertRegex(mwarn.call_args[0][0],
+                             '^unable to use download cache')
+        with mock.patch('warnings.warn'), \
+             self.assertRaises(ChecksumError):
+            self.read(url, digest(b'other'))
+
+    def test_store_error(self):
+        with mock.patch('os.replace', side_effect=OSError()), \
+             mock.patch('warnings.warn') as mwarn:
+            self.assertEqual(self.read(url), b'data')
+            mwarn.assert_called_once()
+            self.assertRegex(mwarn.call_args[0][0],
+                             '^unable to store .* in download cache')
+        self.assertEqual(self.blobs(), [])
+
+    def test_partial_read(self):
+        with self.cache.open(url, opener=self.opener) as f:
+            self.assertEqual(f.read(2), b'da')
+        self.assertEqual(self.blobs(), [digest(b'data')])
+        self.assertEqual(self.read(url), b'data')
+        self.opener.assert_called_once_with(url)
+
+    def test_interrupted_read(self):
+        with self.assertRaises(RuntimeError):
+            with self.cache.open(url, opener=self.opener) as f:
+                f.read(2)
+                raise RuntimeError()
+        self.assertEqual(self.blobs(), [])
+        self.assertEqual(self.cache.lookup(url), None)
+
+    def test_evicted_blob(self):
+        self.read(url)
+        os.remove(os.path.join(self.cache._blobdir, digest(b'data')))
+        self.assertEqual(self.read(url), b'data')
+        self.assertEqual(self.opener.call_count, 2)
+
+    def test_evict(self):
+        self.cache.max_size = 10
+        urls = ['http://example.invalid/{}'.format(i) for i in range(3)]
+        for i, u in enumerate(urls):
+            self.data[u] = str(i).encode() * 4
+
+        self.read(urls[0])
+        self.read(urls[1])
+        # Make the first file the most-recently used, and then add a third
+        # file, which should push the second one out.
+        blob1 = os.path.join(self.cache._blobdir, digest(b'1111'))
+        os.utime(blob1, (0, 0))
+        self.read(urls[0])
+        self.read(urls[2])
+        self.assertEqual(self.blobs(), sorted([digest(b'0000'),
+                                               digest(b'2222')]))
+
+    def test_evict_keeps_newest(self):
+        self.cache.max_size = 1
+        self.assertEqual(self.read(url), b'data')
+        self.assertEqual(self.blobs(), [digest(b'data')])
+
+    def test_evict_stale_tmp(self):
+        os.makedirs(self.cache._blobdir)
+        stale = os.path.join(self.cache._blobdir, '.tmp-stale')
+        fresh = os.path.join(self.cache._blobdir, '.tmp-fresh')
+        for i in (stale, fresh):
+            open(i, 'w').close()
+        os.utime(stale, (0, 0))
+
+        self.cache.evict()
+        self.assertEqual(self.blobs(), ['.tmp-fresh'])
+
+
+class TestFormatSize(TestCase):
+    def test_format(self):
+        self.assertEqual(format_size(0), '0')
+        self.assertEqual(format_size(1023), '1023')
+        self.assertEqual(format_size(1536), '1.5K')
+        self.assertEqual(format_size(3 * 1024 ** 2), '3.0M')
+        self.assertEqual(format_size(4 * 1024 ** 3), '4.0G')
+        self.assertEqual(format_size(5 * 1024 ** 4), '5.0T')
+
+
+class TestArtifactCache(TestCase):
+    def setUp(self):
+        self._tempdir = tempfile.TemporaryDirectory()
+        self.cache = ArtifactCache(os.path.join(self._tempdir.name, 'cache'))
+        self.builddir = self.make_tree('build', {'file': 'data',
+                                                 'sub/file2': 'more data'})
+
+    def tearDown(self):
+        self._tempdir.cleanup()
+
+    def make_tree(self, name, files):
+        root = os.path.join(self._tempdir.name, name)
+        for k, v in files.items():
+            path = os.path.join(root, k)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path, 'w') as f:
+                f.write(v)
+        return root
+
+    def read_tree(self, root):
+        result = {}
+        for dirpath, dirs, files in os.walk(root):
+            for i in files:
+                path = os.path.join(dirpath, i)
+                with open(path) as f:
+                    result[os.path.relpath(path, root).replace(os.sep, '/')] \
+                        = f.read()
+        return result
+
+    def test_from_env(self):
+        self.assertEqual(ArtifactCache.from_env({}), None)
+        self.assertEqual(ArtifactCache.from_env({
+            'MOPACK_CACHE_DIR': '/cache',
+        }), None)
+        self.assertEqual(ArtifactCache.from_env({
+            'MOPACK_CACHE_DIR': '/cache', 'MOPACK_ARTIFACT_CACHE': '0',
+        }), None)
+        self.assertEqual(ArtifactCache.from_env({
+            'MOPACK_CACHE_DIR': '', 'MOPACK_ARTIFACT_CACHE': '1',
+        }), None)
+
+        cache = ArtifactCache.from_env({'MOPACK_CACHE_DIR': '/cache',
+                                        'MOPACK_ARTIFACT_CACHE': '1'})
+        self.assertEqual(cache.path, os.path.join('/cache', 'artifacts'))
+        self.assertEqual(cache.max_size, ArtifactCache.default_max_size)
+
+        cache = ArtifactCache.from_env({'MOPACK_CACHE_DIR': '/cache',
+                                        'MOPACK_ARTIFACT_CACHE_SIZE': '1M'},
+                                       force=True)
+        self.assertEqual(cache.max_size, 1024 ** 2)
+
+        with self.assertRaisesRegex(ConfigurationError,
+                                    r'\$MOPACK_ARTIFACT_CACHE_SIZE'):
+            ArtifactCache.from_env({'MOPACK_CACHE_DIR': '/cache',
+                                    'MOPACK_ARTIFACT_CACHE_SIZE': 'lots'},
+                                   force=True)
+
+    def test_store_restore(self):
+        self.cache.store('key', 'foo', {'builddir': self.builddir})
+        self.assertEqual([(i.key, i.name, i.size)
+                          for i in self.cache.entries()],
+                         [('key', 'foo', 13)])
+
+        dest = os.path.join(self._tempdir.name, 'dest')
+        self.make_tree('dest', {'stale': 'old'})
+        self.assertTrue(self.cache.restore('key', {'builddir': dest}))
+        self.assertEqual(self.read_tree(dest), {'file': 'data',
+                                                'sub/file2': 'more data'})
+
+        # Modifying the original or restored build doesn't affect the cache.
+        for i in (self.builddir, dest):
+            with open(os.path.join(i, 'file'), 'w') as f:
+                f.write('new data')
+        dest2 = os.path.join(self._tempdir.name, 'dest2')
+        self.assertTrue(self.cache.restore('key', {'builddir': dest2}))
+        self.assertEqual(self.read_tree(dest2), {'file': 'data',
+                                                 'sub/file2': 'more data'})
+
+    def test_restore_relocated(self):
+        srcdir = os.path.join(self._tempdir.name, 'src')
+        builddir = self.make_tree('build', {
+            'config.txt': 'src={0}\nbuild={1}\nother={1}bar\n'.format(
+                srcdir, self.builddir
+            ),
+            'binary': '\0' + self.builddir,
+        })
+        os.symlink(os.path.join(builddir, 'config.txt'),
+                   os.path.join(builddir, 'link'))
+        os.chmod(os.path.join(builddir, 'config.txt'), 0o444)
+        self.cache.store('key', 'foo', {'builddir': builddir},
+                         {'srcdir': srcdir, 'builddir': builddir})
+
+        newsrc = os.path.join(self._tempdir.name, 'newsrc')
+        dest = os.path.join(self._tempdir.name, 'dest')
+        self.assertTrue(self.cache.restore('key', {'builddir': dest},
+                                           {'srcdir': newsrc,
+                                            'builddir': dest}))
+        self.assertEqual(self.read_tree(dest), {
+            'file': 'data',
+            'sub/file2': 'more data',
+            'config.txt': 'src={}\nbuild={}\nother={}bar\n'.format(
+                newsrc, dest, builddir
+            ),
+            'binary': '\0' + builddir,
+            'link': 'src={}\nbuild={}\nother={}bar\n'.format(
+                newsrc, dest, builddir
+            ),
+        })
+        self.assertEqual(os.readlink(os.path.join(dest, 'link')),
+                         os.path.join(dest, 'config.txt'))
+        self.assertEqual(os.stat(os.path.join(dest, 'config.txt')).st_mode &
+                         0o777, 0o444)
+
+    def test_restore_error(self):
+        self.cache.store('key', 'foo', {'builddir': self.builddir})
+        dest = os.path.join(self._tempdir.name, 'dest')
+        with mock.patch('mopack.cache._relocate_tree',
+                        side_effect=OSError()), \
+             self.assertRaises(OSError):
+            self.cache.restore('key', {'builddir': dest})
+        self.assertFalse(os.path.exists(dest))
+
+    def test_restore_missing(self):
+        dest = os.path.join(self._tempdir.name, 'dest')
+        self.assertFalse(self.cache.restore('key', {'builddir': dest}))
+        self.assertFalse(os.path.exists(dest))
+
+        # The entry must have the same set of directories.
+        self.cache.store('key', 'foo', {'builddir': self.builddir})
+        self.assertFalse(self.cache.restore('key', {'builddir': dest,
+                                                    'srcdir': dest}))
+
+    def test_store_missing_dir(self):
+        missing = os.path.join(self._tempdir.name, 'missing')
+        self.cache.store('key', 'foo', {'builddir': self.builddir,
+                                        'srcdir': missing})
+
+        src = self.make_tree('src', {'file': 'data'})
+        dest = os.path.join(self._tempdir.name, 'dest')
+        self.assertTrue(self.cache.restore('key', {'builddir': dest,
+                                                   'srcdir': src}))
+        self.assertFalse(os.path.exists(src))
+        self.assertEqual(self.read_tree(dest), {'file': 'data',
+                                                'sub/file2': 'more data'})
+
+    def test_store_existing(self):
+        self.cache.store('key', 'foo', {'builddir': self.builddir})
+        self.cache.store('key', 'foo', {'builddir': self.builddir})
+        self.assertEqual([i.key for i in self.cache.entries()], ['key'])
+        self.assertEqual([i for i in os.listdir(self.cache.path)], ['key'])
+
+    def test_evict(self):
+        self.cache.max_size = 30
+        for i in range(2):
+            self.cache.store('key{}'.format(i), 'foo',
+                             {'builddir': self.builddir})
+            os.utime(self.cache._info_path('key{}'.format(i)), (i, i))
+
+        # Make the first entry the most-recently used, and then add another,
+        # which should push the second one out.
+        self.cache.restore('key0', {
+            'builddir': os.path.join(self._tempdir.name, 'dest')
+        })
+        self.cache.store('key2', 'foo', {'builddir': self.builddir})
+        self.assertEqual(sorted(i.key for i in self.cache.entries()),
+                         ['key0', 'key2'])
+
+        self.cache.evict(max_size=0)
+        self.assertEqual(self.cache.entries(), [])
+
+    def test_evict_keeps_newest(self):
+        self.cache.max_size = 1
+        self.cache.store('key', 'foo', {'builddir': self.builddir})
+        self.assertEqual([i.key for i in self.cache.entries()], ['key'])
+
+    def test_evict_stale_tmp(self):
+        os.makedirs(os.path.join(self.cache.path, '.tmp-stale'))
+        os.makedirs(os.path.join(self.cache.path, '.tmp-fresh'))
+        os.utime(os.path.join(self.cache.path, '.tmp-stale'), (0, 0))
+
+        self.cache.evict()
+        self.assertEqual(os.listdir(self.cache.path), ['.tmp-fresh'])
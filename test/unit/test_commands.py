@@ -1,4 +1,6 @@
 import os
+import subprocess
+import tempfile
 from unittest import mock, TestCase
 from textwrap import dedent
 
@@ -198,3 +200,243 @@ class TestResolve(CommandsTestCase):
             mresolve.assert_called_once()
             mclean.assert_called_once()
             msave.assert_called_once()
+
+    def make_directory_package(self, cfg, name, **kwargs):
+        return DirectoryPackage(
+            name, path='path', build='none', _options=cfg.options,
+            config_file=os.path.abspath('mopack.yml'), **kwargs
+        )
+
+    def test_dependency_order(self):
+        cfg = self.make_empty_config(['mopack.yml'])
+
+        metadata = Metadata(self.pkgdir)
+        metadata.add_package(self.make_directory_package(
+            cfg, 'foo', usage={'type': 'path', 'dependencies': ['bar']}
+        ))
+        metadata.add_package(self.make_directory_package(
+            cfg, 'bar', usage='pkg_config'
+        ))
+
+        order = []
+
+        def resolve(pkg, metadata):
+            order.append(pkg.name)
+
+        with mock.patch('mopack.commands.fetch', return_value=metadata), \
+             mock.patch.object(DirectoryPackage, 'resolve', autospec=True,
+                               side_effect=resolve), \
+             mock.patch.object(Metadata, 'save'):
+            commands.resolve(cfg, self.pkgdir)
+        self.assertEqual(order, ['bar', 'foo'])
+
+    def test_dependency_cycle(self):
+        cfg = self.make_empty_config(['mopack.yml'])
+
+        metadata = Metadata(self.pkgdir)
+        metadata.add_package(self.make_directory_package(
+            cfg, 'foo', usage={'type': 'path', 'dependencies': ['bar']}
+        ))
+        metadata.add_package(self.make_directory_package(
+            cfg, 'bar', usage={'type': 'path', 'dependencies': ['foo']}
+        ))
+
+        order = []
+
+        def resolve(pkg, metadata):
+            order.append(pkg.name)
+
+        with mock.patch('mopack.commands.fetch', return_value=metadata), \
+             mock.patch.object(DirectoryPackage, 'resolve', autospec=True,
+                               side_effect=resolve), \
+             mock.patch.object(Metadata, 'save'):
+            commands.resolve(cfg, self.pkgdir)
+        self.assertEqual(order, ['foo', 'bar'])
+
+    def test_parallel(self):
+        cfg = self.make_empty_config(['mopack.yml'])
+
+        metadata = Metadata(self.pkgdir)
+        for i in ['foo', 'bar', 'baz']:
+            metadata.add_package(self.make_directory_package(
+                cfg, i, usage='pkg_config'
+            ))
+
+        with mock.patch('mopack.commands.fetch', return_value=metadata), \
+             mock.patch.object(DirectoryPackage, 'resolve') as mresolve, \
+             mock.patch.object(Metadata, 'save') as msave:
+            commands.resolve(cfg, self.pkgdir, jobs=2)
+            self.assertEqual(mresolve.call_count, 3)
+            self.assertEqual(msave.call_count, 4)
+
+    def test_jobserver(self):
+        cfg = self.make_empty_config(['mopack.yml'])
+
+        metadata = Metadata(self.pkgdir)
+        metadata.add_package(self.make_directory_package(
+            cfg, 'foo', usage='pkg_config'
+        ))
+
+        jobservers = []
+
+        def resolve(metadata):
+            jobservers.append(metadata.jobserver)
+
+        with mock.patch('mopack.commands.fetch', return_value=metadata), \
+             mock.patch.object(DirectoryPackage, 'resolve',
+                               side_effect=resolve), \
+             mock.patch.object(Metadata, 'save'), \
+             mock.patch('mopack.commands.Jobserver') as mjobserver:
+            mjobserver.supported = True
+            commands.resolve(cfg, self.pkgdir, jobs=4)
+            mjobserver.assert_called_once_with(4)
+            self.assertEqual(jobservers, [mjobserver.return_value])
+            mjobserver.return_value.slot.assert_called_once_with()
+            mjobserver.return_value.close.assert_called_once_with()
+            self.assertEqual(metadata.jobserver, None)
+
+            # Without a job budget, we shouldn't use a jobserver.
+            mjobserver.reset_mock()
+            jobservers.clear()
+            commands.resolve(cfg, self.pkgdir)
+            mjobserver.assert_not_called()
+            self.assertEqual(jobservers, [None])
+
+    def test_parallel_failure(self):
+        cfg = self.make_empty_config(['mopack.yml'])
+
+        metadata = Metadata(self.pkgdir)
+        metadata.add_package(self.make_directory_package(
+            cfg, 'foo', usage={'type': 'path', 'dependencies': ['bar']}
+        ))
+        metadata.add_package(self.make_directory_package(
+            cfg, 'bar', usage='pkg_config'
+        ))
+
+        with mock.patch('mopack.commands.fetch', return_value=metadata), \
+             mock.patch.object(DirectoryPackage, 'resolve',
+                               side_effect=RuntimeError()) as mresolve, \
+             mock.patch.object(DirectoryPackage, 'clean_post') as mclean, \
+             mock.patch.object(Metadata, 'save') as msave:
+            with self.assertRaises(RuntimeError):
+                commands.resolve(cfg, self.pkgdir, jobs=2)
+            # `foo` depends on `bar`, so it should never be resolved.
+            mresolve.assert_called_once()
+            mclean.assert_called_once()
+            self.assertEqual(msave.call_count, 2)
+
+
+class TestUsages(CommandsTestCase):
+    def test_usages(self):
+        cfg = self.make_empty_config(['mopack.yml'])
+        metadata = Metadata(self.pkgdir, cfg.options)
+        for name in ('foo', 'bar'):
+            metadata.add_package(DirectoryPackage(
+                name, path='path', build='none', usage='pkg_config',
+                _options=cfg.options,
+                config_file=os.path.abspath('mopack.yml'),
+            ))
+            metadata.packages[name].resolved = True
+
+        def get_usage(self, metadata, submodules):
+            if self.name == 'bar':
+                raise ValueError('bad usage')
+            return {'name': self.name, 'submodules': submodules}
+
+        with mock.patch('mopack.metadata.Metadata.try_load',
+                        return_value=metadata) as mload, \
+             mock.patch.object(DirectoryPackage, 'get_usage', get_usage):
+            self.assertEqual(commands.usages(self.pkgdir, [
+                ('foo', None), ('foo', ['sub']), ('bar', None),
+                ('foo', None),
+            ]), {
+                'foo': {'name': 'foo', 'submodules': None},
+                'foo[sub]': {'name': 'foo', 'submodules': ['sub']},
+                'bar': {'error': 'bad usage'},
+            })
+            mload.assert_called_once_with(self.pkgdir, False, lazy=True)
+
+
+class TestPackageVersions(CommandsTestCase):
+    def make_metadata(self, pkgdir):
+        cfg = self.make_empty_config(['mopack.yml'])
+        metadata = Metadata(pkgdir, cfg.options)
+        for name in ('foo', 'bar'):
+            pkg = AptPackage(name, _options=cfg.options,
+                             config_file=os.path.abspath('mopack.yml'))
+            pkg.resolved = True
+            metadata.add_package(pkg)
+        metadata.save()
+        return metadata
+
+    def test_batched(self):
+        def mock_run(args, **kwargs):
+            if args[0] == 'pkg-config':
+                if '--list-all' in args:
+                    return subprocess.CompletedProcess(args, 0, 'foo  Foo\n')
+                if args[1:] == ['--modversion', 'foo']:
+                    return subprocess.CompletedProcess(args, 0, '1.0\n')
+                elif kwargs.get('check'):
+                    raise subprocess.CalledProcessError(1, args)
+                return subprocess.CompletedProcess(args, 1, '')
+            elif args[0] == 'dpkg-query':
+                return subprocess.CompletedProcess(
+                    args, 1, 'ii \tlibbar-dev:amd64\tlibbar-dev\t2.0\n'
+                )
+            raise OSError()
+
+        with tempfile.TemporaryDirectory() as pkgdir:
+            self.make_metadata(pkgdir)
+            metadata = Metadata.load(pkgdir)
+            with mock.patch('subprocess.run', side_effect=mock_run) as mrun:
+                self.assertEqual(commands.package_versions(metadata, jobs=2),
+                                 {'foo': '1.0', 'bar': '2.0'})
+                mrun.assert_any_call(
+                    ['pkg-config', '--modversion', 'foo', 'bar'],
+                    stdout=subprocess.PIPE, stderr=subprocess.DEVNULL,
+                    universal_newlines=True, env=mock.ANY
+                )
+                mrun.assert_any_call(
+                    ['dpkg-query', '-W',
+                     '-f${db:Status-Abbrev}\t${binary:Package}\t' +
+                     '${Package}\t${Version}\n',
+                     'libfoo-dev', 'libbar-dev'],
+                    stdout=subprocess.PIPE, stderr=subprocess.DEVNULL,
+                    universal_newlines=True, env=mock.ANY
+                )
+                # Only `bar` needed an individual query (to find that it has
+                # no .pc file before falling back to the dpkg version).
+                self.assertEqual(mrun.call_count, 5)
+
+            # The next time, we should use the cached versions.
+            metadata = Metadata.load(pkgdir)
+            with mock.patch('subprocess.run') as mrun:
+                self.assertEqual(commands.package_versions(metadata),
+                                 {'foo': '1.0', 'bar': '2.0'})
+                mrun.assert_not_called()
+
+    def test_invalidate(self):
+        with tempfile.TemporaryDirectory() as pkgdir:
+            metadata = self.make_metadata(pkgdir)
+            with mock.patch.object(AptPackage, 'version',
+                                   return_value='1.0') as mversion:
+                self.assertEqual(commands.package_versions(metadata),
+                                 {'foo': '1.0', 'bar': '1.0'})
+                self.assertEqual(mversion.call_count, 2)
+
+                commands.package_versions(Metadata.load(pkgdir))
+                self.assertEqual(mversion.call_count, 2)
+
+                # Saving the metadata (e.g. after resolving) invalidates the
+                # cached versions.
+                metadata.save()
+                commands.package_versions(Metadata.load(pkgdir))
+                self.assertEqual(mversion.call_count, 4)
+
+    def test_error(self):
+        with tempfile.TemporaryDirectory() as pkgdir:
+            metadata = self.make_metadata(pkgdir)
+            with mock.patch.object(AptPackage, 'version',
+                                   side_effect=OSError()):
+                with self.assertRaises(OSError):
+                    commands.package_versions(metadata, jobs=2)
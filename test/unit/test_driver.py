@@ -0,0 +1,32 @@
+import io
+from unittest import mock, TestCase
+
+from mopack import driver
+
+
+class TestReadDependencies(TestCase):
+    def setUp(self):
+        self.parser = mock.Mock()
+        self.parser.error.side_effect = SystemExit(2)
+
+    def read(self, dependency, stdin=''):
+        args = mock.Mock(dependency=dependency)
+        with mock.patch('sys.stdin', io.StringIO(stdin)):
+            return list(driver._read_dependencies(self.parser, args))
+
+    def test_args(self):
+        self.assertEqual(self.read([('foo', None), ('bar', ['baz'])]),
+                         [('foo', None), ('bar', ['baz'])])
+
+    def test_stdin(self):
+        self.assertEqual(self.read([('foo', None), ('-', None)],
+                                   'bar\n\n  baz[quux]\n'),
+                         [('foo', None), ('bar', None), ('baz', ['quux'])])
+        self.parser.error.assert_not_called()
+
+    def test_invalid_stdin(self):
+        with self.assertRaises(SystemExit):
+            self.read([('-', None)], 'foo\n\nbar[\n')
+        self.parser.error.assert_called_once_with(
+            'invalid dependency on line 3 of stdin: expected a dependency'
+        )
@@ -1,6 +1,18 @@
-from unittest import TestCase
+import json
+import os
+import random
+import tempfile
+from unittest import mock, skipIf, TestCase
 
+from mopack import expression
 from mopack.expression import *
+from mopack.expression import (ArrayLiteral, BinaryOp, Literal, StringOp,
+                               Symbol, TernaryOp, UnaryOp)
+
+try:
+    import pyparsing as pp
+except ImportError:  # pragma: no cover
+    pp = None
 
 
 class TestEvaluate(TestCase):
@@ -173,6 +185,20 @@ class TestEvaluate(TestCase):
         with self.assertRaises(ParseException):
             evaluate(self.symbols, 'foo ==', True)
 
+    def test_error_location(self):
+        with self.assertRaises(ParseException) as e:
+            evaluate(self.symbols, 'foo\n  == )', True)
+        self.assertEqual(e.exception.loc, 6)
+        self.assertEqual(e.exception.lineno, 2)
+        self.assertEqual(e.exception.col, 3)
+        self.assertEqual(str(e.exception), 'Expected end of text  ' +
+                         '(at char 6), (line:2, col:3)')
+
+        with self.assertRaises(SemanticException) as e:
+            evaluate(self.symbols, 'x ${{ foo + bad }}')
+        self.assertEqual(e.exception.loc, 12)
+        self.assertEqual(e.exception.msg, "undefined symbol 'bad'")
+
     def test_undefined_symbol(self):
         with self.assertRaises(SemanticException):
             evaluate(self.symbols, '${{ bad == "bad" }}')
@@ -180,3 +206,283 @@ class TestEvaluate(TestCase):
             evaluate(self.symbols, '${{ bad == "bad" }}', True)
         with self.assertRaises(SemanticException):
             evaluate(self.symbols, 'bad == "bad"', True)
+
+
+class TestParseCache(TestCase):
+    def setUp(self):
+        self._old_cache = dict(expression._parse_cache)
+        expression._parse_cache.clear()
+
+    def tearDown(self):
+        expression._parse_cache.clear()
+        expression._parse_cache.update(self._old_cache)
+
+    def test_cached(self):
+        with mock.patch('mopack.expression._parse',
+                        wraps=expression._parse) as mparse:
+            tok = parse('foo == "bar"', True)
+            self.assertIs(parse('foo == "bar"', True), tok)
+            self.assertIsNot(parse('foo == "bar"'), tok)
+            self.assertEqual(mparse.call_count, 2)
+
+    def test_plain_string(self):
+        self.assertEqual(parse('foo'), 'foo')
+        self.assertEqual(parse('foo'), 'foo')
+        self.assertEqual(parse(''), '')
+
+    def test_errors_not_cached(self):
+        for i in range(2):
+            with self.assertRaises(ParseException):
+                parse('foo ==', True)
+        self.assertEqual(expression._parse_cache, {})
+
+    def test_load_save(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            path = os.path.join(tmpdir, 'cache', 'expressions')
+            parse('foo == "bar"', True)
+            parse('foo')
+            parse('$foo bar')
+            save_parse_cache(path)
+
+            expression._parse_cache.clear()
+            load_parse_cache(path)
+            self.assertEqual(len(expression._parse_cache), 3)
+            with mock.patch('mopack.expression._parse') as mparse:
+                self.assertEqual(evaluate({'foo': 'bar'}, 'foo == "bar"',
+                                          True), True)
+                self.assertEqual(parse('foo'), 'foo')
+                self.assertEqual(evaluate({'foo': 'baz'}, '$foo bar'),
+                                 'baz bar')
+                mparse.assert_not_called()
+
+    def test_load_save_tokens(self):
+        symbols = {'foo': 'bar', 'arr': [1, 2]}
+        exprs = ['!(foo == "bar") || -arr[1] < 0 ? "yes" : [1, "two", null]',
+                 'arr[0] * 3 + 1 >= 4 && true', 'foo != "baz"']
+        with tempfile.TemporaryDirectory() as tmpdir:
+            path = os.path.join(tmpdir, 'expressions')
+            expected = [evaluate(symbols, i, True) for i in exprs]
+            save_parse_cache(path)
+
+            expression._parse_cache.clear()
+            load_parse_cache(path)
+            with mock.patch('mopack.expression._parse') as mparse:
+                self.assertEqual([evaluate(symbols, i, True) for i in exprs],
+                                 expected)
+                mparse.assert_not_called()
+
+            with self.assertRaisesRegex(SemanticException,
+                                        "undefined symbol 'foo'"):
+                evaluate({}, exprs[2], True)
+
+    def test_save_relative(self):
+        parse('$foo bar')
+        with mock.patch('os.makedirs') as mmakedirs, \
+             mock.patch('mopack.expression.atomic_open') as mopen:
+            save_parse_cache('expressions')
+            mmakedirs.assert_not_called()
+            mopen.assert_called_once_with('expressions')
+
+    def test_load_invalid(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            path = os.path.join(tmpdir, 'expressions')
+            load_parse_cache(path)
+            self.assertEqual(expression._parse_cache, {})
+
+            with open(path, 'wb') as f:
+                f.write(b'garbage')
+            load_parse_cache(path)
+            self.assertEqual(expression._parse_cache, {})
+
+            with open(path, 'w') as f:
+                json.dump({'version': 'other', 'entries': [
+                    ['foo', False, 'foo'],
+                ]}, f)
+            load_parse_cache(path)
+            self.assertEqual(expression._parse_cache, {})
+
+            # Only allow known token types.
+            with open(path, 'w') as f:
+                json.dump({
+                    'version': expression._get_cache_version(),
+                    'entries': [['foo', True, {'type': 'Token'}]],
+                }, f)
+            load_parse_cache(path)
+            self.assertEqual(expression._parse_cache, {})
+
+    def test_cache_version(self):
+        version = expression._get_cache_version()
+        with mock.patch('mopack.expression._cache_version', None), \
+             mock.patch('builtins.open', mock.mock_open(read_data=b'new')):
+            self.assertNotEqual(expression._get_cache_version(), version)
+
+
+def make_reference_parser():
+    # The original pyparsing-based grammar for our expressions. We keep this
+    # around to check that our hand-written parser accepts the same language
+    # and produces the same results.
+    def left_assoc(operands, operator=None, index=None):
+        if index is None:
+            index = len(operands) - 1
+        if index == 0:
+            return operands[0]
+
+        if operator is None:
+            return BinaryOp(left_assoc(operands, operator, index - 2),
+                            operands[index - 1], operands[index])
+        return BinaryOp(left_assoc(operands, operator, index - 1),
+                        operator, operands[index])
+
+    pp.ParserElement.enable_packrat(512)
+    expr = pp.Forward()
+
+    integer_literal = pp.common.signed_integer.copy().set_parse_action(
+        lambda t: [Literal(int(t[0]))]
+    )
+    string_literal = (
+        pp.QuotedString('"') | pp.QuotedString("'")
+    ).set_parse_action(lambda t: [Literal(t[0])])
+    array_literal = (
+        pp.Suppress('[') + pp.Optional(pp.delimited_list(expr)) +
+        pp.Suppress(']')
+    ).set_parse_action(lambda t: [ArrayLiteral(list(t))])
+    bool_literal = (
+        pp.Keyword('true').set_parse_action(lambda: [Literal(True)]) |
+        pp.Keyword('false').set_parse_action(lambda: [Literal(False)])
+    )
+    null_literal = pp.Keyword('null').set_parse_action(lambda: [Literal(None)])
+    literal = (integer_literal | string_literal | array_literal |
+               bool_literal | null_literal)
+
+    identifier = pp.Word(pp.alphas + '_', pp.alphanums + '_').set_parse_action(
+        lambda s, loc, t: [Symbol(s, loc, t[0])]
+    )
+
+    pre_expr = (literal | identifier |
+                (pp.Suppress('(') + expr + pp.Suppress(')')))
+    index = (
+        pre_expr + (pp.Suppress('[') + expr + pp.Suppress(']'))[1, ...]
+    ).set_parse_action(lambda t: [left_assoc(t, '[]')])
+
+    expr_atom = literal | index | identifier
+    expr <<= pp.infix_notation(expr_atom, [
+        (pp.one_of('! -'), 1, pp.opAssoc.RIGHT, lambda t: [UnaryOp(*t[0])]),
+        (pp.one_of('* / %'), 2, pp.opAssoc.LEFT, lambda t: [left_assoc(t[0])]),
+        (pp.one_of('+ -'), 2, pp.opAssoc.LEFT, lambda t: [left_assoc(t[0])]),
+        (pp.one_of('> >= < <='), 2, pp.opAssoc.LEFT,
+         lambda t: [left_assoc(t[0])]),
+        (pp.one_of('== !='), 2, pp.opAssoc.LEFT, lambda t: [left_assoc(t[0])]),
+        ('&&', 2, pp.opAssoc.LEFT, lambda t: [left_assoc(t[0])]),
+        ('||', 2, pp.opAssoc.LEFT, lambda t: [left_assoc(t[0])]),
+        (('?', ':'), 3, pp.opAssoc.RIGHT, lambda t: [TernaryOp(*t[0])]),
+    ])
+
+    expr_holder = ('${{' + expr + '}}').set_parse_action(lambda t: t[1])
+    identifier_holder = ('$' + identifier).set_parse_action(lambda t: t[1])
+    escaped_dollar = pp.Literal('$$').set_parse_action(lambda: ['$'])
+    dollar_expr = escaped_dollar | identifier_holder | expr_holder
+
+    bare_string = (
+        pp.SkipTo(pp.Literal('$') | pp.StringEnd()).leave_whitespace()
+        .set_parse_action(lambda t: t if len(t[0]) else [])
+    )
+
+    # By default, pyparsing expands tabs before parsing, which mangled
+    # strings and error locations; our parser leaves them alone.
+    if_expr = (dollar_expr | expr).parse_with_tabs()
+    str_expr = (bare_string + (dollar_expr + bare_string)[...]) \
+        .parse_with_tabs()
+
+    def parse(expression, if_context=False):
+        if if_context:
+            return if_expr.parse_string(expression, parseAll=True)[0]
+        ast = str_expr.parse_string(expression, parseAll=True)
+        if len(ast) == 0:
+            return expression
+        elif len(ast) == 1:
+            return ast[0]
+        return StringOp(list(ast))
+
+    return parse
+
+
+def dump(tok):
+    if isinstance(tok, Symbol):
+        return ('Symbol', tok.symbol, tok.loc)
+    elif isinstance(tok, ArrayLiteral):
+        return ('ArrayLiteral', [dump(i) for i in tok.value])
+    elif isinstance(tok, Literal):
+        return ('Literal', type(tok.value), tok.value)
+    elif isinstance(tok, UnaryOp):
+        return ('UnaryOp', tok.operator, dump(tok.operand))
+    elif isinstance(tok, (BinaryOp, TernaryOp)):
+        return (type(tok).__name__, tok.operator,
+                [dump(i) for i in tok.operands])
+    elif isinstance(tok, StringOp):
+        return ('StringOp', [dump(i) for i in tok.ast])
+    return tok
+
+
+@skipIf(pp is None, 'pyparsing not installed')
+class TestDifferential(TestCase):
+    cases = [
+        '', ' ', 'foo', '$$', '$$$', '$foo', '$ foo', '$true', '$1', '$', '$!',
+        '${{', '${{ x', '${{ x }', '${{ x }}', '${{ x }} ', '${{}}',
+        ' ${{ x }} $y $$ z ', 'a$b', '$foo == 1', '${{ "}}" }}',
+
+        '1', '+1', '-1', '--1', '- 1', '+ 1', '+x', '01', '12abc', '1_0',
+        '"foo"', "'foo'", '""', '"a\\nb"', "'a\\tb\\'", '"abc',
+        '"a\nb"', 'true', 'false', 'null', 'trueish', 'true_', 'true$',
+        'nulls', '[]', '[ ]', '[1]', '[1, 2]', '[1,', '[1 2]', '[1,]',
+        '[[]]', '[,]', '[@]',
+
+        'x', 'x[0]', 'x[0][1]', 'x[0] [1]', '(x)[0]', '(x)[', 'x[', 'x[]',
+        'x[0][', '[1][0]', 'true[0]', '"s"[0]', '1[0]', '-x[0]', 'x[(a +)]',
+
+        '1 + 2', '1 +2', '1 -1', 'x-1', '1--1', '1 + -2', '1 + +2',
+        '1 + 2 * 3 == 7', 'a * b + c', 'a + b * ', 'a < b < c', 'a >= b',
+        'a >== b', 'a =< b', 'a != b', '!=x', 'a ! b', '! !x', '!(a == b)',
+        'a && b || c', 'a || b && c', 'a & b', 'a ? b : c', 'a ? b',
+        'a ? b :', 'a ? b ? c : d : e', 'a ? b : c ? d : e', 'a?b:c',
+        'a ? b : c + ', '(a', '(a)', '(a)(b)', '()', '(1 ==', '(a + (b',
+        'x y', '1 2', '@', '=', '==1', '1 = 2', 'x.y', 'x ==', '1 +',
+        '\n x \n==\n y', 'a +\t\r\nb',
+    ]
+
+    fragments = [
+        'a', 'b1', '_', '1', '+1', '"s"', "'t'", 'true', 'null', ' ', '  ',
+        '(', ')', '[', ']', ',', '!', '-', '+', '*', '/', '%', '<', '<=',
+        '>', '>=', '==', '!=', '=', '&&', '||', '&', '?', ':', '$', '$$',
+        '${{', '}}', '}', '@', '\n',
+    ]
+
+    @classmethod
+    def setUpClass(cls):
+        cls.reference = staticmethod(make_reference_parser())
+
+    def assertSameParse(self, expr, if_context):
+        try:
+            expected = dump(self.reference(expr, if_context))
+        except pp.ParseBaseException as e:
+            with self.assertRaises(ParseException) as ctx:
+                expression._parse(expr, if_context)
+            self.assertEqual(ctx.exception.loc, e.loc,
+                             '{!r} (if_context={})'.format(expr, if_context))
+        else:
+            self.assertEqual(dump(expression._parse(expr, if_context)),
+                             expected,
+                             '{!r} (if_context={})'.format(expr, if_context))
+
+    def test_cases(self):
+        for i in self.cases:
+            for expr in (i, '${{ ' + i + ' }}', 'x ${{' + i + '}}y'):
+                self.assertSameParse(expr, True)
+                self.assertSameParse(expr, False)
+
+    def test_random(self):
+        rng = random.Random(0)
+        for i in range(500):
+            expr = ''.join(rng.choice(self.fragments)
+                           for j in range(rng.randint(1, 8)))
+            self.assertSameParse(expr, True)
+            self.assertSameParse('${{ ' + expr + ' }}', False)
@@ -1,4 +1,4 @@
-from unittest import TestCase
+from unittest import mock, TestCase
 
 from mopack.glob import *
 
@@ -123,3 +123,45 @@ class TestFilterGlob(TestCase):
     def test_explicit_glob(self):
         g = Glob('/foo')
         self.assertEqual(self._glob(g), ['foo', 'foo/', 'foo/bar'])
+
+
+class TestGlobSet(TestCase):
+    def test_prefix(self):
+        self.assertEqual(Glob('/foo/bar/*.c').prefix, ('foo', 'bar'))
+        self.assertEqual(Glob('/foo/**/bar').prefix, ('foo',))
+        self.assertEqual(Glob('/foo/bar/').prefix, ('foo', 'bar'))
+        self.assertEqual(Glob('/*/bar').prefix, ())
+        self.assertEqual(Glob('foo/bar').prefix, ())
+        self.assertEqual(Glob('').prefix, ())
+
+    def test_match(self):
+        globs = GlobSet(['/foo/bar', '/foo/*.c', '/baz/', 'qux'])
+        self.assertTrue(globs.match('foo/bar'))
+        self.assertTrue(globs.match('foo/bar/file'))
+        self.assertTrue(globs.match('foo/file.c'))
+        self.assertTrue(globs.match('baz/'))
+        self.assertTrue(globs.match('baz/file'))
+        self.assertTrue(globs.match('any/path/qux'))
+
+        self.assertFalse(globs.match('foo/'))
+        self.assertFalse(globs.match('foo/file.h'))
+        self.assertFalse(globs.match('baz'))
+        self.assertFalse(globs.match('bar/foo/bar'))
+
+    def test_only_checks_candidates(self):
+        globs = GlobSet(['/foo/bar', '/baz/*'])
+        with mock.patch.object(Glob, 'match', autospec=True,
+                               return_value=False) as m:
+            globs.match('foo/bar/file')
+            self.assertEqual([i.args[0].prefix for i in m.mock_calls],
+                             [('foo', 'bar')])
+
+    def test_match_kwargs(self):
+        with mock.patch.object(Glob, 'match', return_value=True) as m:
+            self.assertEqual(list(filter_glob('foo', ['foo'], key='value')),
+                             ['foo'])
+            m.assert_called_once_with('foo', key='value')
+
+    def test_empty(self):
+        self.assertFalse(GlobSet([]).match('foo'))
+        self.assertTrue(GlobSet(['']).match('foo'))
@@ -0,0 +1,147 @@
+import os
+import shutil
+import subprocess
+import tempfile
+import threading
+from collections import ChainMap
+from unittest import mock, skipIf, TestCase
+
+from mopack.jobserver import *
+
+
+class TestEnvJobs(TestCase):
+    def test_unset(self):
+        self.assertEqual(env_jobs({}), None)
+        self.assertEqual(env_jobs({'MOPACK_JOBS': ''}), None)
+
+    def test_valid(self):
+        self.assertEqual(env_jobs({'MOPACK_JOBS': '4'}), 4)
+
+    def test_invalid(self):
+        with self.assertRaises(ValueError):
+            env_jobs({'MOPACK_JOBS': '0'})
+        with self.assertRaises(ValueError):
+            env_jobs({'MOPACK_JOBS': 'foo'})
+
+
+@skipIf(not Jobserver.supported, 'named pipes unsupported')
+class TestJobserver(TestCase):
+    def tokens(self, jobserver):
+        # Drain the pipe to count how many tokens are free, then put them
+        # back.
+        try:
+            tokens = os.read(jobserver._rfd, 1024)
+        except BlockingIOError:
+            tokens = b''
+        os.write(jobserver._wfd, tokens)
+        return len(tokens)
+
+    def test_slots(self):
+        with Jobserver(3) as jobserver:
+            self.assertEqual(self.tokens(jobserver), 2)
+            with jobserver.slot():
+                # The first slot is the implicit one.
+                self.assertEqual(self.tokens(jobserver), 2)
+                with jobserver.slot():
+                    self.assertEqual(self.tokens(jobserver), 1)
+                    with jobserver.slot():
+                        self.assertEqual(self.tokens(jobserver), 0)
+                    self.assertEqual(self.tokens(jobserver), 1)
+            self.assertEqual(self.tokens(jobserver), 2)
+
+            with jobserver.slot():
+                self.assertEqual(self.tokens(jobserver), 2)
+
+    def test_slot_error(self):
+        with Jobserver(2) as jobserver:
+            with self.assertRaises(RuntimeError):
+                with jobserver.slot():
+                    with jobserver.slot():
+                        raise RuntimeError()
+            self.assertEqual(self.tokens(jobserver), 1)
+            self.assertTrue(jobserver._implicit_free)
+
+    def test_extra_slots(self):
+        with Jobserver(4) as jobserver:
+            with jobserver.slot():
+                with jobserver.extra_slots() as extra:
+                    self.assertEqual(extra, 3)
+                    self.assertEqual(self.tokens(jobserver), 0)
+                    with jobserver.extra_slots() as extra2:
+                        self.assertEqual(extra2, 0)
+                self.assertEqual(self.tokens(jobserver), 3)
+
+                with jobserver.extra_slots(limit=2) as extra:
+                    self.assertEqual(extra, 2)
+                    self.assertEqual(self.tokens(jobserver), 1)
+                self.assertEqual(self.tokens(jobserver), 3)
+
+    def test_lost_tokens(self):
+        with Jobserver(2) as jobserver:
+            acquired = threading.Event()
+
+            def build():
+                with jobserver.slot():
+                    acquired.set()
+
+            with jobserver.slot():
+                # Pretend a child process died while holding our only token.
+                os.read(jobserver._rfd, 1)
+                thread = threading.Thread(target=build)
+                thread.start()
+                self.assertFalse(acquired.wait(0.2))
+
+            # Once the implicit slot is free, the waiting build can use it.
+            thread.join(5)
+            self.assertTrue(acquired.is_set())
+
+    def test_environ(self):
+        with Jobserver(4) as jobserver:
+            tmpdir = jobserver._tmpdir
+            r, w = jobserver.pass_fds
+            self.assertEqual(jobserver.makeflags, (
+                '-j4 --jobserver-fds={0},{1} --jobserver-auth={0},{1}'
+            ).format(r, w))
+
+            env = jobserver.environ({'MAKEFLAGS': '-k', 'PATH': '/bin'})
+            self.assertIsInstance(env, ChainMap)
+            self.assertEqual(dict(env), {'MAKEFLAGS': jobserver.makeflags,
+                                         'PATH': '/bin'})
+        self.assertFalse(os.path.exists(tmpdir))
+
+    @skipIf(not shutil.which('make'), 'make not found')
+    def test_make(self):
+        # Each recipe reports whether make gave it the jobserver, and sleeps a
+        # bit so that the jobs actually overlap.
+        makefile = ('all: a b c d\n' +
+                    'a b c d:\n' +
+                    '\t@echo "$(MAKEFLAGS)" | grep -q jobserver && ' +
+                    'sleep 0.1 && echo $@\n')
+        with Jobserver(2) as jobserver, \
+             tempfile.TemporaryDirectory() as tmpdir:
+            with open(os.path.join(tmpdir, 'Makefile'), 'w') as f:
+                f.write(makefile)
+            env = jobserver.environ(os.environ)
+            with jobserver.slot():
+                result = subprocess.run(
+                    ['make'], cwd=tmpdir, env=env,
+                    pass_fds=jobserver.pass_fds, stdout=subprocess.PIPE,
+                    stderr=subprocess.PIPE, universal_newlines=True
+                )
+            self.assertEqual(result.returncode, 0, result.stderr)
+            self.assertEqual(result.stderr, '')
+            self.assertEqual(sorted(result.stdout.split()),
+                             ['a', 'b', 'c', 'd'])
+            # Make should have handed back every token it took.
+            self.assertEqual(self.tokens(jobserver), 1)
+
+    def test_invalid(self):
+        with self.assertRaises(ValueError):
+            Jobserver(0)
+
+    def test_mkfifo_error(self):
+        with mock.patch('os.mkfifo', side_effect=OSError()), \
+             mock.patch('shutil.rmtree', side_effect=shutil.rmtree) as mrmtree:
+            with self.assertRaises(OSError):
+                Jobserver(2)
+            mrmtree.assert_called_once()
@@ -1,13 +1,55 @@
 import json
-from unittest import mock
+import os
+import tempfile
+from unittest import mock, TestCase
 
-from . import OptionsTest, Stream
+from . import OptionsTest
 
-from mopack.metadata import Metadata, MetadataVersionError
+from mopack.metadata import (DependencyCycleError, LazyPackages, Metadata,
+                             MetadataVersionError, VersionCache)
+from mopack.path import atomic_open
+from mopack.sources import Package
 from mopack.sources.apt import AptPackage
 from mopack.sources.system import SystemPackage
 
 
+class TestVersionCache(TestCase):
+    def test_lookup(self):
+        cache = VersionCache()
+        with self.assertRaises(KeyError):
+            cache.lookup('foo', 'record')
+
+        cache.add('foo', 'record', '1.0')
+        self.assertEqual(cache.lookup('foo', 'record'), '1.0')
+        with self.assertRaises(KeyError):
+            cache.lookup('foo', 'other')
+
+        cache.add('bar', 'record', None)
+        self.assertEqual(cache.lookup('bar', 'record'), None)
+
+    def test_save(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            path = os.path.join(tmpdir, 'versions.json')
+            cache = VersionCache(path)
+            cache.add('foo', 'foo-record', '1.0')
+            cache.add('bar', None, '2.0')
+            cache.save()
+
+            cache = VersionCache(path)
+            self.assertEqual(cache.lookup('foo', 'foo-record'), '1.0')
+            with self.assertRaises(KeyError):
+                cache.lookup('bar', None)
+
+    def test_invalid_cache_file(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            path = os.path.join(tmpdir, 'versions.json')
+            with open(path, 'w') as f:
+                f.write('{"version": 1, "packages": [}')
+            cache = VersionCache(path)
+            with self.assertRaises(KeyError):
+                cache.lookup('foo', 'record')
+
+
 class TestMetadata(OptionsTest):
     pkgdir = '/path/to/builddir/mopack'
     config_file = '/path/to/mopack.yml'
@@ -41,22 +83,231 @@ class TestMetadata(OptionsTest):
         with self.assertRaises(KeyError):
             metadata.get_package('foo')
 
-    def test_save(self):
-        out = Stream('')
-        with mock.patch('os.makedirs'), \
-             mock.patch('builtins.open', return_value=out):
-            metadata = Metadata(self.pkgdir)
-            pkg = AptPackage('foo', _options=metadata.options,
+    def test_get_usage(self):
+        metadata = self.make_metadata(self.pkgdir, ['foo', 'bar', 'baz'])
+        deps = {'foo': ['bar', 'baz'], 'bar': ['baz'], 'baz': []}
+
+        def get_usage(pkg, metadata, submodules):
+            for i in deps[pkg.name]:
+                metadata.get_usage(i)
+            return {'name': pkg.name, 'submodules': submodules}
+
+        with mock.patch.object(AptPackage, 'get_usage', side_effect=get_usage,
+                               autospec=True) as mget:
+            self.assertEqual(metadata.get_usage('foo'),
+                             {'name': 'foo', 'submodules': None})
+            self.assertEqual(mget.call_count, 3)
+
+            self.assertEqual(metadata.get_usage('foo'),
+                             {'name': 'foo', 'submodules': None})
+            self.assertEqual(mget.call_count, 3)
+
+            self.assertEqual(metadata.get_usage('foo', ['sub']),
+                             {'name': 'foo', 'submodules': ['sub']})
+            self.assertEqual(mget.call_count, 4)
+
+            # Adding a package clears the cache.
+            metadata.add_package(metadata.packages['baz'])
+            metadata.get_usage('foo')
+            self.assertEqual(mget.call_count, 7)
+
+    def test_get_usage_cycle(self):
+        metadata = self.make_metadata(self.pkgdir, ['foo', 'bar', 'baz'])
+        deps = {'foo': ['bar'], 'bar': ['baz'], 'baz': ['bar']}
+
+        def get_usage(pkg, metadata, submodules):
+            for i in deps[pkg.name]:
+                metadata.get_usage(i)
+            return {'name': pkg.name}
+
+        with mock.patch.object(AptPackage, 'get_usage', side_effect=get_usage,
+                               autospec=True):
+            with self.assertRaisesRegex(DependencyCycleError,
+                                        '^dependency cycle: bar -> baz -> ' +
+                                        'bar$'):
+                metadata.get_usage('foo')
+
+            # Failures aren't cached.
+            deps['baz'] = []
+            self.assertEqual(metadata.get_usage('foo'), {'name': 'foo'})
+
+    def make_metadata(self, pkgdir, names=['foo']):
+        metadata = Metadata(pkgdir)
+        for i in names:
+            pkg = AptPackage(i, _options=metadata.options,
                              config_file=self.config_file)
             pkg.resolved = True
             metadata.add_package(pkg)
+        return metadata
+
+    def records(self, pkgdir):
+        return sorted(os.listdir(os.path.join(pkgdir, 'metadata')))
+
+    def test_save(self):
+        with tempfile.TemporaryDirectory() as pkgdir:
+            metadata = self.make_metadata(pkgdir)
             metadata.save()
 
-        # Test round-tripping a package.
+            with open(os.path.join(pkgdir, 'mopack.json')) as f:
+                manifest = json.load(f)
+            self.assertEqual(manifest['version'], 2)
+            self.assertEqual(list(manifest['metadata']['packages']), ['foo'])
+            self.assertEqual(self.records(pkgdir), sorted([
+                manifest['metadata']['options'],
+                manifest['metadata']['packages']['foo'],
+            ]))
+
+            # Test round-tripping a package.
+            metadata_copy = Metadata.load(pkgdir)
+            self.assertEqual(metadata_copy.get_package('foo'),
+                             metadata.get_package('foo'))
+
+    def test_save_incremental(self):
+        with tempfile.TemporaryDirectory() as pkgdir:
+            metadata = self.make_metadata(pkgdir, ['foo', 'bar'])
+            metadata.save()
+            old_records = self.records(pkgdir)
+
+            # Saving without any changes shouldn't write (or even serialize)
+            # any packages' records.
+            with mock.patch('mopack.metadata.atomic_open',
+                            side_effect=atomic_open) as m, \
+                 mock.patch.object(AptPackage, 'dehydrate') as mdehydrate:
+                metadata.save()
+                self.assertEqual(m.call_count, 1)
+                mdehydrate.assert_not_called()
+            self.assertEqual(self.records(pkgdir), old_records)
+
+            # Changing one package should only serialize and write its record,
+            # and remove the old one.
+            metadata.packages['bar'].resolved = False
+            metadata.mark_dirty('bar')
+            with mock.patch('mopack.metadata.atomic_open',
+                            side_effect=atomic_open) as m, \
+                 mock.patch.object(AptPackage, 'dehydrate',
+                                   side_effect=AptPackage.dehydrate,
+                                   autospec=True) as mdehydrate:
+                metadata.save()
+                self.assertEqual(m.call_count, 2)
+                mdehydrate.assert_called_once_with(metadata.packages['bar'])
+            new_records = self.records(pkgdir)
+            self.assertEqual(len(new_records), 3)
+            self.assertEqual(len(set(old_records) & set(new_records)), 2)
+
+            metadata_copy = Metadata.load(pkgdir)
+            self.assertEqual(list(metadata_copy.packages), ['foo', 'bar'])
+            self.assertEqual(metadata_copy.packages['bar'].resolved, False)
+
+    def test_version_cache(self):
+        with tempfile.TemporaryDirectory() as pkgdir:
+            metadata = self.make_metadata(pkgdir, ['foo', 'bar'])
+            metadata.save()
+            record = metadata.package_record('foo')
+            self.assertIsNotNone(record)
+
+            metadata_copy = Metadata.load(pkgdir, lazy=True)
+            self.assertEqual(metadata_copy.package_record('foo'), record)
+            metadata_copy.version_cache.add('foo', record, '1.0')
+            metadata_copy.version_cache.save()
+            self.assertEqual(Metadata.load(pkgdir).version_cache.lookup(
+                'foo', record
+            ), '1.0')
+
+            # Saving the metadata again should clear the cache.
+            metadata.save()
+            with self.assertRaises(KeyError):
+                Metadata.load(pkgdir).version_cache.lookup('foo', record)
+
+    def test_load_lazy(self):
+        with tempfile.TemporaryDirectory() as pkgdir:
+            metadata = self.make_metadata(pkgdir, ['foo', 'bar', 'baz'])
+            metadata.save()
+
+            with mock.patch('mopack.sources.Package.rehydrate',
+                            side_effect=Package.rehydrate) as m:
+                metadata_copy = Metadata.load(pkgdir, lazy=True)
+                self.assertIsInstance(metadata_copy.packages, LazyPackages)
+                self.assertEqual(list(metadata_copy.packages),
+                                 ['foo', 'bar', 'baz'])
+                self.assertTrue('bar' in metadata_copy.packages)
+                self.assertFalse('quux' in metadata_copy.packages)
+                m.assert_not_called()
+
+                self.assertEqual(metadata_copy.get_package('bar'),
+                                 metadata.get_package('bar'))
+                self.assertEqual(metadata_copy.packages.loaded, ['bar'])
+                self.assertEqual(m.call_count, 1)
+
+                metadata_copy.get_package('bar')
+                self.assertEqual(m.call_count, 1)
+
+            self.assertEqual(metadata_copy.packages,
+                             Metadata.load(pkgdir).packages)
+
+    def test_load_lazy_concurrent_save(self):
+        with tempfile.TemporaryDirectory() as pkgdir:
+            metadata = self.make_metadata(pkgdir)
+            metadata.save()
+            metadata_copy = Metadata.load(pkgdir, lazy=True)
+
+            metadata.packages['foo'].resolved = False
+            metadata.mark_dirty('foo')
+            metadata.save()
+            self.assertEqual(metadata_copy.packages['foo'].resolved, False)
+
+    def test_load_lazy_v1(self):
+        metadata = self.make_metadata(self.pkgdir)
+        data = {
+            'version': 1,
+            'config_files': {'explicit': [], 'implicit': []},
+            'metadata': {
+                'options': metadata.options.dehydrate(),
+                'packages': [metadata.packages['foo'].dehydrate()],
+            },
+        }
+        with mock.patch('builtins.open',
+                        mock.mock_open(read_data=json.dumps(data))):
+            metadata_copy = Metadata.load(self.pkgdir, lazy=True)
+        self.assertEqual(metadata_copy.packages, metadata.packages)
+
+    def test_load_v1(self):
+        metadata = self.make_metadata(self.pkgdir)
+        data = {
+            'version': 1,
+            'config_files': {'explicit': ['mopack.yml'], 'implicit': []},
+            'metadata': {
+                'options': metadata.options.dehydrate(),
+                'packages': [metadata.packages['foo'].dehydrate()],
+            },
+        }
         with mock.patch('builtins.open',
-                        mock.mock_open(read_data=out.getvalue())):
-            metadata_copy = Metadata.load(self.config_file)
-            self.assertEqual(metadata_copy.get_package('foo'), pkg)
+                        mock.mock_open(read_data=json.dumps(data))):
+            metadata_copy = Metadata.load(self.pkgdir)
+        self.assertEqual(metadata_copy.files, ['mopack.yml'])
+        self.assertEqual(metadata_copy.get_package('foo'),
+                         metadata.get_package('foo'))
+
+    def test_load_concurrent_save(self):
+        with tempfile.TemporaryDirectory() as pkgdir:
+            metadata = self.make_metadata(pkgdir)
+            metadata.save()
+            read_state = Metadata._read_state
+
+            # Simulate another process saving new metadata right after we've
+            # read the manifest.
+            def save_after_read(pkgdir):
+                state = read_state(pkgdir)
+                if m.call_count == 1:
+                    metadata.packages['foo'].resolved = False
+                    metadata.mark_dirty('foo')
+                    metadata.save()
+                return state
+
+            with mock.patch.object(Metadata, '_read_state',
+                                   side_effect=save_after_read) as m:
+                metadata_copy = Metadata.load(pkgdir)
+                self.assertEqual(m.call_count, 2)
+            self.assertEqual(metadata_copy.packages['foo'].resolved, False)
 
     def test_load_invalid_version(self):
         data = {
@@ -1,6 +1,12 @@
+import os
+import pickle
+import tempfile
 from unittest import mock, TestCase
 
-from mopack.package_defaults import DefaultConfig, _get_default_config
+from mopack import package_defaults
+from mopack.package_defaults import (compile_bundle, save_bundle,
+                                     DefaultConfig, _get_default_config,
+                                     _load_bundle)
 from mopack.types import Unset
 from mopack.yaml_tools import YamlParseError
 
@@ -128,13 +134,100 @@ class TestGetDefaultConfig(TestCase):
         _get_default_config._reset()
 
     def test_normal(self):
-        with mock.patch('os.path.exists', return_value=False) as mexists:
+        with mock.patch('mopack.package_defaults._load_bundle',
+                        return_value=None), \
+             mock.patch('os.path.exists', return_value=False) as mexists:
             _get_default_config('foo')
             mexists.assert_called_once()
 
     def test_invalid_characters(self):
-        with mock.patch('os.path.exists', return_value=False) as mexists:
+        with mock.patch('mopack.package_defaults._load_bundle',
+                        return_value=None), \
+             mock.patch('os.path.exists', return_value=False) as mexists:
             _get_default_config('foo/bar')
             _get_default_config('.')
             _get_default_config('../foo')
             mexists.assert_not_called()
+
+    def test_bundle(self):
+        with mock.patch('mopack.package_defaults._load_bundle',
+                        return_value={'foo': pickle.dumps('config')}), \
+             mock.patch('os.path.exists') as mexists:
+            self.assertEqual(_get_default_config('foo'), 'config')
+            self.assertIs(_get_default_config('bar'), None)
+            mexists.assert_not_called()
+
+
+class TestBundle(TestCase):
+    def setUp(self):
+        self._tempdir = tempfile.TemporaryDirectory()
+        self.defaults_dir = os.path.join(self._tempdir.name, 'defaults')
+        self.bundle_path = os.path.join(self.defaults_dir, 'bundle.pickle')
+        os.mkdir(self.defaults_dir)
+        self.write('foo', 'value')
+
+        _load_bundle._reset()
+        patches = [
+            mock.patch.object(package_defaults, '_defaults_dir',
+                              self.defaults_dir),
+            mock.patch.object(package_defaults, '_bundle_path',
+                              self.bundle_path),
+        ]
+        for i in patches:
+            i.start()
+            self.addCleanup(i.stop)
+
+    def tearDown(self):
+        _load_bundle._reset()
+        self._tempdir.cleanup()
+
+    def write(self, name, value):
+        with open(os.path.join(self.defaults_dir, name + '.yml'), 'w') as f:
+            f.write('source:\n  foo:\n    field: {}\n'.format(value))
+
+    def get(self, bundle, name):
+        return pickle.loads(bundle[name]).get({}, 'source', 'foo', 'field')
+
+    def test_compile(self):
+        bundle = compile_bundle(self.defaults_dir)
+        self.assertEqual(list(bundle['configs']), ['foo'])
+        self.assertEqual(self.get(bundle['configs'], 'foo'), 'value')
+
+    def test_load(self):
+        save_bundle(self.bundle_path, self.defaults_dir)
+        with mock.patch('mopack.package_defaults.save_bundle') as msave:
+            self.assertEqual(self.get(_load_bundle(), 'foo'), 'value')
+            msave.assert_not_called()
+
+    def test_load_reads_only_bundle(self):
+        save_bundle(self.bundle_path, self.defaults_dir)
+        with mock.patch('builtins.open', side_effect=open) as mopen:
+            self.assertEqual(self.get(_load_bundle(), 'foo'), 'value')
+            mopen.assert_called_once_with(self.bundle_path, 'rb')
+
+    def test_missing(self):
+        # We should never build the bundle at runtime.
+        self.assertIs(_load_bundle(), None)
+        self.assertFalse(os.path.exists(self.bundle_path))
+
+    def test_stale(self):
+        save_bundle(self.bundle_path, self.defaults_dir)
+        with open(self.bundle_path, 'rb') as f:
+            old_bundle = f.read()
+
+        self.write('foo', 'new value')
+        self.assertIs(_load_bundle(), None)
+        with open(self.bundle_path, 'rb') as f:
+            self.assertEqual(f.read(), old_bundle)
+
+    def test_added_default(self):
+        save_bundle(self.bundle_path, self.defaults_dir)
+        self.write('bar', 'value')
+        self.assertIs(_load_bundle(), None)
+
+    def test_invalid_default(self):
+        with open(os.path.join(self.defaults_dir, 'bad.yml'), 'w') as f:
+            f.write('unknown:\n  foo: {}\n')
+        with self.assertRaises(YamlParseError):
+            compile_bundle(self.defaults_dir)
+        self.assertIs(_load_bundle(), None)
@@ -1,5 +1,6 @@
 import ntpath
 import os
+import tempfile
 from unittest import mock, TestCase
 
 from mopack.placeholder import placeholder
@@ -30,6 +31,46 @@ class TestPushd(TestCase):
         mmakedirs.assert_called_once_with('foo', 0o777, False)
 
 
+class TestAtomicOpen(TestCase):
+    def test_write(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            path = os.path.join(tmpdir, 'file.txt')
+            with open(path, 'w') as f:
+                f.write('old')
+
+            with atomic_open(path) as f:
+                f.write('new')
+                with open(path) as g:
+                    self.assertEqual(g.read(), 'old')
+
+            with open(path) as f:
+                self.assertEqual(f.read(), 'new')
+            self.assertEqual(os.listdir(tmpdir), ['file.txt'])
+
+    def test_binary(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            path = os.path.join(tmpdir, 'file.bin')
+            with atomic_open(path, 'wb') as f:
+                f.write(b'data')
+            with open(path, 'rb') as f:
+                self.assertEqual(f.read(), b'data')
+
+    def test_error(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            path = os.path.join(tmpdir, 'file.txt')
+            with open(path, 'w') as f:
+                f.write('old')
+
+            with self.assertRaises(RuntimeError), \
+                 atomic_open(path) as f:
+                f.write('new')
+                raise RuntimeError()
+
+            with open(path) as f:
+                self.assertEqual(f.read(), 'old')
+            self.assertEqual(os.listdir(tmpdir), ['file.txt'])
+
+
 class TestFileOutdated(TestCase):
     def test_outdated(self):
         with mock.patch('os.path.getmtime', lambda p: 0 if p == 'foo' else 1):
@@ -54,6 +95,82 @@ class TestFileOutdated(TestCase):
             self.assertFalse(file_outdated('foo', 'bar', False))
 
 
+class TestDirectoryCache(TestCase):
+    def setUp(self):
+        self._tempdir = tempfile.TemporaryDirectory()
+        self.tmpdir = self._tempdir.name
+        self.incdir = os.path.join(self.tmpdir, 'include')
+        os.mkdir(self.incdir)
+        os.mkdir(os.path.join(self.incdir, 'subdir'))
+        open(os.path.join(self.incdir, 'foo.hpp'), 'w').close()
+
+        # Make the directory old enough that its listing isn't racy.
+        os.utime(self.incdir, (0, 0))
+        self.cache_path = os.path.join(self.tmpdir, 'cache.json')
+
+    def tearDown(self):
+        self._tempdir.cleanup()
+
+    def test_isfile(self):
+        cache = DirectoryCache()
+        with mock.patch('os.scandir', wraps=os.scandir) as mscandir:
+            self.assertTrue(cache.isfile(os.path.join(self.incdir,
+                                                      'foo.hpp')))
+            self.assertFalse(cache.isfile(os.path.join(self.incdir,
+                                                       'bar.hpp')))
+            self.assertFalse(cache.isfile(os.path.join(self.incdir,
+                                                       'subdir')))
+            self.assertFalse(cache.isfile(os.path.join(self.tmpdir, 'nonexist',
+                                                       'foo.hpp')))
+            self.assertEqual(mscandir.call_count, 1)
+
+    def test_isfile_path(self):
+        cache = DirectoryCache()
+        self.assertTrue(cache.isfile(Path('include/foo.hpp', 'srcdir'),
+                                     {'srcdir': self.tmpdir}))
+        self.assertFalse(cache.isfile(Path('include/bar.hpp', 'srcdir'),
+                                      {'srcdir': self.tmpdir}))
+
+    def test_save(self):
+        cache = DirectoryCache(self.cache_path)
+        self.assertTrue(cache.isfile(os.path.join(self.incdir, 'foo.hpp')))
+        cache.save()
+
+        cache = DirectoryCache(self.cache_path)
+        with mock.patch('os.scandir') as mscandir:
+            self.assertTrue(cache.isfile(os.path.join(self.incdir,
+                                                      'foo.hpp')))
+            mscandir.assert_not_called()
+
+    def test_save_racy(self):
+        os.utime(self.incdir)
+        cache = DirectoryCache(self.cache_path)
+        self.assertTrue(cache.isfile(os.path.join(self.incdir, 'foo.hpp')))
+        cache.save()
+
+        cache = DirectoryCache(self.cache_path)
+        with mock.patch('os.scandir', wraps=os.scandir) as mscandir:
+            self.assertTrue(cache.isfile(os.path.join(self.incdir,
+                                                      'foo.hpp')))
+            self.assertEqual(mscandir.call_count, 1)
+
+    def test_invalidate(self):
+        cache = DirectoryCache(self.cache_path)
+        self.assertFalse(cache.isfile(os.path.join(self.incdir, 'bar.hpp')))
+        cache.save()
+
+        open(os.path.join(self.incdir, 'bar.hpp'), 'w').close()
+        os.utime(self.incdir, (1, 1))
+        cache = DirectoryCache(self.cache_path)
+        self.assertTrue(cache.isfile(os.path.join(self.incdir, 'bar.hpp')))
+
+    def test_invalid_cache_file(self):
+        with open(self.cache_path, 'w') as f:
+            f.write('garbage')
+        cache = DirectoryCache(self.cache_path)
+        self.assertTrue(cache.isfile(os.path.join(self.incdir, 'foo.hpp')))
+
+
 class TestPath(TestCase):
     def test_construct(self):
         p = Path('foo', Path.Base.cfgdir)
@@ -1,8 +1,13 @@
+import os
+import subprocess
+import tempfile
 from io import StringIO
-from unittest import TestCase
+from unittest import mock, TestCase
 
+from mopack.metadata import Metadata
 from mopack.path import Path
-from mopack.pkg_config import write_pkg_config
+from mopack.pkg_config import (probe_versions, read_fingerprint,
+                               version_probe_key, write_pkg_config)
 from mopack.shell import ShellArguments
 
 
@@ -71,3 +76,73 @@ class TestWritePkgConfig(TestCase):
             write_pkg_config(out, 'mypackage', variables={'srcdir': 1})
         with self.assertRaises(TypeError):
             write_pkg_config(out, 'mypackage', cflags=1)
+
+
+class TestFingerprint(TestCase):
+    def test_fingerprint(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            path = os.path.join(tmpdir, 'mypackage.pc')
+            self.assertEqual(read_fingerprint(path), None)
+
+            with open(path, 'w') as f:
+                write_pkg_config(f, 'mypackage')
+            self.assertEqual(read_fingerprint(path), None)
+
+            with open(path, 'w') as f:
+                write_pkg_config(f, 'mypackage', fingerprint='0123abcd')
+            self.assertEqual(read_fingerprint(path), '0123abcd')
+
+
+class TestProbeVersions(TestCase):
+    env = {'PKG_CONFIG_PATH': '/path/to/pkgconfig'}
+
+    def mock_run(self, args, **kwargs):
+        if args[1] == '--list-all':
+            return subprocess.CompletedProcess(args, 0, 'foo  Foo\nbaz Baz\n')
+        versions = {'foo': '1.0', 'baz': '2.0'}
+        if all(i in versions for i in args[2:]):
+            return subprocess.CompletedProcess(
+                args, 0, ''.join(versions[i] + '\n' for i in args[2:])
+            )
+        return subprocess.CompletedProcess(args, 1, '')
+
+    def check_probes(self, metadata, versions):
+        self.assertEqual(metadata.version_probes, {
+            version_probe_key(self.env, k): v for k, v in versions.items()
+        })
+
+    def test_found(self):
+        metadata = Metadata('/path/to/mopack')
+        with mock.patch('subprocess.run', side_effect=self.mock_run) as mrun:
+            probe_versions(metadata, [(self.env, 'foo'), (self.env, 'baz'),
+                                      (self.env, 'foo'), (self.env, None)])
+            mrun.assert_called_once_with(
+                ['pkg-config', '--modversion', 'foo', 'baz'],
+                stdout=subprocess.PIPE, stderr=subprocess.DEVNULL,
+                universal_newlines=True, env=self.env
+            )
+        self.check_probes(metadata, {'foo': '1.0', 'baz': '2.0'})
+
+    def test_missing(self):
+        metadata = Metadata('/path/to/mopack')
+        with mock.patch('subprocess.run', side_effect=self.mock_run) as mrun:
+            probe_versions(metadata, [(self.env, 'foo'), (self.env, 'bar')])
+            self.assertEqual(mrun.call_count, 3)
+            mrun.assert_called_with(
+                ['pkg-config', '--modversion', 'foo'],
+                stdout=subprocess.PIPE, stderr=subprocess.DEVNULL,
+                universal_newlines=True, env=self.env
+            )
+        self.check_probes(metadata, {'foo': '1.0'})
+
+        metadata = Metadata('/path/to/mopack')
+        with mock.patch('subprocess.run', side_effect=self.mock_run) as mrun:
+            probe_versions(metadata, [(self.env, 'bar')])
+            self.assertEqual(mrun.call_count, 1)
+        self.check_probes(metadata, {})
+
+    def test_no_pkg_config(self):
+        metadata = Metadata('/path/to/mopack')
+        with mock.patch('subprocess.run', side_effect=OSError()):
+            probe_versions(metadata, [(self.env, 'foo'), (self.env, 'bar')])
+        self.check_probes(metadata, {})
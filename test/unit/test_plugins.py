@@ -0,0 +1,53 @@
+import subprocess
+import sys
+from unittest import mock, TestCase
+
+from mopack import plugins
+from mopack.plugins import *
+from mopack.sources.apt import AptPackage
+
+
+class TestLoadPlugin(TestCase):
+    def setUp(self):
+        plugins._entry_point_index.clear()
+
+    def tearDown(self):
+        plugins._entry_point_index.clear()
+
+    def test_builtin(self):
+        with mock.patch('mopack.plugins._find_entry_points') as mfind:
+            self.assertIs(load_plugin('mopack.sources', 'apt'), AptPackage)
+            mfind.assert_not_called()
+
+    def test_external(self):
+        with mock.patch('mopack.plugins._find_entry_points', return_value={
+            'foo': 'mopack.sources.apt:AptPackage',
+        }) as mfind:
+            self.assertIs(load_plugin('mopack.sources', 'foo'), AptPackage)
+            self.assertIs(load_plugin('mopack.sources', 'foo'), AptPackage)
+            mfind.assert_called_once_with('mopack.sources')
+
+    def test_unknown(self):
+        with mock.patch('mopack.plugins._find_entry_points',
+                        return_value={}) as mfind:
+            with self.assertRaises(ImportError):
+                load_plugin('mopack.sources', 'unknown')
+            with self.assertRaises(ImportError):
+                load_plugin('mopack.sources', 'unknown')
+            mfind.assert_called_once_with('mopack.sources')
+
+    def test_builtins_registered(self):
+        # Make sure our table of built-in plugins matches our entry points.
+        for group, names in builtin_plugins.items():
+            eps = plugins._find_entry_points(group)
+            for name, spec in names.items():
+                self.assertEqual(eps.get(name), spec)
+
+    def test_no_pkg_resources(self):
+        output = subprocess.run(
+            [sys.executable, '-c', 'import sys, mopack.driver; ' +
+             "print('pkg_resources' in sys.modules, " +
+             "'importlib.metadata' in sys.modules)"],
+            stdout=subprocess.PIPE, universal_newlines=True, check=True
+        ).stdout
+        self.assertEqual(output.strip(), 'False False')
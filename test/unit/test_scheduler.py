@@ -0,0 +1,70 @@
+import threading
+from unittest import TestCase
+
+from mopack.scheduler import Scheduler
+
+
+class TestScheduler(TestCase):
+    def test_invalid_jobs(self):
+        with self.assertRaises(ValueError):
+            Scheduler(0)
+
+    def test_inline(self):
+        s = Scheduler()
+        results = []
+        threads = []
+
+        def job(x):
+            threads.append(threading.current_thread())
+            return x * 2
+
+        for i in range(3):
+            s.submit(job, i, callback=results.append)
+        s.run()
+        self.assertEqual(results, [0, 2, 4])
+        self.assertEqual(threads, [threading.current_thread()] * 3)
+
+    def test_parallel(self):
+        s = Scheduler(4)
+        results = []
+        callback_threads = set()
+
+        def callback(x):
+            callback_threads.add(threading.current_thread())
+            results.append(x)
+
+        for i in range(8):
+            s.submit(lambda x: x * 2, i, callback=callback)
+        s.run()
+        self.assertEqual(sorted(results), [0, 2, 4, 6, 8, 10, 12, 14])
+        self.assertEqual(callback_threads, {threading.current_thread()})
+
+    def test_submit_from_callback(self):
+        for jobs in (1, 2):
+            s = Scheduler(jobs)
+            results = []
+
+            def callback(x):
+                results.append(x)
+                if x < 3:
+                    s.submit(lambda y: y + 1, x, callback=callback)
+
+            s.submit(lambda y: y, 0, callback=callback)
+            s.run()
+            self.assertEqual(results, [0, 1, 2, 3])
+
+    def test_failure(self):
+        for jobs in (1, 2):
+            s = Scheduler(jobs)
+            results = []
+            errors = []
+
+            def fail():
+                raise RuntimeError('failed')
+
+            s.submit(fail, errback=errors.append)
+            s.submit(lambda: 1, callback=results.append)
+            with self.assertRaises(RuntimeError):
+                s.run()
+            self.assertEqual(len(errors), 1)
+            self.assertFalse(s.failed)
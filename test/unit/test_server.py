@@ -0,0 +1,162 @@
+import os
+import socket
+import tempfile
+import threading
+from unittest import mock, skipIf, TestCase
+
+from mopack.config import Config
+from mopack.metadata import Metadata
+from mopack.server import *
+from mopack.sources.sdist import DirectoryPackage
+
+from . import mock_open_data
+
+
+def get_usage(package, metadata, submodules):
+    return {'name': package.name, 'submodules': submodules}
+
+
+class ServerTestCase(TestCase):
+    def setUp(self):
+        self._tempdir = tempfile.TemporaryDirectory()
+        self.pkgdir = os.path.join(self._tempdir.name, 'mopack')
+
+    def tearDown(self):
+        self._tempdir.cleanup()
+
+    def save_metadata(self, names=['foo']):
+        with mock.patch('builtins.open', mock_open_data('')):
+            cfg = Config(['mopack.yml'])
+
+        metadata = Metadata(self.pkgdir, cfg.options, ['mopack.yml'])
+        for i in names:
+            pkg = DirectoryPackage(
+                i, path='path', build='none', usage='pkg_config',
+                _options=cfg.options,
+                config_file=os.path.abspath('mopack.yml'),
+            )
+            pkg.resolved = True
+            metadata.add_package(pkg)
+        metadata.save()
+
+
+class TestServer(ServerTestCase):
+    def test_usage(self):
+        self.save_metadata()
+        server = Server(self.pkgdir)
+        with mock.patch.object(DirectoryPackage, 'get_usage',
+                               side_effect=get_usage,
+                               autospec=True) as mget:
+            self.assertEqual(server.handle({
+                'command': 'usage', 'dependency': 'foo[sub]',
+            }), {'result': {'name': 'foo', 'submodules': ['sub']}})
+            self.assertEqual(server.handle({
+                'command': 'usage', 'dependency': 'foo[sub]',
+            }), {'result': {'name': 'foo', 'submodules': ['sub']}})
+            mget.assert_called_once()
+
+    def test_reload(self):
+        self.save_metadata()
+        server = Server(self.pkgdir)
+        with mock.patch.object(Metadata, 'try_load',
+                               wraps=Metadata.try_load) as mload, \
+             mock.patch.object(DirectoryPackage, 'version',
+                               return_value=None):
+            self.assertEqual(server.handle({'command': 'list-files'}),
+                             {'result': ['mopack.yml']})
+            self.assertEqual(server.handle({'command': 'list-files'}),
+                             {'result': ['mopack.yml']})
+            self.assertEqual(mload.call_count, 1)
+
+            self.save_metadata(['foo', 'bar'])
+            self.assertEqual(server.handle({
+                'command': 'list-packages', 'flat': True
+            }), {'result': [
+                {'name': 'foo', 'source': 'directory', 'version': None,
+                 'children': []},
+                {'name': 'bar', 'source': 'directory', 'version': None,
+                 'children': []},
+            ]})
+            self.assertEqual(mload.call_count, 2)
+
+    def test_missing_metadata(self):
+        server = Server(self.pkgdir)
+        self.assertEqual(server.handle({'command': 'list-files'}),
+                         {'result': []})
+
+        server = Server(self.pkgdir, strict=True)
+        self.assertIn('error', server.handle({'command': 'list-files'}))
+
+    def test_invalid_request(self):
+        self.save_metadata()
+        server = Server(self.pkgdir)
+        self.assertEqual(server.handle([]),
+                         {'error': 'expected a request object'})
+        self.assertEqual(server.handle({}),
+                         {'error': "missing 'command' in request"})
+        self.assertEqual(server.handle({'command': 'usage'}),
+                         {'error': "missing 'dependency' in request"})
+        self.assertEqual(server.handle({'command': 'unknown'}),
+                         {'error': "unknown command 'unknown'"})
+
+
+@skipIf(not hasattr(socket, 'AF_UNIX'), 'Unix domain sockets unsupported')
+class TestServe(ServerTestCase):
+    def setUp(self):
+        super().setUp()
+        self.save_metadata()
+        self.path = default_socket_path(self.pkgdir)
+
+    def start(self):
+        server = make_server(self.pkgdir)
+        thread = threading.Thread(target=server.serve_forever)
+        thread.start()
+
+        def stop():
+            server.shutdown()
+            thread.join()
+            server.server_close()
+
+        self.addCleanup(stop)
+        return server
+
+    def test_query(self):
+        self.start()
+        with mock.patch.object(DirectoryPackage, 'get_usage',
+                               side_effect=get_usage, autospec=True):
+            self.assertEqual(query(self.path, {
+                'command': 'usage', 'dependency': 'foo',
+            }), {'name': 'foo', 'submodules': None})
+        self.assertEqual(query(self.path, {'command': 'list-files'}),
+                         ['mopack.yml'])
+        with self.assertRaises(ServerError):
+            query(self.path, {'command': 'unknown'})
+
+    def test_concurrent_clients(self):
+        self.start()
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as s:
+            # Keep one connection open while another client queries the
+            # server.
+            s.connect(self.path)
+            with s.makefile('rwb') as f:
+                f.write(b'{"command": "list-files"}\n')
+                f.flush()
+                self.assertEqual(f.readline(), b'{"result": ["mopack.yml"]}\n')
+
+                self.assertEqual(query(self.path, {'command': 'list-files'}),
+                                 ['mopack.yml'])
+
+    def test_already_running(self):
+        self.start()
+        with self.assertRaises(ServerError):
+            make_server(self.pkgdir)
+
+    def test_stale_socket(self):
+        s = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        s.bind(self.path)
+        s.close()
+        self.assertTrue(os.path.exists(self.path))
+
+        self.start()
+        self.assertEqual(query(self.path, {'command': 'list-files'}),
+                         ['mopack.yml'])
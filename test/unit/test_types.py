@@ -591,6 +591,20 @@ class TestUrl(TypeTestCase):
                 url('field', i)
 
 
+class TestSha256(TypeTestCase):
+    def test_valid(self):
+        digest = '0123456789abcdef' * 4
+        self.assertEqual(sha256('field', digest), digest)
+        self.assertEqual(sha256('field', digest.upper()), digest)
+
+    def test_invalid(self):
+        not_digests = ['0123', '0123456789abcdef' * 4 + '0',
+                       'g123456789abcdef' * 4]
+        for i in not_digests:
+            with self.assertFieldError(('field',)):
+                sha256('field', i)
+
+
 class TestDependency(TypeTestCase):
     def test_package(self):
         self.assertEqual(dependency('field', 'package'), ('package', None))
@@ -1,9 +1,10 @@
 import copy
+import json
 import re
 import yaml
 from io import StringIO
 from textwrap import dedent
-from unittest import mock, TestCase
+from unittest import mock, skipIf, TestCase
 from yaml.error import MarkedYAMLError
 
 from . import mock_open_data, through_json
@@ -482,6 +483,8 @@ class TestMarkedJSONEncoder(TestCase):
 
 
 class TestSafeLineLoader(TestCase):
+    Loader = SafeLineLoader
+
     def assertMark(self, mark_range, start, end):
         self.assertEqual([(i.line, i.column) for i in mark_range],
                          [start, end])
@@ -502,7 +505,7 @@ class TestSafeLineLoader(TestCase):
           zoo:
             panda: 3
             giraffe: 4
-        """), Loader=SafeLineLoader)
+        """), Loader=self.Loader)
 
         self.assertEqual(data, {'house': {'cat': 1, 'dog': 2},
                                 'zoo': {'panda': 3, 'giraffe': 4}})
@@ -537,7 +540,7 @@ class TestSafeLineLoader(TestCase):
             - A2
           - - B1
             - B2
-        """), Loader=SafeLineLoader)
+        """), Loader=self.Loader)
 
         self.assertEqual(data, [['A1', 'A2'], ['B1', 'B2']])
 
@@ -556,6 +559,61 @@ class TestSafeLineLoader(TestCase):
                              [[(2, 4), (2, 6)],
                               [(3, 4), (3, 6)]])
 
+    def test_make_parse_error(self):
+        data = StringIO(dedent("""\
+          house:
+            cat: "meow"
+            dog: woof
+        """))
+        cfg = yaml.load(data, Loader=self.Loader)
+        e = MarkedYAMLOffsetError('context', cfg['house'].mark, 'problem',
+                                  cfg['house'].value_marks['cat'], offset=2)
+        err = make_parse_error(e, data)
+        self.assertEqual((err.mark.line, err.mark.column), (1, 10))
+        self.assertEqual(err.snippet, '  cat: "meow"')
+
+
+@skipIf(CSafeLineLoader is None, 'libyaml unavailable')
+class TestCSafeLineLoader(TestSafeLineLoader):
+    Loader = CSafeLineLoader
+
+    def test_same_marks(self):
+        def dump(data):
+            if isinstance(data, MarkedDict):
+                return ([(k, list(data.marks[k]), list(data.value_marks[k]),
+                          dump(v)) for k, v in data.items()],
+                        list(data.mark))
+            elif isinstance(data, MarkedList):
+                return ([(list(m), dump(v))
+                         for v, m in zip(data, data.marks)],
+                        list(data.mark))
+            return data
+
+        data = dedent("""\
+          packages:
+            - name: "f\u00f6o"
+              flags: [-O2, '-DX=${{ x }}']
+              usage: &usage
+                type: pkg_config
+                path: |
+                  one
+                  two
+            - name: bar
+              usage: *usage
+          other: {a: 1, b: [true, null]}
+        """)
+        expected = yaml.load(data, Loader=SafeLineLoader)
+        actual = yaml.load(data, Loader=CSafeLineLoader)
+
+        def marks(data):
+            result = dump(data)
+            return json.loads(json.dumps(result, default=lambda m: [
+                m.name, m.index, m.line, m.column
+            ]))
+
+        self.assertEqual(actual, expected)
+        self.assertEqual(marks(actual), marks(expected))
+
 
 class TestGetOffsetMark(TestCase):
     def assertMark(self, mark, linecol, index):
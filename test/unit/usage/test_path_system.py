@@ -1,6 +1,7 @@
 import os
 import shutil
 import sys
+import tempfile
 import warnings
 from textwrap import dedent
 from unittest import mock
@@ -10,7 +11,8 @@ from ... import call_pkg_config, test_stage_dir
 
 from mopack.options import Options
 from mopack.metadata import Metadata
-from mopack.path import Path
+from mopack.path import DirectoryCache, Path
+from mopack.pkg_config import write_pkg_config
 from mopack.shell import ShellArguments
 from mopack.types import dependency_string, FieldValueError
 from mopack.usage import Usage
@@ -90,15 +92,18 @@ class TestPath(UsageTest):
         if pkg is None:
             pkg = MockPackage()
 
+        # Load the directory cache now so it doesn't try to use our mock open.
+        self.metadata.dir_cache
         with mock.patch('subprocess.run', side_effect=OSError()), \
              mock.patch('mopack.usage.path_system._system_include_path',
                         return_value=[Path('/mock/include')]), \
-             mock.patch('mopack.usage.path_system.isfile', mock_isfile), \
+             mock.patch.object(DirectoryCache, 'isfile',
+                               staticmethod(mock_isfile)), \
              mock.patch('builtins.open', **open_args):
             self.assertEqual(usage.version(self.metadata, pkg), expected)
 
     def check_get_usage(self, usage, name, submodules, expected=None, *,
-                        pkg=None, metadata=None, write_pkg_config=True):
+                        pkg=None, metadata=None, up_to_date=False):
         depname = dependency_string(name, submodules)
         if expected is None:
             expected = {'name': depname, 'type': self.type, 'generated': True,
@@ -111,19 +116,29 @@ class TestPath(UsageTest):
             metadata = self.metadata
 
         self.clear_pkgdir()
-
-        with mock.patch('mopack.usage.path_system.file_outdated',
-                        return_value=write_pkg_config), \
-             mock.patch('mopack.usage.path_system._system_include_path',
+        with mock.patch('mopack.usage.path_system._system_include_path',
                         return_value=[Path('/mock/include')]), \
              mock.patch('mopack.usage.path_system._system_lib_path',
                         return_value=[Path('/mock/lib')]), \
              mock.patch('mopack.usage.path_system._system_lib_names',
                         return_value=['lib{}.so']), \
-             mock.patch('mopack.usage.path_system.isfile',
-                        mock_isfile):
-            self.assertEqual(usage.get_usage(metadata, pkg, submodules),
-                             expected)
+             mock.patch.object(DirectoryCache, 'isfile',
+                               staticmethod(mock_isfile)):
+            if up_to_date:
+                # Generate the .pc files ahead of time so that they're up to
+                # date below.
+                metadata._reset_usages()
+                usage.get_usage(metadata, pkg, submodules)
+
+            # Each call should act like a separate invocation of `mopack
+            # usage`.
+            metadata._reset_usages()
+            with mock.patch('mopack.usage.path_system.write_pkg_config',
+                            wraps=write_pkg_config) as mwrite:
+                self.assertEqual(usage.get_usage(metadata, pkg, submodules),
+                                 expected)
+            if up_to_date:
+                mwrite.assert_not_called()
 
     def check_pkg_config(self, name, submodules, expected={}):
         pcname = dependency_string(name, submodules)
@@ -150,10 +165,121 @@ class TestPath(UsageTest):
     def test_pkg_config_up_to_date(self):
         usage = self.make_usage('foo')
         self.check_usage(usage)
-        self.check_get_usage(usage, 'foo', None, write_pkg_config=False)
-        self.assertFalse(os.path.exists(
-            os.path.join(self.pkgconfdir, 'foo.pc')
-        ))
+        self.check_get_usage(usage, 'foo', None, up_to_date=True)
+        self.check_pkg_config('foo', None)
+
+    def test_pkg_config_fingerprint(self):
+        pcpath = os.path.join(self.pkgconfdir, 'foo.pc')
+
+        def get_usage(usage, lib_names='lib{}.so'):
+            self.metadata._reset_usages()
+            with mock.patch('mopack.usage.path_system._system_lib_path',
+                            return_value=[Path('/mock/lib')]), \
+                 mock.patch.dict(os.environ,
+                                 {'MOPACK_LIB_NAMES': lib_names}), \
+                 mock.patch.object(DirectoryCache, 'isfile',
+                                   staticmethod(mock_isfile)), \
+                 mock.patch('mopack.usage.path_system.write_pkg_config',
+                            wraps=write_pkg_config) as mwrite:
+                usage.get_usage(self.metadata, MockPackage('foo'), None)
+                return mwrite.call_count
+
+        self.clear_pkgdir()
+        usage = self.make_usage('foo')
+        self.assertEqual(get_usage(usage), 1)
+        self.assertEqual(get_usage(usage), 0)
+        self.assertEqual(get_usage(self.make_usage('foo')), 0)
+        self.check_pkg_config('foo', None)
+
+        # Changing the environment should regenerate the .pc file...
+        self.assertEqual(get_usage(usage, '{}.lib'), 1)
+        self.assertEqual(get_usage(usage, '{}.lib'), 0)
+
+        # ... as should changing the usage's fields.
+        self.assertEqual(get_usage(self.make_usage(
+            'foo', compile_flags='-DFOO'
+        ), '{}.lib'), 1)
+        self.check_pkg_config('foo', None, {'cflags': ['-DFOO']})
+        with open(pcpath) as f:
+            self.assertIn('# mopack-fingerprint: ', f.read())
+
+    def test_pkg_config_fingerprint_guessed_version(self):
+        def get_usage(usage, pkg):
+            self.metadata._reset_usages()
+            with mock.patch('mopack.usage.path_system._system_lib_path',
+                            return_value=[Path('/mock/lib')]), \
+                 mock.patch('mopack.usage.path_system._system_lib_names',
+                            return_value=['lib{}.so']), \
+                 mock.patch.object(DirectoryCache, 'isfile',
+                                   staticmethod(mock_isfile)), \
+                 mock.patch.object(MockPackage, 'guessed_version',
+                                   side_effect=MockPackage.guessed_version,
+                                   autospec=True) as mversion, \
+                 mock.patch('mopack.usage.path_system.write_pkg_config',
+                            wraps=write_pkg_config) as mwrite:
+                usage.get_usage(self.metadata, pkg, None)
+                return mwrite.call_count, mversion.call_count
+
+        # We should only get the version when writing the .pc file.
+        usage = self.make_usage('foo')
+        self.assertEqual(get_usage(usage, MockPackage(version='1.0')), (1, 1))
+        self.assertEqual(get_usage(usage, MockPackage(version='1.0')), (0, 0))
+        self.check_pkg_config('foo', None, {'version': '1.0'})
+
+        self.assertEqual(get_usage(usage, MockPackage(version='2.0')), (1, 1))
+        self.check_pkg_config('foo', None, {'version': '2.0'})
+
+    def test_pkg_config_fingerprint_headers(self):
+        def write_header(path, version):
+            with open(os.path.join(path, 'foo.hpp'), 'w') as f:
+                f.write('#define VERSION "{}"\n'.format(version))
+
+        def get_usage(usage):
+            # Use new metadata each time, like a new invocation of `mopack
+            # usage` would.
+            with mock.patch('mopack.usage.path_system.write_pkg_config',
+                            wraps=write_pkg_config) as mwrite:
+                usage.get_usage(Metadata(self.pkgdir), MockPackage(), None)
+                return mwrite.call_count
+
+        with tempfile.TemporaryDirectory() as tmpdir:
+            incdirs = [os.path.join(tmpdir, i) for i in ('inc1', 'inc2')]
+            for i in incdirs:
+                os.mkdir(i)
+
+            usage = self.make_usage(
+                'foo', include_path=incdirs, headers=['foo.hpp'],
+                libraries=[], version={
+                    'type': 'regex',
+                    'file': 'foo.hpp',
+                    'regex': [r'#define VERSION "([\d\.]+)"'],
+                }
+            )
+
+            write_header(incdirs[0], '1.0')
+            self.assertEqual(get_usage(usage), 1)
+            self.assertEqual(get_usage(usage), 0)
+            self.check_pkg_config('foo', None, {
+                'version': '1.0', 'cflags': ['-I' + incdirs[0]], 'libs': [],
+            })
+
+            # Changing the header that the version comes from should
+            # regenerate the .pc file...
+            write_header(incdirs[0], '1.10')
+            self.assertEqual(get_usage(usage), 1)
+            self.assertEqual(get_usage(usage), 0)
+            self.check_pkg_config('foo', None, {
+                'version': '1.10', 'cflags': ['-I' + incdirs[0]], 'libs': [],
+            })
+
+            # ... as should moving the header somewhere else.
+            os.rename(os.path.join(incdirs[0], 'foo.hpp'),
+                      os.path.join(incdirs[1], 'foo.hpp'))
+            self.assertEqual(get_usage(usage), 1)
+            self.assertEqual(get_usage(usage), 0)
+            self.check_pkg_config('foo', None, {
+                'version': '1.10', 'cflags': ['-I' + incdirs[1]], 'libs': [],
+            })
 
     def test_auto_link(self):
         pkg = MockPackage(srcdir=self.srcdir, builddir=self.builddir)